@@ -1,12 +1,21 @@
-import google.generativeai as genai
 from config import LLM_API_KEY, LLM_MODEL_NAME
+from tools.structured_output import parse_json
 import json
 
-genai.configure(api_key=LLM_API_KEY)
+_genai = None
+
+def _load_genai():
+    # google.generativeai is slow to import and only needed once a synthesizer is built
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=LLM_API_KEY)
+        _genai = genai
+    return _genai
 
 class DecisionSynthesizerAgent:
     def __init__(self):
-        self.model = genai.GenerativeModel(LLM_MODEL_NAME)
+        self.model = _load_genai().GenerativeModel(LLM_MODEL_NAME)
     
     def synthesize(self, agent_outputs: list) -> dict:
         prompt = f"""
@@ -45,7 +54,7 @@ Return only JSON, no markdown or explanation.
         
         try:
             response = self.model.generate_content(prompt)
-            result = json.loads(response.text.strip().replace('```json', '').replace('```', ''))
+            result = parse_json(response.text)
             return result
         except Exception as e:
             severity_order = {'CRITICAL': 3, 'HIGH': 2, 'MEDIUM': 1}
@@ -1,20 +1,54 @@
-from openai import OpenAI
-from config import LLM_MODEL_NAME, LLM_CLIENT, DEMAND_FORECAST_WEEKS
+from config import LLM_MODEL_NAME, DEMAND_FORECAST_WEEKS
 from tools.sql_executor import run_sql_query
+from tools.llm_gateway import LLMUnavailableError
+from tools.structured_output import structured_completion, decision_schema
 from tools.dynamic_schema import get_dynamic_schema, find_column
+from tools.telemetry import span
+from tools.prompts import agent_messages
+from tools.batch_query import run_keyed_query, key_match, to_number
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = f"""You are a demand forecasting agent.
+
+Task: Analyze enrollment velocity and project supply shortfall risk.
+
+Rules:
+- CRITICAL if weeks_of_cover < 2
+- HIGH if weeks_of_cover < 4
+- MEDIUM if weeks_of_cover < {DEMAND_FORECAST_WEEKS}
+
+The records to analyze are in the user message under "Data".
+
+Return ONLY a JSON object with this exact structure:
+{{
+    "decision": "YES or NO",
+    "severity": "CRITICAL or HIGH or MEDIUM",
+    "risk_type": "SHORTFALL",
+    "weeks_of_cover": number or null,
+    "reasoning": {{
+        "technical": "detailed analysis of demand vs supply",
+        "regulatory": "N/A or relevant info",
+        "logistical": "impact on distribution"
+    }},
+    "recommended_action": "specific action to take"
+}}
+
+Return only JSON, no markdown or explanation."""
 
 class DemandAgent:
     def __init__(self):
-        self.client = LLM_CLIENT
         self.model_name = LLM_MODEL_NAME
+        self.result_set = None
         self.allowed_tables = [
             'enrollment_rate_report',
             'country_level_enrollment_report',
             'available_inventory_report'
         ]
     
-    def work(self, query: str, entities: dict) -> dict:
+    def work(self, query: str, entities: dict, rows: list = None) -> dict:
         trial_id = entities.get('trial_id')
         country = entities.get('country')
         
@@ -39,18 +73,18 @@ class DemandAgent:
         enroll_table = enroll_schema['table_name']
         
         # Find columns dynamically
-        print(f"[DEMAND] Available columns in {enroll_table}: {enroll_schema['columns']}")
+        logger.debug("Available columns in %s: %s", enroll_table, enroll_schema['columns'])
         
         country_col = find_column(enroll_table, ['country', 'location', 'region', 'site'])
         trial_col = find_column(enroll_table, ['trial', 'study', 'trial_id', 'study_id'])
         rate_col = find_column(enroll_table, ['enrollment_rate', 'rate', 'enrollment', 'enrolled', 'patients'])
         date_col = find_column(enroll_table, ['report_date', 'date', 'timestamp', 'time', 'week', 'month'])
         
-        print(f"[DEMAND] Found columns - Country: {country_col}, Trial: {trial_col}, Rate: {rate_col}, Date: {date_col}")
+        logger.debug("Found columns - Country: %s, Trial: %s, Rate: %s, Date: %s", country_col, trial_col, rate_col, date_col)
         
         # If rate column not found, we can't do proper demand forecasting
         if not rate_col:
-            print(f"[DEMAND] WARNING: No enrollment rate column found. Cannot calculate demand forecast.")
+            logger.warning("No enrollment rate column found. Cannot calculate demand forecast.")
             return {
                 'decision': 'NO',
                 'severity': 'MEDIUM',
@@ -155,7 +189,7 @@ class DemandAgent:
         """
         
         try:
-            data = run_sql_query(sql_query)
+            data = rows if rows is not None else run_sql_query(sql_query)
         except Exception as e:
             return {
                 'decision': 'NO',
@@ -172,52 +206,29 @@ class DemandAgent:
                 'uncertainty': 'Unable to fetch demand data'
             }
         
-        prompt = f"""
-You are a demand forecasting agent.
-
-Task: Analyze enrollment velocity and project supply shortfall risk.
-
-Rules:
-- CRITICAL if weeks_of_cover < 2
-- HIGH if weeks_of_cover < 4
-- MEDIUM if weeks_of_cover < {DEMAND_FORECAST_WEEKS}
-
-Data:
-{json.dumps(data, indent=2)}
-
-Return ONLY a JSON object with this exact structure:
-{{
-    "decision": "YES or NO",
-    "severity": "CRITICAL or HIGH or MEDIUM",
-    "risk_type": "SHORTFALL",
-    "weeks_of_cover": number or null,
-    "reasoning": {{
-        "technical": "detailed analysis of demand vs supply",
-        "regulatory": "N/A or relevant info",
-        "logistical": "impact on distribution"
-    }},
-    "source_tables": {json.dumps(self.allowed_tables)},
-    "recommended_action": "specific action to take"
-}}
-
-Return only JSON, no markdown or explanation.
-"""
+        self.result_set = {'rows': data, 'columns': {'trial_id': 'trial_id', 'country': 'country'}, 'complete': True}
+        
+        with span('prompt_building', rows=len(data)):
+            messages = agent_messages(SYSTEM_PROMPT, data)
         
         try:
-            print(f"[DEMAND] Sending query to LLM for analysis...")
-            response = self.client.chat.completions.create(
+            logger.debug("Sending query to LLM for analysis...")
+            result = structured_completion(
+                messages,
+                decision_schema('SHORTFALL', weeks_of_cover=True),
+                name='shortfall_decision',
                 model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1000
+                task='decision'
             )
-            print(f"[DEMAND] LLM response received")
+            logger.debug("LLM response received")
             
-            response_text = response.choices[0].message.content.strip().replace('```json', '').replace('```', '')
-            print(f"[DEMAND] Raw response: {response_text[:200]}...")
-            
-            result = json.loads(response_text)
-            print(f"[DEMAND] Parsed JSON successfully")
-            print(f"[DEMAND] Decision: {result.get('decision')} | Severity: {result.get('severity')} | Weeks of Cover: {result.get('weeks_of_cover')}")
+            result['source_tables'] = self.allowed_tables
+            logger.info("Decision: %s | Severity: %s | Weeks of Cover: %s", result.get('decision'), result.get('severity'), result.get('weeks_of_cover'))
+            return result
+        except LLMUnavailableError as e:
+            logger.warning("LLM unavailable, using rule-based assessment: %s", e)
+            result = self.evaluate(data)
+            result['uncertainty'] = f'Rule-based assessment, LLM unavailable: {str(e)}'
             return result
         except Exception as e:
             return {
@@ -234,3 +245,141 @@ Return only JSON, no markdown or explanation.
                 'recommended_action': 'Manual review required',
                 'uncertainty': 'Unable to process demand data'
             }
+    
+    def work_batch(self, entity_sets: list) -> list:
+        enroll_schema = get_dynamic_schema('enrollment_rate_report')
+        inv_schema = get_dynamic_schema('available_inventory_report')
+        if not enroll_schema['exists'] or not inv_schema['exists']:
+            return [self._error_response('enrollment_rate_report or available_inventory_report table not found') for _ in entity_sets]
+        
+        enroll_table = enroll_schema['table_name']
+        inv_table = inv_schema['table_name']
+        
+        country_col = find_column(enroll_table, ['country', 'location', 'region', 'site'])
+        trial_col = find_column(enroll_table, ['trial', 'study', 'trial_id', 'study_id'])
+        rate_col = find_column(enroll_table, ['enrollment_rate', 'rate', 'enrollment', 'enrolled', 'patients'])
+        date_col = find_column(enroll_table, ['report_date', 'date', 'timestamp', 'time', 'week', 'month'])
+        inv_country_col = find_column(inv_table, ['country', 'location', 'region'])
+        inv_trial_col = find_column(inv_table, ['trial', 'study', 'trial_id'])
+        qty_col = find_column(inv_table, ['available_quantity', 'quantity', 'qty', 'available'])
+        
+        if not all([country_col, trial_col, rate_col, date_col, inv_country_col, inv_trial_col]):
+            return [self._error_response('Required enrollment or inventory columns not found') for _ in entity_sets]
+        
+        total_expr = f'SUM("{qty_col}")' if qty_col else '0'
+        
+        def build_query(keys_cte: str) -> str:
+            return f"""
+            WITH {keys_cte},
+            weekly_demand AS (
+                SELECT
+                    k.key_idx,
+                    e."{country_col}" AS country,
+                    e."{trial_col}" AS trial_id,
+                    AVG(e."{rate_col}") * 7 AS weekly_consumption
+                FROM keys k
+                JOIN {enroll_table} e
+                    ON {key_match(f'e."{trial_col}"', 'trial_id')}
+                    AND {key_match(f'e."{country_col}"', 'country')}
+                WHERE e."{date_col}"::date >= CURRENT_DATE - INTERVAL '28 days'
+                GROUP BY k.key_idx, e."{country_col}", e."{trial_col}"
+            ),
+            available_stock AS (
+                SELECT
+                    "{inv_country_col}" AS country,
+                    "{inv_trial_col}" AS trial_id,
+                    {total_expr} AS total_inventory
+                FROM {inv_table}
+                GROUP BY "{inv_country_col}", "{inv_trial_col}"
+            )
+            SELECT
+                d.key_idx,
+                d.country,
+                d.trial_id,
+                COALESCE(a.total_inventory, 0) AS total_inventory,
+                d.weekly_consumption,
+                CASE
+                    WHEN d.weekly_consumption > 0 THEN
+                        COALESCE(a.total_inventory, 0) / d.weekly_consumption
+                    ELSE NULL
+                END AS weeks_of_cover
+            FROM weekly_demand d
+            LEFT JOIN available_stock a
+            ON d.country = a.country AND d.trial_id = a.trial_id
+            WHERE COALESCE(a.total_inventory, 0) / NULLIF(d.weekly_consumption, 0) <= {DEMAND_FORECAST_WEEKS}
+            """
+        
+        try:
+            groups = run_keyed_query(entity_sets, ['trial_id', 'country'], build_query)
+        except Exception as e:
+            return [self._error_response(f'SQL execution failed: {str(e)}') for _ in entity_sets]
+        
+        logger.info("Batch evaluated %s entity sets in one pass", len(entity_sets))
+        return [self.evaluate(rows) for rows in groups]
+    
+    def evaluate(self, data: list) -> dict:
+        covers = [
+            (cover, row) for cover, row in ((to_number(row.get('weeks_of_cover')), row) for row in data)
+            if cover is not None
+        ]
+        
+        if not covers:
+            return {
+                'decision': 'NO',
+                'severity': 'MEDIUM',
+                'risk_type': 'SHORTFALL',
+                'weeks_of_cover': None,
+                'reasoning': {
+                    'technical': f'No trial/country combination has less than {DEMAND_FORECAST_WEEKS} weeks of cover',
+                    'regulatory': 'N/A',
+                    'logistical': 'N/A'
+                },
+                'source_tables': self.allowed_tables,
+                'recommended_action': 'No action required'
+            }
+        
+        weeks_of_cover, worst = min(covers, key=lambda item: item[0])
+        if weeks_of_cover < 2:
+            severity = 'CRITICAL'
+            action = 'Expedite resupply immediately'
+        elif weeks_of_cover < 4:
+            severity = 'HIGH'
+            action = 'Schedule resupply within the next two weeks'
+        else:
+            severity = 'MEDIUM'
+            action = 'Include in the next planned resupply'
+        
+        return {
+            'decision': 'YES',
+            'severity': severity,
+            'risk_type': 'SHORTFALL',
+            'weeks_of_cover': round(weeks_of_cover, 2),
+            'reasoning': {
+                'technical': (
+                    f'{len(covers)} trial/country combination(s) below {DEMAND_FORECAST_WEEKS} weeks of cover; '
+                    f'lowest is {worst.get("trial_id")} in {worst.get("country")} with {weeks_of_cover:.1f} weeks '
+                    f'({to_number(worst.get("total_inventory")) or 0:g} units at '
+                    f'{to_number(worst.get("weekly_consumption")) or 0:.1f} per week)'
+                ),
+                'regulatory': 'N/A',
+                'logistical': f'Resupply must arrive within {weeks_of_cover:.1f} weeks'
+            },
+            'source_tables': self.allowed_tables,
+            'recommended_action': action
+        }
+    
+    def _error_response(self, error_msg: str) -> dict:
+        return {
+            'decision': 'NO',
+            'severity': 'MEDIUM',
+            'risk_type': 'SHORTFALL',
+            'weeks_of_cover': None,
+            'reasoning': {
+                'technical': error_msg,
+                'regulatory': 'N/A',
+                'logistical': 'N/A'
+            },
+            'source_tables': self.allowed_tables,
+            'recommended_action': 'Check database schema',
+            'uncertainty': 'Unable to fetch demand data'
+        }
@@ -1,20 +1,54 @@
-from openai import OpenAI
-from config import LLM_MODEL_NAME, LLM_CLIENT, EXPIRY_WARNING_DAYS, CRITICAL_EXPIRY, HIGH_EXPIRY
+from config import LLM_MODEL_NAME, EXPIRY_WARNING_DAYS, CRITICAL_EXPIRY, HIGH_EXPIRY
 from tools.sql_executor import run_sql_query
+from tools.llm_gateway import LLMUnavailableError
+from tools.structured_output import structured_completion, decision_schema
 from tools.dynamic_schema import get_dynamic_schema, find_column
+from tools.telemetry import span
+from tools.prompts import agent_messages
+from tools.batch_query import run_keyed_query, key_match, to_date, to_number
 import json
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = f"""You are an inventory analysis agent.
+
+Task: Analyze the following inventory data and classify expiry risk.
+
+Rules:
+- CRITICAL if expiry <= {CRITICAL_EXPIRY} days
+- HIGH if expiry <= {HIGH_EXPIRY} days
+- MEDIUM if expiry <= {EXPIRY_WARNING_DAYS} days
+
+The records to analyze are in the user message under "Data".
+
+Return ONLY a JSON object with this exact structure:
+{{
+    "decision": "YES or NO",
+    "severity": "CRITICAL or HIGH or MEDIUM",
+    "risk_type": "EXPIRY",
+    "weeks_of_cover": null,
+    "reasoning": {{
+        "technical": "detailed analysis",
+        "regulatory": "N/A or relevant info",
+        "logistical": "N/A or relevant info"
+    }},
+    "recommended_action": "specific action to take"
+}}
+
+Return only JSON, no markdown or explanation."""
 
 class InventoryAgent:
     def __init__(self):
-        self.client = LLM_CLIENT
         self.model_name = LLM_MODEL_NAME
+        self.result_set = None
         self.allowed_tables = [
             'affiliate_warehouse_inventory',
             'available_inventory_report'
         ]
     
-    def work(self, query: str, entities: dict) -> dict:
+    def work(self, query: str, entities: dict, rows: list = None) -> dict:
         trial_id = entities.get('trial_id')
         country = entities.get('country')
         
@@ -25,32 +59,20 @@ class InventoryAgent:
         
         table_name = schema['table_name']
         
-        lot_col = find_column(table_name, ['lot', 'batch'])
-        expiry_col = find_column(table_name, ['expiry', 'expiration'])
-        trial_col = find_column(table_name, ['trial', 'study'])
-        location_col = find_column(table_name, ['location', 'country', 'site'])
-        qty_col = find_column(table_name, ['qty', 'quantity', 'initial'])
-        
-        if not all([lot_col, expiry_col]):
+        columns = self._resolve_columns(table_name)
+        if columns is None:
             return self._error_response('Required columns not found in table')
         
         sql_query = f"""
-        SELECT 
-            "{lot_col}" as batch_id,
-            "{expiry_col}" as expiry_date"""
-        
-        if trial_col:
-            sql_query += f',\n            "{trial_col}" as trial_id'
-        if location_col:
-            sql_query += f',\n            "{location_col}" as country'
-        if qty_col:
-            sql_query += f',\n            "{qty_col}" as available_quantity'
-        
-        sql_query += f"""
+        SELECT {self._select_list(columns)}
         FROM {table_name}
         WHERE 1=1
         """
         
+        trial_col = columns['trial']
+        location_col = columns['location']
+        expiry_col = columns['expiry']
+        
         if trial_id and trial_col:
             sql_query += f" AND \"{trial_col}\" ILIKE '%{trial_id}%'"
         if country and location_col:
@@ -59,61 +81,150 @@ class InventoryAgent:
         sql_query += f" AND \"{expiry_col}\"::date <= CURRENT_DATE + INTERVAL '{EXPIRY_WARNING_DAYS} days'"
         
         try:
-            data = run_sql_query(sql_query)
+            data = rows if rows is not None else run_sql_query(sql_query)
         except Exception as e:
             return self._error_response(f'SQL execution failed: {str(e)}')
         
-        prompt = f"""
-You are an inventory analysis agent.
-
-Task: Analyze the following inventory data and classify expiry risk.
-
-Rules:
-- CRITICAL if expiry <= {CRITICAL_EXPIRY} days
-- HIGH if expiry <= {HIGH_EXPIRY} days
-- MEDIUM if expiry <= {EXPIRY_WARNING_DAYS} days
-
-Data:
-{json.dumps(data, indent=2)}
-
-Return ONLY a JSON object with this exact structure:
-{{
-    "decision": "YES or NO",
-    "severity": "CRITICAL or HIGH or MEDIUM",
-    "risk_type": "EXPIRY",
-    "weeks_of_cover": null,
-    "reasoning": {{
-        "technical": "detailed analysis",
-        "regulatory": "N/A or relevant info",
-        "logistical": "N/A or relevant info"
-    }},
-    "source_tables": {json.dumps(self.allowed_tables)},
-    "recommended_action": "specific action to take"
-}}
-
-Return only JSON, no markdown or explanation.
-"""
+        self.result_set = {'rows': data, 'columns': {'trial_id': 'trial_id' if trial_col else None, 'country': 'country' if location_col else None}, 'complete': True}
+        
+        with span('prompt_building', rows=len(data)):
+            messages = agent_messages(SYSTEM_PROMPT, data)
         
         try:
-            print(f"[INVENTORY] Sending {len(data)} records to LLM for analysis...")
-            response = self.client.chat.completions.create(
+            logger.debug("Sending %s records to LLM for analysis...", len(data))
+            result = structured_completion(
+                messages,
+                decision_schema('EXPIRY'),
+                name='expiry_decision',
                 model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1000
+                task='decision'
             )
-            print(f"[INVENTORY] LLM response received")
-            
-            response_text = response.choices[0].message.content.strip().replace('```json', '').replace('```', '')
-            print(f"[INVENTORY] Raw response: {response_text[:200]}...")
+            logger.debug("LLM response received")
             
-            result = json.loads(response_text)
-            print(f"[INVENTORY] Parsed JSON successfully")
-            print(f"[INVENTORY] Decision: {result.get('decision')} | Severity: {result.get('severity')}")
+            result['source_tables'] = self.allowed_tables
+            logger.info("Decision: %s | Severity: %s", result.get('decision'), result.get('severity'))
+            return result
+        except LLMUnavailableError as e:
+            logger.warning("LLM unavailable, using rule-based assessment: %s", e)
+            result = self.evaluate(data)
+            result['uncertainty'] = f'Rule-based assessment, LLM unavailable: {str(e)}'
             return result
         except Exception as e:
-            print(f"[INVENTORY] ERROR: {str(e)}")
+            logger.error("LLM processing failed: %s", e)
             return self._error_response(f'LLM processing failed: {str(e)}')
     
+    def work_batch(self, entity_sets: list) -> list:
+        schema = get_dynamic_schema('available_inventory_report')
+        if not schema['exists']:
+            return [self._error_response('Table available_inventory_report not found') for _ in entity_sets]
+        
+        table_name = schema['table_name']
+        columns = self._resolve_columns(table_name)
+        if columns is None:
+            return [self._error_response('Required columns not found in table') for _ in entity_sets]
+        
+        filters = []
+        if columns['trial']:
+            filters.append(key_match(f't."{columns["trial"]}"', 'trial_id'))
+        if columns['location']:
+            filters.append(key_match(f't."{columns["location"]}"', 'country'))
+        
+        def build_query(keys_cte: str) -> str:
+            return f"""
+            WITH {keys_cte}
+            SELECT k.key_idx, {self._select_list(columns, 't.')}
+            FROM keys k
+            JOIN {table_name} t ON {' AND '.join(filters) or 'TRUE'}
+            WHERE t."{columns['expiry']}"::date <= CURRENT_DATE + INTERVAL '{EXPIRY_WARNING_DAYS} days'
+            """
+        
+        try:
+            groups = run_keyed_query(entity_sets, ['trial_id', 'country'], build_query)
+        except Exception as e:
+            return [self._error_response(f'SQL execution failed: {str(e)}') for _ in entity_sets]
+        
+        logger.info("Batch evaluated %s entity sets in one pass", len(entity_sets))
+        return [self.evaluate(rows) for rows in groups]
+    
+    def evaluate(self, data: list) -> dict:
+        today = date.today()
+        days_left = [
+            (expiry - today).days
+            for expiry in (to_date(row.get('expiry_date')) for row in data)
+            if expiry is not None
+        ]
+        
+        if not days_left:
+            return {
+                'decision': 'NO',
+                'severity': 'MEDIUM',
+                'risk_type': 'EXPIRY',
+                'weeks_of_cover': None,
+                'reasoning': {
+                    'technical': f'No lots expire within {EXPIRY_WARNING_DAYS} days',
+                    'regulatory': 'N/A',
+                    'logistical': 'N/A'
+                },
+                'source_tables': self.allowed_tables,
+                'recommended_action': 'No action required'
+            }
+        
+        earliest = min(days_left)
+        if earliest <= CRITICAL_EXPIRY:
+            severity = 'CRITICAL'
+            action = f'Use or redistribute lots expiring within {CRITICAL_EXPIRY} days immediately'
+        elif earliest <= HIGH_EXPIRY:
+            severity = 'HIGH'
+            action = f'Prioritise allocation of lots expiring within {HIGH_EXPIRY} days'
+        else:
+            severity = 'MEDIUM'
+            action = 'Monitor expiring lots and plan consumption'
+        
+        critical_lots = sum(1 for days in days_left if days <= CRITICAL_EXPIRY)
+        quantity = sum(to_number(row.get('available_quantity')) or 0 for row in data)
+        
+        return {
+            'decision': 'YES',
+            'severity': severity,
+            'risk_type': 'EXPIRY',
+            'weeks_of_cover': None,
+            'reasoning': {
+                'technical': (
+                    f'{len(data)} lot(s) expire within {EXPIRY_WARNING_DAYS} days; earliest in {earliest} days, '
+                    f'{critical_lots} within {CRITICAL_EXPIRY} days, total quantity {quantity:g}'
+                ),
+                'regulatory': 'N/A',
+                'logistical': 'N/A'
+            },
+            'source_tables': self.allowed_tables,
+            'recommended_action': action
+        }
+    
+    def _resolve_columns(self, table_name: str):
+        columns = {
+            'lot': find_column(table_name, ['lot', 'batch']),
+            'expiry': find_column(table_name, ['expiry', 'expiration']),
+            'trial': find_column(table_name, ['trial', 'study']),
+            'location': find_column(table_name, ['location', 'country', 'site']),
+            'qty': find_column(table_name, ['qty', 'quantity', 'initial'])
+        }
+        if not all([columns['lot'], columns['expiry']]):
+            return None
+        return columns
+    
+    def _select_list(self, columns: dict, prefix: str = '') -> str:
+        select = [
+            f'{prefix}"{columns["lot"]}" as batch_id',
+            f'{prefix}"{columns["expiry"]}" as expiry_date'
+        ]
+        if columns['trial']:
+            select.append(f'{prefix}"{columns["trial"]}" as trial_id')
+        if columns['location']:
+            select.append(f'{prefix}"{columns["location"]}" as country')
+        if columns['qty']:
+            select.append(f'{prefix}"{columns["qty"]}" as available_quantity')
+        return ',\n            '.join(select)
+    
     def _error_response(self, error_msg: str) -> dict:
         return {
             'decision': 'NO',
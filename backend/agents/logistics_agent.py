@@ -1,21 +1,63 @@
-from openai import OpenAI
-from config import LLM_MODEL_NAME, LLM_CLIENT
+from config import LLM_MODEL_NAME, LANE_INDEX_ENABLED
 from tools.sql_executor import run_sql_query
+from tools.llm_gateway import LLMUnavailableError
+from tools.structured_output import structured_completion, decision_schema
 from tools.dynamic_schema import get_dynamic_schema, find_column
+from tools.telemetry import span
+from tools.prompts import agent_messages
+from tools.batch_query import run_keyed_query, key_match, to_number
+from tools import lane_index
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+ROW_LIMIT = 50
+
+SYSTEM_PROMPT = """You are a logistics analysis agent.
+
+Task: Analyze shipping timelines and lead time feasibility.
+
+Rules:
+- CRITICAL if lead_time > 30 days
+- HIGH if lead_time > 21 days
+- MEDIUM if lead_time > 14 days
+
+The records to analyze are in the user message under "Data".
+
+Return ONLY a JSON object with this exact structure:
+{
+    "decision": "YES or NO",
+    "severity": "CRITICAL or HIGH or MEDIUM",
+    "risk_type": "LOGISTICS",
+    "weeks_of_cover": null,
+    "reasoning": {
+        "technical": "N/A or relevant info",
+        "regulatory": "N/A or relevant info",
+        "logistical": "detailed analysis of shipping timelines"
+    },
+    "recommended_action": "specific action to take"
+}
+
+Return only JSON, no markdown or explanation."""
 
 class LogisticsAgent:
     def __init__(self):
-        self.client = LLM_CLIENT
         self.model_name = LLM_MODEL_NAME
+        self.result_set = None
         self.allowed_tables = [
             'distribution_order_report',
             'ip_shipping_timelines_report'
         ]
     
-    def work(self, query: str, entities: dict) -> dict:
+    def work(self, query: str, entities: dict, rows: list = None) -> dict:
         country = entities.get('country')
         
+        if country and rows is None:
+            decision = self.check_lanes(country)
+            if decision is not None:
+                return decision
+        
         schema = get_dynamic_schema('ip_shipping_timelines_report')
         
         if not schema['exists']:
@@ -29,10 +71,10 @@ class LogisticsAgent:
         if country and dest_col:
             sql_query += f' AND "{dest_col}" ILIKE \'%{country}%\''
         
-        sql_query += ' LIMIT 50'
+        sql_query += f' LIMIT {ROW_LIMIT}'
         
         try:
-            data = run_sql_query(sql_query)
+            data = rows if rows is not None else run_sql_query(sql_query, cache=True)
         except Exception as e:
             return {
                 'decision': 'NO',
@@ -49,52 +91,29 @@ class LogisticsAgent:
                 'uncertainty': 'Unable to fetch logistics data'
             }
         
-        prompt = f"""
-You are a logistics analysis agent.
-
-Task: Analyze shipping timelines and lead time feasibility.
-
-Rules:
-- CRITICAL if lead_time > 30 days
-- HIGH if lead_time > 21 days
-- MEDIUM if lead_time > 14 days
-
-Data:
-{json.dumps(data, indent=2)}
-
-Return ONLY a JSON object with this exact structure:
-{{
-    "decision": "YES or NO",
-    "severity": "CRITICAL or HIGH or MEDIUM",
-    "risk_type": "LOGISTICS",
-    "weeks_of_cover": null,
-    "reasoning": {{
-        "technical": "N/A or relevant info",
-        "regulatory": "N/A or relevant info",
-        "logistical": "detailed analysis of shipping timelines"
-    }},
-    "source_tables": {json.dumps(self.allowed_tables)},
-    "recommended_action": "specific action to take"
-}}
-
-Return only JSON, no markdown or explanation.
-"""
+        self.result_set = {'rows': data, 'columns': {'country': dest_col}, 'complete': len(data) < ROW_LIMIT}
+        
+        with span('prompt_building', rows=len(data)):
+            messages = agent_messages(SYSTEM_PROMPT, data)
         
         try:
-            print(f"[LOGISTICS] Sending {len(data)} records to LLM for analysis...")
-            response = self.client.chat.completions.create(
+            logger.debug("Sending %s records to LLM for analysis...", len(data))
+            result = structured_completion(
+                messages,
+                decision_schema('LOGISTICS'),
+                name='logistics_decision',
                 model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1000
+                task='decision'
             )
-            print(f"[LOGISTICS] LLM response received")
+            logger.debug("LLM response received")
             
-            response_text = response.choices[0].message.content.strip().replace('```json', '').replace('```', '')
-            print(f"[LOGISTICS] Raw response: {response_text[:200]}...")
-            
-            result = json.loads(response_text)
-            print(f"[LOGISTICS] Parsed JSON successfully")
-            print(f"[LOGISTICS] Decision: {result.get('decision')} | Severity: {result.get('severity')}")
+            result['source_tables'] = self.allowed_tables
+            logger.info("Decision: %s | Severity: %s", result.get('decision'), result.get('severity'))
+            return result
+        except LLMUnavailableError as e:
+            logger.warning("LLM unavailable, using rule-based assessment: %s", e)
+            result = self.evaluate(data, lane_index.lead_time_column(table_name))
+            result['uncertainty'] = f'Rule-based assessment, LLM unavailable: {str(e)}'
             return result
         except Exception as e:
             return {
@@ -112,6 +131,140 @@ Return only JSON, no markdown or explanation.
                 'uncertainty': 'Unable to process logistics data'
             }
     
+    def check_lanes(self, country: str) -> dict:
+        """Answer from the lane lead-time index; None when disabled, unavailable or no lane reaches `country`."""
+        if not LANE_INDEX_ENABLED:
+            return None
+        try:
+            summary = lane_index.destination_summary(country)
+            route = lane_index.best_route(country) if summary else None
+        except Exception as e:
+            logger.warning("Lane index unavailable, reading shipping rows: %s", e)
+            return None
+        if summary is None:
+            return None
+        
+        # Keyed on the country so a session never reuses this answer for another destination
+        self.result_set = {'rows': [], 'columns': {'country': 'destination'}, 'complete': False}
+        return self.from_lanes(summary, route)
+    
+    def from_lanes(self, summary: dict, route: dict = None) -> dict:
+        # The fastest route is what would be used; fall back to the destination-wide p90 without one
+        p90 = route['p90_days'] if route else summary['p90_days']
+        result = self._decision(p90)
+        
+        logistical = (
+            f"{summary['shipments']} shipments; lead time median {summary['p50_days']:g} days, "
+            f"p90 {summary['p90_days']:g} days, max {summary['max_days']:g} days"
+        )
+        if summary['on_time_rate'] is not None:
+            logistical += f", {summary['on_time_rate']:.0%} on time"
+        logistical += f"; trend {summary['trend']}"
+        if route:
+            path = ' -> '.join([route['legs'][0]['origin']] + [leg['destination'] for leg in route['legs']])
+            logistical += f". Fastest route {path}: expected {route['expected_days']:g} days, p90 {route['p90_days']:g} days"
+        
+        result['reasoning']['logistical'] = logistical
+        result['source_tables'] = [lane_index.SOURCE_TABLE]
+        return result
+    
+    def work_batch(self, entity_sets: list) -> list:
+        indexed = {}
+        for idx, entities in enumerate(entity_sets):
+            if entities.get('country'):
+                decision = self.check_lanes(entities['country'])
+                if decision is not None:
+                    indexed[idx] = decision
+        if indexed:
+            remaining = [entities for idx, entities in enumerate(entity_sets) if idx not in indexed]
+            decisions = iter(self._work_batch_rows(remaining) if remaining else [])
+            return [indexed[idx] if idx in indexed else next(decisions) for idx in range(len(entity_sets))]
+        return self._work_batch_rows(entity_sets)
+    
+    def _work_batch_rows(self, entity_sets: list) -> list:
+        schema = get_dynamic_schema('ip_shipping_timelines_report')
+        if not schema['exists']:
+            return [self._error_response('Table ip_shipping_timelines_report not found') for _ in entity_sets]
+        
+        table_name = schema['table_name']
+        dest_col = find_column(table_name, ['destination', 'location', 'country'])
+        lead_col = lane_index.lead_time_column(table_name)
+        match = key_match(f't."{dest_col}"', 'country') if dest_col else 'TRUE'
+        
+        def build_query(keys_cte: str) -> str:
+            return f"""
+            WITH {keys_cte}
+            SELECT k.key_idx, t.*
+            FROM keys k
+            JOIN {table_name} t ON {match}
+            """
+        
+        try:
+            groups = run_keyed_query(entity_sets, ['country'], build_query)
+        except Exception as e:
+            return [self._error_response(f'SQL execution failed: {str(e)}') for _ in entity_sets]
+        
+        logger.info("Batch evaluated %s entity sets in one pass", len(entity_sets))
+        return [self.evaluate(rows, lead_col) for rows in groups]
+    
+    def evaluate(self, data: list, lead_col: str) -> dict:
+        lead_times = sorted(
+            value for value in (to_number(row.get(lead_col)) for row in data) if value is not None
+        ) if lead_col else []
+        
+        if not lead_times:
+            return {
+                'decision': 'NO',
+                'severity': 'MEDIUM',
+                'risk_type': 'LOGISTICS',
+                'weeks_of_cover': None,
+                'reasoning': {
+                    'technical': 'N/A',
+                    'regulatory': 'N/A',
+                    'logistical': f'No shipping lead times found ({len(data)} shipment records)'
+                },
+                'source_tables': self.allowed_tables,
+                'recommended_action': 'Verify shipping timeline data for this destination',
+                'uncertainty': 'No lead time data available'
+            }
+        
+        # Judge on the 90th percentile so a single outlier shipment does not set the severity
+        p90 = lead_times[min(len(lead_times) - 1, int(0.9 * len(lead_times)))]
+        result = self._decision(p90)
+        result['reasoning']['logistical'] = (
+            f'{len(lead_times)} shipments; lead time median {lead_times[len(lead_times) // 2]:g} days, '
+            f'p90 {p90:g} days, max {lead_times[-1]:g} days'
+        )
+        return result
+    
+    def _decision(self, p90: float) -> dict:
+        if p90 > 30:
+            severity, decision = 'CRITICAL', 'NO'
+            action = 'Lead times exceed 30 days; use an alternative route or depot'
+        elif p90 > 21:
+            severity, decision = 'HIGH', 'NO'
+            action = 'Plan shipments at least 4 weeks ahead of need'
+        elif p90 > 14:
+            severity, decision = 'MEDIUM', 'YES'
+            action = 'Plan shipments at least 3 weeks ahead of need'
+        else:
+            severity, decision = 'MEDIUM', 'YES'
+            action = 'Standard shipment planning is sufficient'
+        
+        return {
+            'decision': decision,
+            'severity': severity,
+            'risk_type': 'LOGISTICS',
+            'weeks_of_cover': None,
+            'reasoning': {
+                'technical': 'N/A',
+                'regulatory': 'N/A',
+                'logistical': 'N/A'
+            },
+            'source_tables': self.allowed_tables,
+            'recommended_action': action
+        }
+    
     def _error_response(self, error_msg: str) -> dict:
         return {
             'decision': 'NO',
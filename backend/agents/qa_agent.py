@@ -1,21 +1,67 @@
-from openai import OpenAI
-from config import LLM_MODEL_NAME, LLM_CLIENT
+from config import LLM_MODEL_NAME, FEASIBILITY_ENABLED
 from tools.sql_executor import run_sql_query
+from tools.llm_gateway import LLMUnavailableError
+from tools.structured_output import structured_completion, decision_schema
 from tools.dynamic_schema import get_dynamic_schema, find_column
+from tools.telemetry import span
+from tools.prompts import agent_messages
+from tools.batch_query import run_keyed_query, key_match
+from tools import feasibility
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+ROW_LIMIT = 50
+
+RESULT_TERMS = ['result', 'outcome', 'status', 'decision']
+SUCCESS_MARKERS = ('PASS', 'APPROV', 'SUCCESS', 'EXTEND', 'ACCEPT')
+FAILURE_MARKERS = ('FAIL', 'REJECT', 'OOS')
+
+SYSTEM_PROMPT = """You are a quality assurance and stability agent.
+
+Task: Analyze re-evaluation history and stability data.
+
+Rules:
+- Decision = "YES" if past re-evaluation successful
+- HIGH if re-evaluation required but not done
+- MEDIUM if stability data inconclusive
+
+The records to analyze are in the user message under "Data".
+
+Return ONLY a JSON object with this exact structure:
+{
+    "decision": "YES or NO",
+    "severity": "CRITICAL or HIGH or MEDIUM",
+    "risk_type": "QA",
+    "weeks_of_cover": null,
+    "reasoning": {
+        "technical": "detailed analysis of stability and re-evaluation",
+        "regulatory": "compliance status",
+        "logistical": "N/A or relevant info"
+    },
+    "recommended_action": "specific action to take"
+}
+
+Return only JSON, no markdown or explanation."""
 
 class QaAgent:
     def __init__(self):
-        self.client = LLM_CLIENT
         self.model_name = LLM_MODEL_NAME
+        self.result_set = None
         self.allowed_tables = [
             're-evaluation',
             'qdocs'
         ]
     
-    def work(self, query: str, entities: dict) -> dict:
+    def work(self, query: str, entities: dict, rows: list = None) -> dict:
         batch_id = entities.get('batch_id')
         
+        if batch_id and rows is None:
+            decision = self.check_feasibility(batch_id, entities.get('country'))
+            if decision is not None:
+                return decision
+        
         table_name = 're-evaluation'
         
         # Get actual columns from database
@@ -32,66 +78,171 @@ class QaAgent:
         if batch_id and batch_col:
             sql_query += f' AND "{batch_col}" ILIKE \'%{batch_id}%\''
         
-        sql_query += ' LIMIT 50'
+        sql_query += f' LIMIT {ROW_LIMIT}'
         
         try:
-            print(f"[QA] Executing SQL: {sql_query}")
-            data = run_sql_query(sql_query)
-            print(f"[QA] Retrieved {len(data)} records")
+            logger.debug("Executing SQL: %s", sql_query)
+            data = rows if rows is not None else run_sql_query(sql_query, cache=True)
+            logger.debug("Retrieved %s records", len(data))
         except Exception as e:
             return self._error_response(f'SQL execution failed: {str(e)}')
         
-        prompt = f"""
-You are a quality assurance and stability agent.
-
-Task: Analyze re-evaluation history and stability data.
-
-Rules:
-- Decision = "YES" if past re-evaluation successful
-- HIGH if re-evaluation required but not done
-- MEDIUM if stability data inconclusive
-
-Data:
-{json.dumps(data, indent=2)}
-
-Return ONLY a JSON object with this exact structure:
-{{
-    "decision": "YES or NO",
-    "severity": "CRITICAL or HIGH or MEDIUM",
-    "risk_type": "QA",
-    "weeks_of_cover": null,
-    "reasoning": {{
-        "technical": "detailed analysis of stability and re-evaluation",
-        "regulatory": "compliance status",
-        "logistical": "N/A or relevant info"
-    }},
-    "source_tables": {json.dumps(self.allowed_tables)},
-    "recommended_action": "specific action to take"
-}}
-
-Return only JSON, no markdown or explanation.
-"""
+        self.result_set = {'rows': data, 'columns': {'batch_id': batch_col}, 'complete': len(data) < ROW_LIMIT}
+        
+        with span('prompt_building', rows=len(data)):
+            messages = agent_messages(SYSTEM_PROMPT, data)
         
         try:
-            print(f"[QA] Sending {len(data)} records to LLM for analysis...")
-            response = self.client.chat.completions.create(
+            logger.debug("Sending %s records to LLM for analysis...", len(data))
+            result = structured_completion(
+                messages,
+                decision_schema('QA'),
+                name='qa_decision',
                 model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1000
+                task='decision'
             )
-            print(f"[QA] LLM response received")
-            
-            response_text = response.choices[0].message.content.strip().replace('```json', '').replace('```', '')
-            print(f"[QA] Raw response: {response_text[:200]}...")
+            logger.debug("LLM response received")
             
-            result = json.loads(response_text)
-            print(f"[QA] Parsed JSON successfully")
-            print(f"[QA] Decision: {result.get('decision')} | Severity: {result.get('severity')}")
+            result['source_tables'] = self.allowed_tables
+            logger.info("Decision: %s | Severity: %s", result.get('decision'), result.get('severity'))
+            return result
+        except LLMUnavailableError as e:
+            logger.warning("LLM unavailable, using rule-based assessment: %s", e)
+            result = self.evaluate(data, find_column(table_name, RESULT_TERMS))
+            result['uncertainty'] = f'Rule-based assessment, LLM unavailable: {str(e)}'
             return result
         except Exception as e:
-            print(f"[QA] ERROR: {str(e)}")
+            logger.error("LLM processing failed: %s", e)
             return self._error_response(f'LLM processing failed: {str(e)}')
     
+    def check_feasibility(self, batch_id: str, country: str = None) -> dict:
+        """Answer from the precomputed feasibility index; None when disabled, unavailable or not indexed."""
+        if not FEASIBILITY_ENABLED:
+            return None
+        try:
+            assessment = feasibility.check_extension(batch_id, country)
+        except Exception as e:
+            logger.warning("Feasibility index unavailable, reading re-evaluation rows: %s", e)
+            return None
+        if assessment is None:
+            return None
+        
+        # Keyed on the exact entities so a session never reuses this answer for another batch or country
+        self.result_set = {'rows': [], 'columns': {'batch_id': 'batch_id', 'country': 'country'}, 'complete': False}
+        return self.from_assessment(assessment)
+    
+    def from_assessment(self, assessment: dict) -> dict:
+        checks = {check['check']: check for check in assessment['checks']}
+        failing = [check for check in assessment['checks'] if check['status'] != 'ok']
+        regulatory = checks.get('regulatory')
+        
+        if assessment['feasible']:
+            action = f"Extend expiry of batch {assessment['batch_id']}"
+            if assessment['extended_expiry']:
+                action += f" to {assessment['extended_expiry']}"
+        elif any(check['status'] == 'blocked' for check in failing):
+            action = 'Do not extend expiry; resolve: ' + '; '.join(
+                check['detail'] for check in failing if check['status'] == 'blocked'
+            )
+        else:
+            action = 'Complete outstanding items before extending: ' + '; '.join(check['detail'] for check in failing)
+        
+        if regulatory:
+            regulatory_text = regulatory['detail']
+        elif assessment['approved_countries'] is not None:
+            regulatory_text = f"Approved in {len(assessment['approved_countries'])} countries; specify a country to check"
+        else:
+            regulatory_text = 'N/A'
+        
+        return {
+            'decision': assessment['decision'],
+            'severity': assessment['severity'],
+            'risk_type': 'QA',
+            'weeks_of_cover': None,
+            'reasoning': {
+                'technical': ' | '.join(checks[name]['detail'] for name in ('re-evaluation', 'stability', 'qdocs')),
+                'regulatory': regulatory_text,
+                'logistical': 'N/A'
+            },
+            'source_tables': feasibility.SOURCE_TABLES,
+            'recommended_action': action
+        }
+    
+    def work_batch(self, entity_sets: list) -> list:
+        indexed = {}
+        for idx, entities in enumerate(entity_sets):
+            if entities.get('batch_id'):
+                decision = self.check_feasibility(entities['batch_id'], entities.get('country'))
+                if decision is not None:
+                    indexed[idx] = decision
+        if indexed:
+            remaining = [entities for idx, entities in enumerate(entity_sets) if idx not in indexed]
+            decisions = iter(self._work_batch_rows(remaining) if remaining else [])
+            return [indexed[idx] if idx in indexed else next(decisions) for idx in range(len(entity_sets))]
+        return self._work_batch_rows(entity_sets)
+    
+    def _work_batch_rows(self, entity_sets: list) -> list:
+        table_name = 're-evaluation'
+        schema = get_dynamic_schema(table_name)
+        if not schema['exists']:
+            return [self._error_response(f'Table {table_name} not found') for _ in entity_sets]
+        
+        batch_col = find_column(table_name, ['batch', 'lot', 'batch_id', 'lot_id'])
+        result_col = find_column(table_name, RESULT_TERMS)
+        match = key_match(f't."{batch_col}"', 'batch_id') if batch_col else 'TRUE'
+        
+        def build_query(keys_cte: str) -> str:
+            return f"""
+            WITH {keys_cte}
+            SELECT k.key_idx, t.*
+            FROM keys k
+            JOIN "{table_name}" t ON {match}
+            """
+        
+        try:
+            groups = run_keyed_query(entity_sets, ['batch_id'], build_query)
+        except Exception as e:
+            return [self._error_response(f'SQL execution failed: {str(e)}') for _ in entity_sets]
+        
+        logger.info("Batch evaluated %s entity sets in one pass", len(entity_sets))
+        return [self.evaluate(rows, result_col) for rows in groups]
+    
+    def evaluate(self, data: list, result_col: str) -> dict:
+        results = [str(row.get(result_col) or '').upper() for row in data] if result_col else []
+        passed = sum(1 for result in results if any(marker in result for marker in SUCCESS_MARKERS))
+        failed = sum(1 for result in results if any(marker in result for marker in FAILURE_MARKERS))
+        
+        if not data:
+            severity, decision = 'HIGH', 'NO'
+            technical = 'No re-evaluation history found for this batch'
+            action = 'Initiate re-evaluation before any expiry extension'
+        elif passed and not failed:
+            severity, decision = 'MEDIUM', 'YES'
+            technical = f'{passed} successful re-evaluation(s) on record'
+            action = 'Expiry extension supported by re-evaluation history'
+        elif failed:
+            severity, decision = 'HIGH', 'NO'
+            technical = f'{failed} failed re-evaluation(s) out of {len(data)}'
+            action = 'Do not extend expiry; review failed re-evaluations'
+        else:
+            severity, decision = 'MEDIUM', 'NO'
+            technical = f'{len(data)} re-evaluation record(s) with inconclusive results'
+            action = 'Request additional stability data'
+        
+        return {
+            'decision': decision,
+            'severity': severity,
+            'risk_type': 'QA',
+            'weeks_of_cover': None,
+            'reasoning': {
+                'technical': technical,
+                'regulatory': 'N/A',
+                'logistical': 'N/A'
+            },
+            'source_tables': self.allowed_tables,
+            'recommended_action': action
+        }
+    
     def _error_response(self, error_msg: str) -> dict:
         return {
             'decision': 'NO',
@@ -1,21 +1,66 @@
-from openai import OpenAI
-from config import LLM_MODEL_NAME, LLM_CLIENT
+from config import LLM_MODEL_NAME, APPROVAL_MATRIX_ENABLED
 from tools.sql_executor import run_sql_query
+from tools.llm_gateway import LLMUnavailableError
+from tools.structured_output import structured_completion, decision_schema
 from tools.dynamic_schema import get_dynamic_schema, find_column
+from tools.telemetry import span
+from tools.prompts import agent_messages
+from tools.batch_query import run_keyed_query, key_match, to_number
+from tools.approval_matrix import approvals, SOURCE_TABLES as APPROVAL_TABLES
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+ROW_LIMIT = 50
+
+STATUS_TERMS = ['approval_status', 'status', 'approval']
+
+SYSTEM_PROMPT = """You are a regulatory compliance agent.
+
+Task: Analyze ALL the regulatory data and provide ONE SINGLE consolidated decision.
+
+Rules:
+- CRITICAL if ANY status = "REJECTED"
+- HIGH if ANY status = "PENDING" and urgent
+- MEDIUM if ANY status = "PENDING"
+- Decision = "NO" if there are ANY issues, "YES" if all clear
+
+The records to analyze are in the user message under "Data (multiple records)".
+
+IMPORTANT: Analyze ALL rows together and return ONLY ONE JSON object (not an array) with this exact structure:
+{
+    "decision": "YES or NO",
+    "severity": "CRITICAL or HIGH or MEDIUM",
+    "risk_type": "REGULATORY",
+    "weeks_of_cover": null,
+    "reasoning": {
+        "technical": "N/A or relevant info",
+        "regulatory": "consolidated analysis of ALL approval statuses - mention key findings",
+        "logistical": "N/A or relevant info"
+    },
+    "recommended_action": "specific action to take based on most critical finding"
+}
+
+Return ONLY ONE JSON object, NOT an array. No markdown or explanation."""
 
 class RegulatoryAgent:
     def __init__(self):
-        self.client = LLM_CLIENT
         self.model_name = LLM_MODEL_NAME
+        self.result_set = None
         self.allowed_tables = [
             'rim',
             'material_country_requirements'
         ]
     
-    def work(self, query: str, entities: dict) -> dict:
+    def work(self, query: str, entities: dict, rows: list = None) -> dict:
         country = entities.get('country')
         
+        if country and rows is None:
+            decision = self.check_approvals(country)
+            if decision is not None:
+                return decision
+        
         schema = get_dynamic_schema('rim')
         
         if not schema['exists']:
@@ -29,10 +74,10 @@ class RegulatoryAgent:
         if country and country_col:
             sql_query += f' AND "{country_col}" ILIKE \'%{country}%\''
         
-        sql_query += ' LIMIT 50'
+        sql_query += f' LIMIT {ROW_LIMIT}'
         
         try:
-            data = run_sql_query(sql_query)
+            data = rows if rows is not None else run_sql_query(sql_query, cache=True)
         except Exception as e:
             return {
                 'decision': 'NO',
@@ -49,55 +94,25 @@ class RegulatoryAgent:
                 'uncertainty': 'Unable to fetch regulatory data'
             }
         
-        prompt = f"""
-You are a regulatory compliance agent.
-
-Task: Analyze ALL the regulatory data and provide ONE SINGLE consolidated decision.
-
-Rules:
-- CRITICAL if ANY status = "REJECTED"
-- HIGH if ANY status = "PENDING" and urgent
-- MEDIUM if ANY status = "PENDING"
-- Decision = "NO" if there are ANY issues, "YES" if all clear
-
-Data (multiple records):
-{json.dumps(data, indent=2)}
-
-IMPORTANT: Analyze ALL rows together and return ONLY ONE JSON object (not an array) with this exact structure:
-{{
-    "decision": "YES or NO",
-    "severity": "CRITICAL or HIGH or MEDIUM",
-    "risk_type": "REGULATORY",
-    "weeks_of_cover": null,
-    "reasoning": {{
-        "technical": "N/A or relevant info",
-        "regulatory": "consolidated analysis of ALL approval statuses - mention key findings",
-        "logistical": "N/A or relevant info"
-    }},
-    "source_tables": {json.dumps(self.allowed_tables)},
-    "recommended_action": "specific action to take based on most critical finding"
-}}
-
-Return ONLY ONE JSON object, NOT an array. No markdown or explanation.
-"""
+        self.result_set = {'rows': data, 'columns': {'country': country_col}, 'complete': len(data) < ROW_LIMIT}
+        
+        with span('prompt_building', rows=len(data)):
+            messages = agent_messages(SYSTEM_PROMPT, data, 'Data (multiple records)')
         
         try:
-            print(f"[REGULATORY] Sending {len(data)} records to LLM for analysis...")
-            response = self.client.chat.completions.create(
+            logger.debug("Sending %s records to LLM for analysis...", len(data))
+            parsed = structured_completion(
+                messages,
+                decision_schema('REGULATORY'),
+                name='regulatory_decision',
                 model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1000
+                task='decision'
             )
-            response_text = response.choices[0].message.content.strip().replace('```json', '').replace('```', '')
-            
-            print(f"[REGULATORY] LLM response received")
-            
-            # Parse the response
-            parsed = json.loads(response_text)
+            logger.debug("LLM response received")
             
-            # If LLM returns an array instead of single object, take the most critical one
+            # Without schema support the model may still return an array; take the most critical one
             if isinstance(parsed, list):
-                print(f"[REGULATORY] WARNING: LLM returned array of {len(parsed)} decisions, consolidating...")
+                logger.warning("LLM returned array of %s decisions, consolidating...", len(parsed))
                 
                 # Find the most critical decision
                 severity_order = {'CRITICAL': 3, 'HIGH': 2, 'MEDIUM': 1}
@@ -105,14 +120,20 @@ Return ONLY ONE JSON object, NOT an array. No markdown or explanation.
                 
                 # Add note about consolidation
                 result['reasoning']['regulatory'] = f"Consolidated from {len(parsed)} findings. Most critical: " + result['reasoning'].get('regulatory', '')
-                print(f"[REGULATORY] Selected most critical: {result.get('severity')} - {result.get('decision')}")
+                logger.debug("Selected most critical: %s - %s", result.get('severity'), result.get('decision'))
             else:
                 result = parsed
+            result['source_tables'] = self.allowed_tables
             
-            print(f"[REGULATORY] Final decision: {result.get('decision')} | Severity: {result.get('severity')}")
+            logger.info("Final decision: %s | Severity: %s", result.get('decision'), result.get('severity'))
+            return result
+        except LLMUnavailableError as e:
+            logger.warning("LLM unavailable, using rule-based assessment: %s", e)
+            result = self.evaluate(data, find_column(table_name, STATUS_TERMS))
+            result['uncertainty'] = f'Rule-based assessment, LLM unavailable: {str(e)}'
             return result
         except Exception as e:
-            print(f"[REGULATORY] ERROR: {str(e)}")
+            logger.error("LLM processing failed: %s", e)
             return {
                 'decision': 'NO',
                 'severity': 'MEDIUM',
@@ -128,6 +149,138 @@ Return ONLY ONE JSON object, NOT an array. No markdown or explanation.
                 'uncertainty': 'Unable to process regulatory data'
             }
     
+    def check_approvals(self, country: str) -> dict:
+        """Answer from the in-memory approval matrix; None when disabled, unavailable or the country is unknown."""
+        if not APPROVAL_MATRIX_ENABLED:
+            return None
+        try:
+            summary = approvals.country_summary(country)
+        except Exception as e:
+            logger.warning("Approval matrix unavailable, reading rim rows: %s", e)
+            return None
+        if summary is None:
+            return None
+        
+        # Keyed on the country so a session never reuses this answer for another one
+        self.result_set = {'rows': [], 'columns': {'country': 'country'}, 'complete': False}
+        return self.from_summary(summary)
+    
+    def from_summary(self, summary: dict) -> dict:
+        if summary['rejected']:
+            severity, decision = 'CRITICAL', 'NO'
+            action = 'Do not ship affected materials; resolve rejected submissions'
+        elif summary['non_compliant']:
+            severity, decision = 'HIGH', 'NO'
+            action = 'Resolve country requirement non-compliance before shipping'
+        elif summary['no_record']:
+            severity, decision = 'HIGH', 'NO'
+            action = 'Submit approvals for required materials without a RIM record before shipping'
+        elif summary['pending']:
+            severity, decision = 'MEDIUM', 'NO'
+            action = 'Follow up on pending approvals before shipping'
+        else:
+            severity, decision = 'MEDIUM', 'YES'
+            action = 'No regulatory blockers; proceed'
+        
+        regulatory = (
+            f"{summary['country']}: {summary['approved']} materials approved, {summary['pending']} pending, "
+            f"{summary['rejected']} rejected, {summary['non_compliant']} non-compliant with requirements, "
+            f"{summary['no_record']} required without an approval record"
+        )
+        if summary['blocking']:
+            shown = summary['blocking'][:10]
+            regulatory += '. Blocking: ' + ', '.join(f"{item['material_id']} ({item['reason']})" for item in shown)
+            if len(summary['blocking']) > len(shown):
+                regulatory += f" and {len(summary['blocking']) - len(shown)} more"
+        
+        return {
+            'decision': decision,
+            'severity': severity,
+            'risk_type': 'REGULATORY',
+            'weeks_of_cover': None,
+            'reasoning': {
+                'technical': 'N/A',
+                'regulatory': regulatory,
+                'logistical': 'N/A'
+            },
+            'source_tables': APPROVAL_TABLES,
+            'recommended_action': action
+        }
+    
+    def work_batch(self, entity_sets: list) -> list:
+        indexed = {}
+        for idx, entities in enumerate(entity_sets):
+            if entities.get('country'):
+                decision = self.check_approvals(entities['country'])
+                if decision is not None:
+                    indexed[idx] = decision
+        if indexed:
+            remaining = [entities for idx, entities in enumerate(entity_sets) if idx not in indexed]
+            decisions = iter(self._work_batch_rows(remaining) if remaining else [])
+            return [indexed[idx] if idx in indexed else next(decisions) for idx in range(len(entity_sets))]
+        return self._work_batch_rows(entity_sets)
+    
+    def _work_batch_rows(self, entity_sets: list) -> list:
+        schema = get_dynamic_schema('rim')
+        if not schema['exists']:
+            return [self._error_response('Table rim not found') for _ in entity_sets]
+        
+        table_name = schema['table_name']
+        country_col = find_column(table_name, ['country', 'location', 'region'])
+        status_col = find_column(table_name, STATUS_TERMS)
+        match = key_match(f't."{country_col}"', 'country') if country_col else 'TRUE'
+        
+        def build_query(keys_cte: str) -> str:
+            return f"""
+            WITH {keys_cte}
+            SELECT k.key_idx, t.*
+            FROM keys k
+            JOIN {table_name} t ON {match}
+            """
+        
+        try:
+            groups = run_keyed_query(entity_sets, ['country'], build_query)
+        except Exception as e:
+            return [self._error_response(f'SQL execution failed: {str(e)}') for _ in entity_sets]
+        
+        logger.info("Batch evaluated %s entity sets in one pass", len(entity_sets))
+        return [self.evaluate(rows, status_col) for rows in groups]
+    
+    def evaluate(self, data: list, status_col: str) -> dict:
+        if not data or not status_col:
+            return self._error_response(
+                'No regulatory records found' if not data else 'Approval status column not found'
+            )
+        
+        statuses = [str(row.get(status_col) or '').upper() for row in data]
+        rejected = sum(1 for status in statuses if 'REJECT' in status)
+        pending = sum(1 for status in statuses if 'PEND' in status)
+        
+        if rejected:
+            severity, decision = 'CRITICAL', 'NO'
+            action = 'Do not ship affected materials; resolve rejected submissions'
+        elif pending:
+            # The urgency needed for HIGH is not derivable from RIM alone
+            severity, decision = 'MEDIUM', 'NO'
+            action = 'Follow up on pending approvals before shipping'
+        else:
+            severity, decision = 'MEDIUM', 'YES'
+            action = 'No regulatory blockers; proceed'
+        
+        return {
+            'decision': decision,
+            'severity': severity,
+            'risk_type': 'REGULATORY',
+            'weeks_of_cover': None,
+            'reasoning': {
+                'technical': 'N/A',
+                'regulatory': f'{len(statuses)} approval records: {rejected} rejected, {pending} pending',
+                'logistical': 'N/A'
+            },
+            'source_tables': self.allowed_tables,
+            'recommended_action': action
+        }
+    
     def _error_response(self, error_msg: str) -> dict:
         return {
             'decision': 'NO',
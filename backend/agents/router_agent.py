@@ -1,56 +1,105 @@
-from openai import OpenAI
-from config import LLM_MODEL_NAME, LLM_CLIENT
+from config import (
+    LLM_MODEL_NAME, LLM_BATCH_CONCURRENCY, SESSION_MAX_SESSIONS, SESSION_TTL_SECONDS,
+    SESSION_RESULT_TTL_SECONDS, SESSION_MAX_MB
+)
+from tools.llm_gateway import chat_completion, LLMUnavailableError
+from tools.structured_output import structured_completion, StructuredOutputError, INTENT_SCHEMA
+from tools.single_flight import SingleFlight
+from tools.telemetry import span
+from tools.profiler import profiled
+from tools.session_store import SessionStore
+from concurrent.futures import ThreadPoolExecutor
+import json
+import re
+import logging
 
-class RouterAgent:
-    def __init__(self):
-        self.client = LLM_CLIENT
-        self.model_name = LLM_MODEL_NAME
-        self.conversation_memory = {}
-    
-    def classify_intent(self, query: str) -> dict:
-        prompt = f"""
-You are an intent classification agent for a clinical supply chain system.
+logger = logging.getLogger(__name__)
+
+# Used when the LLM is unreachable or its circuit breaker is open
+INTENT_KEYWORDS = [
+    ('REGULATORY', ['regulatory', 'approval', 'approved', 'compliance', 'rim', 'submission']),
+    ('QA', ['stability', 're-evaluation', 'reevaluation', 'extend expiry', 'extension', 'qdoc', 'quality']),
+    ('LOGISTICS', ['shipping', 'shipment', 'lead time', 'logistics', 'transit', 'delivery', 'depot']),
+    ('DEMAND', ['demand', 'enrollment', 'forecast', 'shortfall', 'weeks of cover', 'run out']),
+    ('STOCK', ['stock', 'inventory', 'expiry', 'expiring', 'expire', 'available'])
+]
 
-Analyze this user query and return ONLY a JSON object with this structure:
-{{
+# Shared across router instances so concurrent identical requests coalesce
+_intent_flights = SingleFlight('intent')
+_agent_flights = SingleFlight('agent')
+
+# Static system prompts; the query and per-call data go in the user message so prefixes stay cacheable
+INTENT_SYSTEM_PROMPT = """You are an intent classification agent for a clinical supply chain system.
+
+Analyze the user query and return ONLY a JSON object with this structure:
+{
     "intent": "STOCK" | "DEMAND" | "LOGISTICS" | "REGULATORY" | "QA" | "GENERAL",
-    "entities": {{
+    "entities": {
         "trial_id": "extracted trial name or null",
         "country": "extracted country or null",
         "batch_id": "extracted batch ID or null"
-    }},
+    },
     "confidence": 0.0 to 1.0
-}}
+}
 
-User Query: {query}
+Return only the JSON object, no explanation."""
 
-Return only the JSON object, no explanation.
-"""
-        
+NARRATIVE_SYSTEM_PROMPT = """You are a clinical supply chain analyst.
+
+Summarise the risk decision in the user message for a supply planner in at most two sentences.
+
+Return plain text only."""
+
+# Elliptical follow-ups such as "and what about France?" that only swap an entity
+FOLLOW_UP = re.compile(
+    r'^\s*(?:and|also|ok(?:ay)?|then)?[\s,]*(?:what|how)\s+about\s+(?P<subject>.+?)\s*[?.!]*\s*$',
+    re.IGNORECASE
+)
+BARE_NAME = re.compile(r"[A-Z][\w'.-]*(?:\s+[A-Z][\w'.-]*)*")
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split()).rstrip('?.! ')
+
+def normalize_entities(entities: dict) -> tuple:
+    return tuple(sorted(
+        (key, str(value).strip().lower())
+        for key, value in (entities or {}).items()
+        if value not in (None, '', 'null')
+    ))
+
+class RouterAgent:
+    def __init__(self):
+        self.model_name = LLM_MODEL_NAME
+        self.conversation_memory = SessionStore(
+            SESSION_MAX_SESSIONS, SESSION_TTL_SECONDS, SESSION_RESULT_TTL_SECONDS, SESSION_MAX_MB * 1024 * 1024
+        )
+    
+    def classify_intent(self, query: str) -> dict:
+        return _intent_flights.do(normalize_query(query), lambda: self._classify_intent(query))
+    
+    def _classify_intent(self, query: str) -> dict:
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=500
-            )
-            import json
-            
-            response_text = response.choices[0].message.content.strip()
-            
-            if response_text.startswith('```json'):
-                response_text = response_text.replace('```json', '').replace('```', '').strip()
-            elif response_text.startswith('```'):
-                response_text = response_text.replace('```', '').strip()
-            
-            result = json.loads(response_text)
-            return result
-        except json.JSONDecodeError as e:
+            with span('intent_classification'):
+                return structured_completion(
+                    [
+                        {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"User Query: {query}"}
+                    ],
+                    INTENT_SCHEMA,
+                    name='intent',
+                    model=self.model_name,
+                    task='intent'
+                )
+        except StructuredOutputError as e:
             return {
                 'intent': 'GENERAL',
                 'entities': {},
                 'confidence': 0.0,
-                'error': f'JSON parsing failed: {str(e)}. Response was: {response.text[:200] if "response" in locals() else "No response"}'
+                'error': f'JSON parsing failed: {str(e)}. Response was: {e.text[:200] or "No response"}'
             }
+        except LLMUnavailableError as e:
+            logger.warning("LLM unavailable (%s), using keyword classification", e)
+            return self.classify_intent_fallback(query)
         except Exception as e:
             return {
                 'intent': 'GENERAL',
@@ -59,40 +108,168 @@ Return only the JSON object, no explanation.
                 'error': str(e)
             }
     
-    def route_to_agent(self, intent: str, query: str, entities: dict) -> dict:
-        from agents.inventory_agent import InventoryAgent
-        from agents.demand_agent import DemandAgent
-        from agents.logistics_agent import LogisticsAgent
-        from agents.regulatory_agent import RegulatoryAgent
-        from agents.qa_agent import QaAgent
+    def classify_intent_fallback(self, query: str) -> dict:
+        query_lower = query.lower()
+        intent = 'GENERAL'
+        for candidate, keywords in INTENT_KEYWORDS:
+            if any(keyword in query_lower for keyword in keywords):
+                intent = candidate
+                break
+        
+        batch_match = re.search(r'batch\s*#?\s*([A-Za-z0-9_-]+)', query, re.IGNORECASE)
+        trial_match = re.search(r'trial\s+([A-Za-z0-9_-]+)', query, re.IGNORECASE)
+        countries = [
+            candidate for candidate in re.findall(r'\b(?:in|for|to)\s+([A-Z][a-z]+(?:\s+(?:and\s+)?[A-Z][a-z]+)*)', query)
+            if candidate.split()[0] not in ('Trial', 'Batch', 'Study')
+        ]
         
-        agent_map = {
-            'STOCK': ('Inventory Agent', InventoryAgent()),
-            'DEMAND': ('Demand Agent', DemandAgent()),
-            'LOGISTICS': ('Logistics Agent', LogisticsAgent()),
-            'REGULATORY': ('Regulatory Agent', RegulatoryAgent()),
-            'QA': ('QA Agent', QaAgent())
+        return {
+            'intent': intent,
+            'entities': {
+                'trial_id': trial_match.group(1) if trial_match else None,
+                'country': countries[-1] if countries else None,
+                'batch_id': batch_match.group(1) if batch_match else None
+            },
+            'confidence': 0.3,
+            'fallback': True
         }
+    
+    def resolve_follow_up(self, session_id: str, query: str):
+        """Intent and entities for an elliptical follow-up, from session context and without an LLM call."""
+        match = FOLLOW_UP.match(query)
+        if not match:
+            return None
+        last_intent, last_entities = self.conversation_memory.context(session_id)
+        if not last_intent:
+            return None
+        
+        subject = match.group('subject')
+        extracted = self.classify_intent_fallback(subject)
+        found = {key: value for key, value in extracted['entities'].items() if value}
+        if not found:
+            if not BARE_NAME.fullmatch(subject):
+                return None
+            # A bare name ("France", "United Kingdom") replaces the country
+            found = {'country': subject}
+        
+        return {
+            'intent': extracted['intent'] if extracted['intent'] != 'GENERAL' else last_intent,
+            'entities': dict(last_entities, **found),
+            'confidence': 0.6,
+            'follow_up': True
+        }
+    
+    def route_in_session(self, session_id: str, intent: str, query: str, entities: dict):
+        """route_to_agent() that answers from, and records into, the session; returns (decision, reuse)."""
+        memory = self.conversation_memory
+        memory.record_turn(session_id, query, intent, entities)
+        cached, rows = memory.find_result(session_id, intent, entities)
+        if cached is not None:
+            return cached, 'decision'
         
-        if intent in agent_map:
-            agent_name, agent = agent_map[intent]
-            print(f"[ROUTER] Selected: {agent_name}")
-            print(f"[ROUTER] Calling {agent_name}.work()...")
-            result = agent.work(query, entities)
-            print(f"[{agent_name.upper()}] Processing complete")
-            return result
+        if rows is not None:
+            decision, result_set = self._run_agent(intent, query, entities, rows)
         else:
-            print(f"[ROUTER] No agent found for intent: {intent}")
-            return {
-                'decision': 'NO',
-                'severity': 'MEDIUM',
-                'risk_type': 'GENERAL',
-                'reasoning': {
-                    'technical': 'Unable to classify query intent',
-                    'regulatory': 'N/A',
-                    'logistical': 'N/A'
-                },
-                'source_tables': [],
-                'recommended_action': 'Please rephrase your query',
-                'uncertainty': 'Query intent unclear'
-            }
+            key = (intent, normalize_entities(entities))
+            decision, result_set = _agent_flights.do(key, lambda: self._run_agent(intent, query, entities))
+        
+        if decision.get('decision') in ('YES', 'NO') and 'uncertainty' not in decision:
+            memory.store_result(session_id, intent, entities, decision, result_set)
+        return decision, 'rows' if rows is not None else None
+    
+    def route_to_agent(self, intent: str, query: str, entities: dict) -> dict:
+        # Agents derive their answer from the entities only, so the raw query text is not part of the key
+        key = (intent, normalize_entities(entities))
+        return _agent_flights.do(key, lambda: self._run_agent(intent, query, entities))[0]
+    
+    def get_coalescing_stats(self) -> dict:
+        return {
+            'intent': _intent_flights.stats(),
+            'agent': _agent_flights.stats()
+        }
+    
+    def _run_agent(self, intent: str, query: str, entities: dict, rows: list = None) -> tuple:
+        selected = self._agent_for(intent)
+        
+        if selected:
+            agent_name, agent = selected
+            logger.debug("Selected: %s", agent_name)
+            logger.debug("Calling %s.work()...", agent_name)
+            with span('agent', agent=agent_name, intent=intent), profiled('agent', agent=agent_name, intent=intent):
+                result = agent.work(query, entities, rows=rows)
+            logger.debug("%s processing complete", agent_name)
+            return result, agent.result_set
+        else:
+            logger.info("No agent found for intent: %s", intent)
+            return self._unknown_intent_response(), None
+    
+    def route_batch(self, intent: str, entity_sets: list, narrative: bool = False) -> list:
+        selected = self._agent_for(intent)
+        if not selected:
+            logger.info("No agent found for intent: %s", intent)
+            return [self._unknown_intent_response() for _ in entity_sets]
+        
+        agent_name, agent = selected
+        logger.debug("Calling %s.work_batch() for %s entity sets...", agent_name, len(entity_sets))
+        with span('agent_batch', agent=agent_name, intent=intent, entity_sets=len(entity_sets)):
+            decisions = agent.work_batch(entity_sets)
+        
+        if narrative:
+            self._add_narratives(decisions, entity_sets)
+        return decisions
+    
+    def _add_narratives(self, decisions: list, entity_sets: list) -> None:
+        def narrate(item):
+            decision, entities = item
+            try:
+                decision['narrative'] = chat_completion(
+                    [
+                        {"role": "system", "content": NARRATIVE_SYSTEM_PROMPT},
+                        {"role": "user", "content": (
+                            f"Entities: {json.dumps(entities, default=str, sort_keys=True)}\n"
+                            f"Decision: {json.dumps(decision, default=str, sort_keys=True)}"
+                        )}
+                    ],
+                    max_tokens=200,
+                    model=self.model_name,
+                    task='narrative'
+                ).strip()
+            except Exception as e:
+                decision['narrative_error'] = str(e)
+        
+        # The gateway semaphore caps upstream concurrency; this bounds the batch's share of it
+        with ThreadPoolExecutor(max_workers=LLM_BATCH_CONCURRENCY) as pool:
+            list(pool.map(narrate, zip(decisions, entity_sets)))
+    
+    def _agent_for(self, intent: str):
+        if intent == 'STOCK':
+            from agents.inventory_agent import InventoryAgent
+            return ('Inventory Agent', InventoryAgent())
+        if intent == 'DEMAND':
+            from agents.demand_agent import DemandAgent
+            return ('Demand Agent', DemandAgent())
+        if intent == 'LOGISTICS':
+            from agents.logistics_agent import LogisticsAgent
+            return ('Logistics Agent', LogisticsAgent())
+        if intent == 'REGULATORY':
+            from agents.regulatory_agent import RegulatoryAgent
+            return ('Regulatory Agent', RegulatoryAgent())
+        if intent == 'QA':
+            from agents.qa_agent import QaAgent
+            return ('QA Agent', QaAgent())
+        return None
+    
+    def _unknown_intent_response(self) -> dict:
+        return {
+            'decision': 'NO',
+            'severity': 'MEDIUM',
+            'risk_type': 'GENERAL',
+            'reasoning': {
+                'technical': 'Unable to classify query intent',
+                'regulatory': 'N/A',
+                'logistical': 'N/A'
+            },
+            'source_tables': [],
+            'recommended_action': 'Please rephrase your query',
+            'uncertainty': 'Query intent unclear'
+        }
@@ -1,62 +1,129 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from agents.router_agent import RouterAgent
-from tools.sql_executor import run_sql_query
-from tools.audit_logger import log_decision
-from db.connection import get_connection
-from openai import OpenAI
-from config import LLM_API_KEY, LLM_MODEL_NAME, LLM_CLIENT
+from tools.sql_executor import run_sql_query, run_sql_page, stream_query_csv, get_cache_stats, clear_query_cache, handle_table_change
+from tools import change_feed
+from tools.audit_logger import log_decision, query_decisions, summarize_decisions, get_decision, AUDIT_FILTERS
+from db.connection import get_connection, get_replica_status
+from tools.llm_gateway import get_llm_stats, check_reachability
+from tools.structured_output import get_structured_output_stats
+from tools.telemetry import configure_logging, span, new_request_id, get_request_id, get_stage_stats
+from tools.metrics import render_prometheus, register_gauge
+from tools import profiler
+from tools import partition_manager
+from tools import sql_guard
+from tools import feasibility
+from tools import lane_index
+from tools import approval_matrix
+from tools.approval_matrix import approvals
+from tools import redistribution
+from tools.sql_guard import (
+    prepare_page, run_page, check_export, decode_more_token, stream_with_heartbeat,
+    QueryRejectedError, QueryIdInUseError
+)
+from config import LLM_MODEL_NAME, CHANGE_FEED_ENABLED, BATCH_MAX_ENTITY_SETS
+from config import ADMIN_TOKEN, PROFILE_SAMPLER_ENABLED, AUDIT_PARTITION_MAINTENANCE, SQL_GUARD_ENABLED
+from config import SQL_GUARD_TIMEOUT_MS
+from functools import wraps
+import hmac
 import sys
 import os
 import json
+import logging
+import threading
+from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 def check_database_connection():
-    print("Checking database connection...")
+    logger.info("Checking database connection...")
     try:
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT 1")
         cursor.fetchone()
         cursor.close()
-        print("✓ Database connection successful")
+        logger.info("✓ Database connection successful")
         return True
     except Exception as e:
-        print(f"✗ Database connection failed: {str(e)}")
+        logger.error("✗ Database connection failed: %s", e)
         return False
 
 def check_llm_connection():
-    print("Checking LLM connection...")
-    try:
-        if not LLM_CLIENT:
-            print("✗ LLM connection failed: No API key configured")
-            return False
-        
-        response = LLM_CLIENT.chat.completions.create(
-            model=LLM_MODEL_NAME,
-            messages=[{"role": "user", "content": "Say 'OK'"}],
-            max_tokens=10
-        )
-        if response.choices[0].message.content:
-            print(f"✓ LLM connection successful (Model: {LLM_MODEL_NAME})")
-            return True
-        else:
-            print("✗ LLM connection failed: No response from model")
-            return False
-    except Exception as e:
-        print(f"✗ LLM connection failed: {str(e)}")
-        return False
+    # Runs off the boot path; agent queries fall back to rule-based decisions until the LLM is reachable
+    result = check_reachability()
+    if result['reachable']:
+        logger.info("✓ LLM connection successful (Model: %s, %.0f ms)", LLM_MODEL_NAME, result['latency_ms'])
+    else:
+        logger.warning("✗ LLM connection failed: %s", result['error'])
+    return result['reachable']
 
 app = Flask(__name__)
 CORS(app)
 
 router = RouterAgent()
 
+change_feed.subscribe(handle_table_change)
+change_feed.subscribe(feasibility.handle_table_change, feasibility.SOURCE_TABLES)
+change_feed.subscribe(lane_index.handle_table_change, [lane_index.SOURCE_TABLE])
+change_feed.subscribe(approvals.handle_table_change, approval_matrix.SOURCE_TABLES)
+if CHANGE_FEED_ENABLED:
+    change_feed.start_listener()
+if PROFILE_SAMPLER_ENABLED:
+    profiler.start_sampler()
+if AUDIT_PARTITION_MAINTENANCE:
+    partition_manager.start_maintenance()
+
+register_gauge('sql_cache_entries', lambda: {(): get_cache_stats()['entries']})
+register_gauge('sql_cache_hits', lambda: {(): get_cache_stats()['hits']})
+register_gauge('sql_cache_misses', lambda: {(): get_cache_stats()['misses']})
+register_gauge('llm_in_flight', lambda: {(): get_llm_stats()['in_flight']})
+register_gauge('db_replica_healthy', lambda: {
+    (('replica', r['host']),): int(r['healthy']) for r in get_replica_status()
+})
+register_gauge('db_replica_lag_seconds', lambda: {
+    (('replica', r['host']),): r['lag_seconds'] for r in get_replica_status() if r['lag_seconds'] is not None
+})
+register_gauge('feasibility_index_batches', lambda: {(): feasibility.stats()['batches']})
+register_gauge('lane_index_lanes', lambda: {(): lane_index.stats()['lanes']})
+register_gauge('approval_matrix_materials', lambda: {(): approvals.stats()['materials']})
+register_gauge('llm_circuit_open', lambda: {(): int(get_llm_stats()['circuit_breaker']['state'] == 'OPEN')})
+
+def require_admin(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Admin endpoints are disabled; set ADMIN_TOKEN to enable them'}), 403
+        # compare_digest rejects non-ASCII str with a TypeError, so compare bytes
+        supplied = request.headers.get('X-Admin-Token', '').encode('utf-8')
+        if not hmac.compare_digest(supplied, ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'Invalid admin token'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.before_request
+def assign_request_id():
+    new_request_id()
+
+@app.after_request
+def add_request_id_header(response):
+    request_id = get_request_id()
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    print("\n[API] Health check requested")
-    return jsonify({'status': 'ok'}), 200
+    logger.debug("Health check requested")
+    health = {'status': 'ok'}
+    if request.args.get('deep', 'false').lower() == 'true':
+        # Cached for LLM_HEALTH_TTL_SECONDS so probes do not hit the upstream on every call
+        health['llm'] = check_reachability()
+        health['replicas'] = get_replica_status()
+    return jsonify(health), 200
 
 @app.route('/api/query', methods=['POST'])
 def process_query():
@@ -64,96 +131,211 @@ def process_query():
         data = request.get_json()
         query = data.get('query', '')
         
-        print("\n" + "="*60)
-        print(f"[API] New query received: {query}")
-        print("="*60)
+        logger.info("New query received: %s", query)
         
         if not query:
-            print("[API] ERROR: Empty query")
+            logger.warning("Empty query")
             return jsonify({'error': 'Query parameter is required'}), 400
         
-        print("[ROUTER] Classifying intent...")
-        intent_result = router.classify_intent(query)
-        
-        if 'error' in intent_result:
-            print(f"[ROUTER] ERROR: {intent_result['error']}")
-            return jsonify({
-                'error': 'Intent classification failed',
-                'details': intent_result['error']
-            }), 500
-        
-        intent = intent_result.get('intent', 'GENERAL')
-        entities = intent_result.get('entities', {})
-        
-        print(f"[ROUTER] Intent: {intent}")
-        print(f"[ROUTER] Entities: {entities}")
-        print(f"[ROUTER] Routing to agent...")
-        
-        decision = router.route_to_agent(intent, query, entities)
-        
-        # Debug check
-        if not isinstance(decision, dict):
-            print(f"[API] ERROR: Agent returned {type(decision)} instead of dict!")
-            print(f"[API] Value: {decision}")
-            return jsonify({
-                'error': 'Internal error: Agent returned invalid response type',
-                'details': f'Expected dict, got {type(decision).__name__}'
-            }), 500
-         
-        print(f"[AGENT] Decision: {decision.get('decision', 'N/A')}")
-        print(f"[AGENT] Severity: {decision.get('severity', 'N/A')}")
-        print(f"[AGENT] Risk Type: {decision.get('risk_type', 'N/A')}")
-        
-        if decision.get('decision') in ['YES', 'NO'] and 'uncertainty' not in decision:
-            try:
-                log_decision(decision)
-                print("[AUDIT] Decision logged to database")
-            except Exception as log_error:
-                decision['log_warning'] = f'Failed to log decision: {str(log_error)}'
-                print(f"[AUDIT] WARNING: {log_error}")
-        
-        print("\n" + "="*60)
-        print("[API] FINAL RESPONSE JSON:")
-        print("="*60)
-        print(json.dumps(decision, indent=2))
-        print("="*60 + "\n")
-        
-        print("[API] Query processed successfully")
-        print("="*60 + "\n")
+        # Optional client session; enables follow-up resolution and result reuse
+        session_id = str(data.get('session_id') or request.headers.get('X-Session-ID', '')).strip()[:128]
+        
+        with span('api_query') as request_span, profiler.profiled('api_query') as profile_tags:
+            intent_result = router.resolve_follow_up(session_id, query) if session_id else None
+            if intent_result is None:
+                intent_result = router.classify_intent(query)
+            
+            if 'error' in intent_result:
+                logger.error("Intent classification failed: %s", intent_result['error'])
+                return jsonify({
+                    'error': 'Intent classification failed',
+                    'details': intent_result['error']
+                }), 500
+            
+            intent = intent_result.get('intent', 'GENERAL')
+            entities = intent_result.get('entities', {})
+            request_span['intent'] = intent
+            profile_tags['intent'] = intent
+            
+            logger.info("Intent: %s, entities: %s", intent, entities)
+            
+            reuse = None
+            if session_id:
+                decision, reuse = router.route_in_session(session_id, intent, query, entities)
+                request_span['session_reuse'] = reuse
+            else:
+                decision = router.route_to_agent(intent, query, entities)
+            
+            if not isinstance(decision, dict):
+                logger.error("Agent returned %s instead of dict: %r", type(decision).__name__, decision)
+                return jsonify({
+                    'error': 'Internal error: Agent returned invalid response type',
+                    'details': f'Expected dict, got {type(decision).__name__}'
+                }), 500
+            
+            logger.info(
+                "Decision: %s | Severity: %s | Risk Type: %s",
+                decision.get('decision', 'N/A'), decision.get('severity', 'N/A'), decision.get('risk_type', 'N/A')
+            )
+            
+            if decision.get('decision') in ['YES', 'NO'] and 'uncertainty' not in decision:
+                try:
+                    with span('audit_logging'):
+                        log_decision(decision, entities)
+                    logger.debug("Decision logged to database")
+                except Exception as log_error:
+                    decision['log_warning'] = f'Failed to log decision: {str(log_error)}'
+                    logger.warning("Failed to log decision: %s", log_error)
+        
+        if session_id:
+            decision = dict(decision, session={
+                'id': session_id,
+                'follow_up': bool(intent_result.get('follow_up')),
+                'intent': intent,
+                'entities': entities,
+                'reused': reuse
+            })
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Final response: %s", json.dumps(decision, default=str))
         return jsonify(decision), 200
         
     except Exception as e:
-        print(f"[API] ERROR: Query processing failed - {str(e)}")
-        print("="*60 + "\n")
+        logger.exception("Query processing failed")
         return jsonify({
             'error': 'Query processing failed',
             'details': str(e)
         }), 500
 
+@app.route('/api/query/batch', methods=['POST'])
+def process_query_batch():
+    try:
+        data = request.get_json() or {}
+        intent = str(data.get('intent', '')).upper()
+        entity_sets = data.get('entity_sets', [])
+        narrative = bool(data.get('narrative', False))
+        should_log = bool(data.get('log', True))
+        
+        logger.info("Batch query received: intent=%s, entity_sets=%s", intent, len(entity_sets) if isinstance(entity_sets, list) else 'invalid')
+        
+        if not intent:
+            return jsonify({'error': 'intent parameter is required'}), 400
+        if not isinstance(entity_sets, list) or not entity_sets or not all(isinstance(e, dict) for e in entity_sets):
+            return jsonify({'error': 'entity_sets must be a non-empty list of objects'}), 400
+        if len(entity_sets) > BATCH_MAX_ENTITY_SETS:
+            return jsonify({'error': f'At most {BATCH_MAX_ENTITY_SETS} entity sets per batch'}), 400
+        
+        decisions = router.route_batch(intent, entity_sets, narrative=narrative)
+        
+        logged = 0
+        if should_log:
+            for entities, decision in zip(entity_sets, decisions):
+                if decision.get('decision') in ['YES', 'NO'] and 'uncertainty' not in decision:
+                    try:
+                        with span('audit_logging'):
+                            log_decision(decision, entities)
+                        logged += 1
+                    except Exception as log_error:
+                        decision['log_warning'] = f'Failed to log decision: {str(log_error)}'
+        
+        logger.info("Batch processed: %s decisions, %s logged", len(decisions), logged)
+        return jsonify({
+            'intent': intent,
+            'count': len(decisions),
+            'logged': logged,
+            'results': [
+                {'entities': entities, 'decision': decision}
+                for entities, decision in zip(entity_sets, decisions)
+            ]
+        }), 200
+        
+    except Exception as e:
+        logger.exception("Batch query processing failed")
+        return jsonify({
+            'error': 'Batch query processing failed',
+            'details': str(e)
+        }), 500
+
+def is_int_param(value) -> bool:
+    # JSON numbers and query-string digits; bools and fractional values are not offsets
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return value >= 0
+    return isinstance(value, str) and value.strip().isdigit()
+
 @app.route('/api/sql', methods=['POST'])
 def execute_sql():
     try:
         data = request.get_json()
         query = data.get('query', '')
         
-        print("\n" + "="*60)
-        print(f"[SQL] Direct SQL query received")
-        print(f"[SQL] Query: {query[:100]}..." if len(query) > 100 else f"[SQL] Query: {query}")
-        print("="*60)
+        logger.info("Direct SQL query received: %s", query[:100] + '...' if len(query) > 100 else query)
         
         if not query:
-            print("[SQL] ERROR: Empty query")
+            logger.warning("Empty SQL query")
             return jsonify({'error': 'SQL query parameter is required'}), 400
         
         if not query.strip().upper().startswith('SELECT'):
-            print("[SQL] ERROR: Non-SELECT query attempted")
+            logger.warning("Non-SELECT query attempted")
             return jsonify({'error': 'Only SELECT queries are allowed'}), 403
         
-        print("[SQL] Executing query...")
-        result = run_sql_query(query)
+        columns = data.get('columns') or None
+        if columns is not None and (not isinstance(columns, list) or not all(isinstance(c, str) for c in columns)):
+            return jsonify({'error': 'columns must be a list of column names'}), 400
+        for name in ('offset', 'limit'):
+            if data.get(name) is not None and not is_int_param(data[name]):
+                return jsonify({'error': f'{name} must be a non-negative integer'}), 400
+        
+        if SQL_GUARD_ENABLED:
+            offset, limit = data.get('offset', 0), data.get('limit')
+            if data.get('more_token'):
+                try:
+                    token = decode_more_token(query, data['more_token'])
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                offset, limit = token['offset'], token['limit']
+            query_id = str(data.get('query_id') or get_request_id())
+            # The plan check runs before streaming starts, so a rejection still gets a 4xx status
+            try:
+                prepared = prepare_page(query, offset=offset, limit=limit, columns=columns, query_id=query_id)
+            except QueryRejectedError as e:
+                return jsonify({'success': False, 'error': str(e), 'rejected': True, 'query_id': query_id}), 422
+            except QueryIdInUseError as e:
+                return jsonify({'success': False, 'error': str(e), 'query_id': query_id}), 409
+            except RuntimeError as e:
+                return jsonify({'success': False, 'error': str(e), 'query_id': query_id}), 400
+            
+            def work():
+                with span('api_sql', guarded=True):
+                    page = run_page(prepared, with_total=bool(data.get('count', False)))
+                logger.info("SQL page returned %s rows (offset %s)", page['row_count'], page['offset'])
+                return dict(page, success=True, query_id=query_id)
+            
+            # Streamed so a client disconnect is noticed and the statement cancelled
+            return Response(
+                stream_with_context(stream_with_heartbeat(work, query_id, app.json.dumps)),
+                mimetype='application/json',
+                headers={'X-Query-ID': query_id}
+            )
+        
+        # Paged mode: only the requested window and columns are fetched and serialized
+        if 'limit' in data or 'offset' in data or columns:
+            with span('api_sql', paged=True):
+                page = run_sql_page(
+                    query,
+                    offset=data.get('offset', 0),
+                    limit=data.get('limit', 100),
+                    columns=columns,
+                    with_total=bool(data.get('count', False))
+                )
+            logger.info("SQL page returned %s rows (offset %s)", page['row_count'], page['offset'])
+            return jsonify(dict(page, success=True)), 200
+        
+        with span('api_sql'):
+            result = run_sql_query(query)
         
-        print(f"[SQL] Query successful - {len(result)} rows returned")
-        print("="*60 + "\n")
+        logger.info("SQL query returned %s rows", len(result))
         
         return jsonify({
             'success': True,
@@ -162,13 +344,315 @@ def execute_sql():
         }), 200
         
     except Exception as e:
-        print(f"[SQL] ERROR: {str(e)}")
-        print("="*60 + "\n")
+        logger.error("SQL query failed: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/api/sql/cancel', methods=['POST'])
+def cancel_sql():
+    query_id = (request.get_json(silent=True) or {}).get('query_id')
+    if not query_id:
+        return jsonify({'error': 'query_id is required'}), 400
+    if not sql_guard.cancel(str(query_id)):
+        return jsonify({'error': 'No running query with this id'}), 404
+    return jsonify({'status': 'cancelling', 'query_id': query_id}), 200
+
+@app.route('/api/sql/export', methods=['GET', 'POST'])
+def export_sql():
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    query = data.get('query', '')
+    columns = data.get('columns') or None
+    if isinstance(columns, str):
+        columns = [column.strip() for column in columns.split(',') if column.strip()]
+    if columns is not None and (not isinstance(columns, list) or not all(isinstance(c, str) for c in columns)):
+        return jsonify({'error': 'columns must be a list or comma-separated string of column names'}), 400
+    if not isinstance(query, str):
+        return jsonify({'error': 'SQL query must be a string'}), 400
+    
+    if not query:
+        return jsonify({'error': 'SQL query parameter is required'}), 400
+    if not query.strip().upper().startswith('SELECT'):
+        logger.warning("Non-SELECT export attempted")
+        return jsonify({'error': 'Only SELECT queries are allowed'}), 403
+    
+    timeout_ms = None
+    if SQL_GUARD_ENABLED:
+        try:
+            check_export(query, columns)
+        except QueryRejectedError as e:
+            return jsonify({'error': str(e), 'rejected': True}), 422
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 400
+        timeout_ms = SQL_GUARD_TIMEOUT_MS
+    
+    logger.info("SQL export started: %s", query[:100] + '...' if len(query) > 100 else query)
+    filename = f"query_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return Response(
+        stream_with_context(stream_query_csv(query, columns, statement_timeout_ms=timeout_ms)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+def audit_time(name: str):
+    """ISO date or timestamp from the query string; ValueError (a 400) rather than a database error."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        # fromisoformat only accepts a trailing 'Z' from Python 3.11
+        return datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date or timestamp, got {value!r}")
+
+def audit_filters() -> dict:
+    filters = {name: request.args.get(name) for name in AUDIT_FILTERS}
+    filters.update(since=audit_time('since'), until=audit_time('until'))
+    return filters
+
+@app.route('/api/audit', methods=['GET'])
+def audit_log():
+    try:
+        filters = audit_filters()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        page = query_decisions(
+            filters,
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor'),
+            include_json=request.args.get('include_json', 'false').lower() == 'true'
+        )
+        return jsonify(page), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Audit query failed")
+        return jsonify({'error': 'Audit query failed', 'details': str(e)}), 500
+
+@app.route('/api/audit/<int:decision_id>', methods=['GET'])
+def audit_decision(decision_id):
+    try:
+        decision = get_decision(decision_id)
+        if not decision:
+            return jsonify({'error': 'Decision not found'}), 404
+        return jsonify(decision), 200
+    except Exception as e:
+        logger.exception("Audit lookup failed")
+        return jsonify({'error': 'Audit lookup failed', 'details': str(e)}), 500
+
+@app.route('/api/audit/summary', methods=['GET'])
+def audit_summary():
+    try:
+        filters = audit_filters()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        return jsonify(summarize_decisions(filters)), 200
+    except Exception as e:
+        logger.exception("Audit summary failed")
+        return jsonify({'error': 'Audit summary failed', 'details': str(e)}), 500
+
+@app.route('/api/audit/rollups', methods=['GET'])
+def audit_rollups():
+    try:
+        since, until = audit_time('since'), audit_time('until')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        rollups = partition_manager.get_rollups(since, until)
+        return jsonify({'rollups': rollups, 'count': len(rollups)}), 200
+    except Exception as e:
+        logger.exception("Audit rollup query failed")
+        return jsonify({'error': 'Audit rollup query failed', 'details': str(e)}), 500
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    stats = get_cache_stats()
+    stats['request_coalescing'] = router.get_coalescing_stats()
+    stats['sessions'] = router.conversation_memory.stats()
+    stats['feasibility'] = feasibility.stats()
+    stats['lanes'] = lane_index.stats()
+    stats['approvals'] = approvals.stats()
+    return jsonify(stats), 200
+
+@app.route('/api/cache/clear', methods=['POST'])
+def cache_clear():
+    clear_query_cache()
+    logger.info("Query result cache cleared")
+    return jsonify({'status': 'cleared'}), 200
+
+@app.route('/api/session/<session_id>', methods=['GET', 'DELETE'])
+def session_state(session_id):
+    if request.method == 'DELETE':
+        return jsonify({'cleared': router.conversation_memory.clear(session_id)}), 200
+    return jsonify({'session_id': session_id, 'turns': router.conversation_memory.history(session_id)}), 200
+
+@app.route('/api/feasibility/<batch_id>', methods=['GET'])
+def batch_feasibility(batch_id):
+    try:
+        assessment = feasibility.check_extension(batch_id, request.args.get('country'))
+    except Exception as e:
+        logger.exception("Feasibility lookup failed")
+        return jsonify({'error': 'Feasibility index unavailable', 'details': str(e)}), 503
+    if assessment is None:
+        return jsonify({'error': f'Batch {batch_id} not found'}), 404
+    return jsonify(assessment), 200
+
+@app.route('/api/lanes', methods=['GET'])
+def lanes():
+    try:
+        stats = lane_index.lane_stats(request.args.get('origin'), request.args.get('destination'))
+    except Exception as e:
+        logger.exception("Lane index lookup failed")
+        return jsonify({'error': 'Lane index unavailable', 'details': str(e)}), 503
+    return jsonify({'lanes': stats, 'count': len(stats)}), 200
+
+@app.route('/api/lanes/route', methods=['GET'])
+def lane_route():
+    destination = request.args.get('destination')
+    if not destination:
+        return jsonify({'error': 'destination parameter is required'}), 400
+    try:
+        route = lane_index.best_route(destination, request.args.get('origin'))
+    except Exception as e:
+        logger.exception("Lane routing failed")
+        return jsonify({'error': 'Lane index unavailable', 'details': str(e)}), 503
+    if route is None:
+        return jsonify({'error': f'No route to {destination}'}), 404
+    return jsonify(route), 200
+
+@app.route('/api/regulatory/approvals', methods=['GET'])
+def material_approvals():
+    material = request.args.get('material')
+    country = request.args.get('country')
+    if not material and not country:
+        return jsonify({'error': 'material or country parameter is required'}), 400
+    countries = [c for c in request.args.get('countries', '').split(',') if c.strip()] or None
+    try:
+        result = approvals.check_material(material, countries) if material else approvals.country_summary(country)
+    except Exception as e:
+        logger.exception("Approval matrix lookup failed")
+        return jsonify({'error': 'Approval matrix unavailable', 'details': str(e)}), 503
+    if result is None:
+        return jsonify({'error': f'Material {material} not found' if material else f'Country {country} not found'}), 404
+    return jsonify(result), 200
+
+@app.route('/api/redistribution/plan', methods=['POST'])
+def redistribution_plan():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    trial_id, solver, horizon_weeks = data.get('trial_id'), data.get('solver'), data.get('horizon_weeks')
+    if trial_id is not None and not isinstance(trial_id, str):
+        return jsonify({'error': 'trial_id must be a string'}), 400
+    if solver is not None and not isinstance(solver, str):
+        return jsonify({'error': f"solver must be one of {', '.join(redistribution.SOLVERS)}"}), 400
+    if horizon_weeks is not None and (
+        isinstance(horizon_weeks, bool) or not isinstance(horizon_weeks, (int, float))
+        or not 0 < horizon_weeks <= redistribution.MAX_HORIZON_WEEKS
+    ):
+        return jsonify({'error': f'horizon_weeks must be a number between 0 and {redistribution.MAX_HORIZON_WEEKS}'}), 400
+    try:
+        plan = redistribution.build_plan(trial_id, solver, horizon_weeks)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Redistribution planning failed")
+        return jsonify({'error': 'Redistribution planning failed', 'details': str(e)}), 500
+    logger.info("Redistribution plan: %s transfers, %s units (%s solver, %.0f ms)", plan['summary']['transfers'],
+                plan['summary']['units_moved'], plan['solver'], plan['summary']['solve_ms'])
+    return jsonify(plan), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics/stages', methods=['GET'])
+def stage_metrics():
+    return jsonify(get_stage_stats()), 200
+
+@app.route('/api/llm/stats', methods=['GET'])
+def llm_stats():
+    stats = get_llm_stats()
+    stats['structured_output'] = get_structured_output_stats()
+    return jsonify(stats), 200
+
+@app.route('/api/changes', methods=['GET'])
+def recent_changes():
+    since = request.args.get('since', 0, type=int)
+    result = change_feed.get_recent_events(since)
+    result['listening'] = change_feed.is_listener_running()
+    return jsonify(result), 200
+
+@app.route('/api/admin/profile', methods=['GET'])
+@require_admin
+def profile_status():
+    status = profiler.get_profiler_status()
+    status['captured'] = profiler.list_profiles()
+    return jsonify(status), 200
+
+@app.route('/api/admin/profile/arm', methods=['POST'])
+@require_admin
+def profile_arm():
+    data = request.get_json(silent=True) or {}
+    count = data.get('count', 1)
+    if not isinstance(count, int) or count < 0:
+        return jsonify({'error': 'count must be a non-negative integer'}), 400
+    armed = profiler.arm(count, agent=data.get('agent'))
+    logger.info("Profiler armed: %s", armed)
+    return jsonify({'armed': armed}), 200
+
+@app.route('/api/admin/profile/<profile_id>', methods=['GET'])
+@require_admin
+def profile_download(profile_id):
+    profile = profiler.get_profile(profile_id)
+    if not profile:
+        return jsonify({'error': 'Profile not found'}), 404
+    if request.args.get('format') == 'pstats':
+        # Loadable with pstats.Stats(path), snakeviz or flameprof
+        return Response(profile['stats'], mimetype='application/octet-stream', headers={
+            'Content-Disposition': f'attachment; filename=profile_{profile_id}.pstats'
+        })
+    return Response(profile['summary'], mimetype='text/plain')
+
+@app.route('/api/admin/profile/sampler', methods=['POST'])
+@require_admin
+def profile_sampler():
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action == 'start':
+        try:
+            return jsonify(profiler.start_sampler(data.get('interval_ms'))), 200
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    if action == 'stop':
+        return jsonify(profiler.stop_sampler()), 200
+    return jsonify({'error': "action must be 'start' or 'stop'"}), 400
+
+@app.route('/api/admin/profile/sampler/stacks', methods=['GET'])
+@require_admin
+def profile_sampler_stacks():
+    reset = request.args.get('reset', 'false').lower() == 'true'
+    return Response(profiler.collapsed_stacks(reset=reset), mimetype='text/plain')
+
+@app.route('/api/admin/audit/partitions', methods=['GET'])
+@require_admin
+def audit_partitions():
+    return jsonify(partition_manager.get_maintenance_status()), 200
+
+@app.route('/api/admin/audit/maintenance', methods=['POST'])
+@require_admin
+def audit_maintenance():
+    data = request.get_json(silent=True) or {}
+    try:
+        result = partition_manager.run_maintenance(archive=bool(data.get('archive', True)))
+        return jsonify(result), 200
+    except Exception as e:
+        logger.exception("Partition maintenance failed")
+        return jsonify({'error': 'Partition maintenance failed', 'details': str(e)}), 500
+
 @app.route('/api/watchdog/run', methods=['GET'])
 def run_watchdog():
     return jsonify({
@@ -177,27 +661,13 @@ def run_watchdog():
     }), 200
 
 if __name__ == '__main__':
-    print("="*60)
-    print("Clinical Supply Chain Control Tower - Backend Starting...")
-    print("="*60)
+    logger.info("Clinical Supply Chain Control Tower - Backend Starting...")
     
     db_ok = check_database_connection()
-    llm_ok = check_llm_connection()
-    
-    print("="*60)
-    
     if not db_ok:
-        print("WARNING: Database connection failed. Some features may not work.")
-    
-    if not llm_ok:
-        print("WARNING: LLM connection failed. Agent queries will not work.")
-    
-    if db_ok and llm_ok:
-        print("All systems operational. Starting server...")
-    else:
-        print("Starting server with warnings...")
+        logger.warning("Database connection failed. Some features may not work.")
     
-    print("="*60)
-    print()
+    threading.Thread(target=check_llm_connection, name='llm-startup-check', daemon=True).start()
     
+    logger.info("Starting server...")
     app.run(debug=True, host='0.0.0.0', port=5000)
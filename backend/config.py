@@ -1,4 +1,5 @@
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,20 +9,137 @@ DB_USER = os.getenv('DB_USER', 'postgres')
 DB_PASS = os.getenv('DB_PASS', '')
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = os.getenv('DB_PORT', '5432')
+# Comma-separated host[:port] list; SELECT traffic is spread across these when set
+DB_REPLICA_HOSTS = os.getenv('DB_REPLICA_HOSTS', '')
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '30'))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv('DB_REPLICA_CHECK_SECONDS', '10'))
+DB_REPLICA_CONNECT_TIMEOUT_SECONDS = int(os.getenv('DB_REPLICA_CONNECT_TIMEOUT_SECONDS', '3'))
 
 LLM_API_KEY = os.getenv('LLM_API_KEY', '')  # HuggingFace token
 LLM_MODEL_NAME = os.getenv('LLM_MODEL_NAME', 'meta-llama/Llama-3.3-70B-Instruct:groq')
+LLM_BASE_URL = os.getenv('LLM_BASE_URL', 'https://router.huggingface.co/v1')
 
-# Initialize OpenAI client with HuggingFace router
-from openai import OpenAI
+# The OpenAI client (and the openai package) is only loaded on first LLM use
+_llm_client = None
+_llm_client_lock = threading.Lock()
 
-LLM_CLIENT = OpenAI(
-    base_url="https://router.huggingface.co/v1",
-    api_key=LLM_API_KEY
-) if LLM_API_KEY else None
+def get_llm_client():
+    global _llm_client
+    if _llm_client is None and LLM_API_KEY:
+        with _llm_client_lock:
+            if _llm_client is None:
+                from openai import OpenAI
+                _llm_client = OpenAI(
+                    base_url=LLM_BASE_URL,
+                    api_key=LLM_API_KEY
+                )
+    return _llm_client
+
+def __getattr__(name):
+    # Keeps `from config import LLM_CLIENT` working without building the client at import time
+    if name == 'LLM_CLIENT':
+        return get_llm_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 EXPIRY_WARNING_DAYS = int(os.getenv('EXPIRY_WARNING_DAYS', '90'))
 CRITICAL_EXPIRY = int(os.getenv('CRITICAL_EXPIRY', '30'))
 HIGH_EXPIRY = int(os.getenv('HIGH_EXPIRY', '60'))
 DEMAND_FORECAST_WEEKS = int(os.getenv('DEMAND_FORECAST_WEEKS', '8'))
 MAX_SQL_RETRY = int(os.getenv('MAX_SQL_RETRY', '3'))
+
+SQL_CACHE_ENABLED = os.getenv('SQL_CACHE_ENABLED', 'true').lower() == 'true'
+SQL_CACHE_MAX_MB = int(os.getenv('SQL_CACHE_MAX_MB', '64'))
+SQL_CACHE_TTL_SECONDS = int(os.getenv('SQL_CACHE_TTL_SECONDS', '300'))
+
+CHANGE_FEED_ENABLED = os.getenv('CHANGE_FEED_ENABLED', 'true').lower() == 'true'
+CHANGE_FEED_CHANNEL = os.getenv('CHANGE_FEED_CHANNEL', 'table_change')
+CHANGE_FEED_HISTORY = int(os.getenv('CHANGE_FEED_HISTORY', '500'))
+
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '30'))
+LLM_MAX_RETRY = int(os.getenv('LLM_MAX_RETRY', str(MAX_SQL_RETRY)))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '0.5'))
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', '8'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+
+BATCH_QUERY_CHUNK_SIZE = int(os.getenv('BATCH_QUERY_CHUNK_SIZE', '500'))
+BATCH_MAX_ENTITY_SETS = int(os.getenv('BATCH_MAX_ENTITY_SETS', '10000'))
+LLM_BATCH_CONCURRENCY = int(os.getenv('LLM_BATCH_CONCURRENCY', '4'))
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+OTEL_ENABLED = os.getenv('OTEL_ENABLED', 'false').lower() == 'true'
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+PROFILE_HISTORY = int(os.getenv('PROFILE_HISTORY', '20'))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '10'))
+PROFILE_SAMPLER_ENABLED = os.getenv('PROFILE_SAMPLER_ENABLED', 'false').lower() == 'true'
+
+AUDIT_PARTITION_MAINTENANCE = os.getenv('AUDIT_PARTITION_MAINTENANCE', 'true').lower() == 'true'
+AUDIT_PARTITION_MONTHS_AHEAD = int(os.getenv('AUDIT_PARTITION_MONTHS_AHEAD', '2'))
+AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', '12'))
+AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', 'archive')
+AUDIT_MAINTENANCE_INTERVAL_HOURS = float(os.getenv('AUDIT_MAINTENANCE_INTERVAL_HOURS', '24'))
+
+AUDIT_DEDUP_WINDOW_MINUTES = int(os.getenv('AUDIT_DEDUP_WINDOW_MINUTES', '60'))
+AUDIT_TEXT_MIN_CHARS = int(os.getenv('AUDIT_TEXT_MIN_CHARS', '120'))
+AUDIT_WRITE_POOL_SIZE = int(os.getenv('AUDIT_WRITE_POOL_SIZE', '4'))
+
+LLM_HEALTH_TTL_SECONDS = int(os.getenv('LLM_HEALTH_TTL_SECONDS', '300'))
+
+SQL_PAGE_MAX_ROWS = int(os.getenv('SQL_PAGE_MAX_ROWS', '5000'))
+SQL_EXPORT_BATCH_ROWS = int(os.getenv('SQL_EXPORT_BATCH_ROWS', '5000'))
+
+SQL_GUARD_ENABLED = os.getenv('SQL_GUARD_ENABLED', 'true').lower() == 'true'
+SQL_GUARD_MAX_COST = float(os.getenv('SQL_GUARD_MAX_COST', '5000000'))
+SQL_GUARD_MAX_ROWS = float(os.getenv('SQL_GUARD_MAX_ROWS', '10000000'))
+SQL_GUARD_TIMEOUT_MS = int(os.getenv('SQL_GUARD_TIMEOUT_MS', '15000'))
+SQL_GUARD_DEFAULT_LIMIT = int(os.getenv('SQL_GUARD_DEFAULT_LIMIT', '1000'))
+
+# Structured output for agent LLM calls: json_schema, json_object or none (prompt-only JSON)
+LLM_RESPONSE_FORMAT = os.getenv('LLM_RESPONSE_FORMAT', 'json_schema').lower()
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv('LLM_MAX_OUTPUT_TOKENS', '1000'))
+# Optional on-disk store of completions for byte-identical requests (disabled when empty)
+LLM_COMPLETION_STORE_PATH = os.getenv('LLM_COMPLETION_STORE_PATH', '')
+LLM_COMPLETION_STORE_TTL_SECONDS = int(os.getenv('LLM_COMPLETION_STORE_TTL_SECONDS', '86400'))
+LLM_COMPLETION_STORE_MAX_ENTRIES = int(os.getenv('LLM_COMPLETION_STORE_MAX_ENTRIES', '10000'))
+
+# Optional in-process llama.cpp model (GGUF file, requires llama-cpp-python) for simple tasks
+LOCAL_LLM_MODEL_PATH = os.getenv('LOCAL_LLM_MODEL_PATH', '')
+LOCAL_LLM_CONTEXT = int(os.getenv('LOCAL_LLM_CONTEXT', '4096'))
+LOCAL_LLM_THREADS = int(os.getenv('LOCAL_LLM_THREADS', '0'))  # 0 lets llama.cpp choose
+# Task -> provider, e.g. "intent=local,narrative=local"; tasks are intent, narrative and decision,
+# and unlisted tasks (or a local model that is not configured) use the remote endpoint
+LLM_TASK_ROUTES = {
+    task.strip(): provider.strip().lower()
+    for task, _, provider in (item.partition('=') for item in os.getenv('LLM_TASK_ROUTES', '').split(','))
+    if task.strip() and provider.strip()
+}
+
+# Session memory for follow-up queries (/api/query with session_id)
+SESSION_MAX_SESSIONS = int(os.getenv('SESSION_MAX_SESSIONS', '1000'))
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', '1800'))
+SESSION_RESULT_TTL_SECONDS = int(os.getenv('SESSION_RESULT_TTL_SECONDS', '300'))
+SESSION_MAX_MB = int(os.getenv('SESSION_MAX_MB', '64'))
+
+# Per-batch expiry-extension feasibility index (QA, stability, QDocs, RIM, country requirements)
+FEASIBILITY_ENABLED = os.getenv('FEASIBILITY_ENABLED', 'true').lower() == 'true'
+FEASIBILITY_REFRESH_SECONDS = int(os.getenv('FEASIBILITY_REFRESH_SECONDS', '900'))
+
+# Origin -> destination lead-time index for LogisticsAgent (ip_shipping_timelines_report)
+LANE_INDEX_ENABLED = os.getenv('LANE_INDEX_ENABLED', 'true').lower() == 'true'
+LANE_INDEX_REFRESH_SECONDS = int(os.getenv('LANE_INDEX_REFRESH_SECONDS', '300'))
+LANE_INDEX_FULL_REBUILD_SECONDS = int(os.getenv('LANE_INDEX_FULL_REBUILD_SECONDS', '21600'))
+LANE_MIN_SHIPMENTS = int(os.getenv('LANE_MIN_SHIPMENTS', '3'))
+LANE_TRANSFER_DAYS = float(os.getenv('LANE_TRANSFER_DAYS', '1'))
+
+# In-process material x country approval bitsets (rim, material_country_requirements)
+APPROVAL_MATRIX_ENABLED = os.getenv('APPROVAL_MATRIX_ENABLED', 'true').lower() == 'true'
+APPROVAL_MATRIX_REFRESH_SECONDS = int(os.getenv('APPROVAL_MATRIX_REFRESH_SECONDS', '900'))
+
+# Near-expiry stock redistribution planner (/api/redistribution/plan)
+REDISTRIBUTION_SOLVER = os.getenv('REDISTRIBUTION_SOLVER', 'greedy').lower()  # greedy | flow (needs networkx)
+REDISTRIBUTION_HORIZON_WEEKS = int(os.getenv('REDISTRIBUTION_HORIZON_WEEKS', '12'))
+REDISTRIBUTION_MIN_SHELF_DAYS = int(os.getenv('REDISTRIBUTION_MIN_SHELF_DAYS', '30'))
+REDISTRIBUTION_DEFAULT_LEAD_DAYS = float(os.getenv('REDISTRIBUTION_DEFAULT_LEAD_DAYS', '14'))
@@ -0,0 +1,54 @@
+-- Change feed: statement-level triggers publish a NOTIFY on the change-feed
+-- channel whenever a report table is written. Safe to re-run.
+--
+-- Pass the backend's CHANGE_FEED_CHANNEL with -v channel=<name> (default
+-- table_change). The backend only checks the installed channel and logs a
+-- warning when it differs from its own.
+
+\if :{?channel}
+\else
+\set channel table_change
+\endif
+
+SELECT format($f$
+CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        %L,
+        json_build_object('table', TG_TABLE_NAME, 'op', TG_OP)::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+$f$, :'channel') \gexec
+
+DO $$
+DECLARE
+    tbl TEXT;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY[
+        'affiliate_warehouse_inventory',
+        'allocated_materials',
+        'available_inventory_report',
+        'enrollment_rate_report',
+        'country_level_enrollment_report',
+        'distribution_order_report',
+        'ip_shipping_timelines_report',
+        'rim',
+        'material_country_requirements',
+        're-evaluation',
+        'qdocs',
+        'stability_documents'
+    ]
+    LOOP
+        IF to_regclass(format('public.%I', tbl)) IS NOT NULL THEN
+            EXECUTE format('DROP TRIGGER IF EXISTS change_feed_notify ON %I', tbl);
+            EXECUTE format(
+                'CREATE TRIGGER change_feed_notify '
+                'AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+                'FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change()',
+                tbl
+            );
+        END IF;
+    END LOOP;
+END $$;
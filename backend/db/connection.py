@@ -1,25 +1,90 @@
+from typing import Dict, List, Optional
+import itertools
+import logging
+import threading
+import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from config import DB_NAME, DB_USER, DB_PASS, DB_HOST, DB_PORT
+from psycopg2.pool import ThreadedConnectionPool
+from config import (
+    DB_NAME, DB_USER, DB_PASS, DB_HOST, DB_PORT,
+    DB_REPLICA_HOSTS, DB_REPLICA_MAX_LAG_SECONDS, DB_REPLICA_CHECK_SECONDS, DB_REPLICA_CONNECT_TIMEOUT_SECONDS
+)
+
+logger = logging.getLogger(__name__)
 
 _connection = None
 
+# Replay lag in seconds; a replica that has replayed everything it received is current even if the
+# primary has been idle (pg_last_xact_replay_timestamp would otherwise keep growing)
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END AS lag_seconds
+"""
+
+def _parse_replicas(value: str) -> List[Dict]:
+    replicas = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.partition(':')
+        replicas.append({
+            'host': host,
+            'port': port or DB_PORT,
+            'connection': None,
+            'healthy': False,
+            'lag_seconds': None,
+            'checked_at': 0.0,
+            'error': None
+        })
+    return replicas
+
+_replicas = _parse_replicas(DB_REPLICA_HOSTS)
+_replica_cycle = itertools.cycle(range(len(_replicas))) if _replicas else None
+_replica_lock = threading.Lock()
+_replica_monitor = {'thread': None}
+
+def create_connection(autocommit: bool = True, host: Optional[str] = None, port: Optional[str] = None,
+                      connect_timeout: Optional[int] = None):
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASS,
+            host=host or DB_HOST,
+            port=port or DB_PORT,
+            cursor_factory=RealDictCursor,
+            **({'connect_timeout': connect_timeout} if connect_timeout else {})
+        )
+        conn.autocommit = autocommit
+        return conn
+    except psycopg2.Error as e:
+        raise ConnectionError(f"Database connection failed: {str(e)}")
+
+def create_pool(maxconn: int, minconn: int = 0) -> ThreadedConnectionPool:
+    """Primary connections for callers that need their own transactions; they start non-autocommit."""
+    try:
+        return ThreadedConnectionPool(
+            minconn, maxconn,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASS,
+            host=DB_HOST,
+            port=DB_PORT,
+            cursor_factory=RealDictCursor
+        )
+    except psycopg2.Error as e:
+        raise ConnectionError(f"Database connection failed: {str(e)}")
+
 def get_connection():
     global _connection
     
     if _connection is None or _connection.closed:
-        try:
-            _connection = psycopg2.connect(
-                dbname=DB_NAME,
-                user=DB_USER,
-                password=DB_PASS,
-                host=DB_HOST,
-                port=DB_PORT,
-                cursor_factory=RealDictCursor
-            )
-            _connection.autocommit = True
-        except psycopg2.Error as e:
-            raise ConnectionError(f"Database connection failed: {str(e)}")
+        _connection = create_connection()
     
     try:
         cursor = _connection.cursor()
@@ -36,3 +101,87 @@ def close_connection():
     if _connection and not _connection.closed:
         _connection.close()
         _connection = None
+
+def _connect_replica(replica: Dict, autocommit: bool = True):
+    return create_connection(autocommit, host=replica['host'], port=replica['port'],
+                             connect_timeout=DB_REPLICA_CONNECT_TIMEOUT_SECONDS)
+
+def _check_replica(replica: Dict) -> None:
+    # Runs on the monitor thread without holding _replica_lock; results are published under it
+    conn = replica['connection']
+    try:
+        if conn is None or conn.closed:
+            conn = _connect_replica(replica)
+        cursor = conn.cursor()
+        cursor.execute(REPLICA_LAG_QUERY)
+        lag = float(cursor.fetchone()['lag_seconds'])
+        cursor.close()
+        update = {'connection': conn, 'lag_seconds': lag, 'healthy': lag <= DB_REPLICA_MAX_LAG_SECONDS, 'error': None}
+        if lag > DB_REPLICA_MAX_LAG_SECONDS:
+            logger.warning("Replica %s lagging %.1fs; reads go elsewhere", replica['host'], lag)
+    except (psycopg2.Error, ConnectionError) as e:
+        update = {'connection': None, 'healthy': False, 'error': str(e)[:200]}
+        logger.warning("Replica %s unavailable: %s", replica['host'], e)
+    update['checked_at'] = time.monotonic()
+    with _replica_lock:
+        replica.update(update)
+
+def _monitor_replicas() -> None:
+    while True:
+        for replica in _replicas:
+            _check_replica(replica)
+        time.sleep(DB_REPLICA_CHECK_SECONDS)
+
+def _start_replica_monitor() -> None:
+    with _replica_lock:
+        if _replica_monitor['thread'] is None:
+            thread = threading.Thread(target=_monitor_replicas, name='replica-monitor', daemon=True)
+            _replica_monitor['thread'] = thread
+            thread.start()
+
+def _next_replica() -> Optional[Dict]:
+    """Round-robin over replicas the monitor found reachable and within the lag limit.
+    
+    Health checks run on a background thread, so picking a replica never waits on the network; until
+    the first check completes, reads go to the primary.
+    """
+    if _replica_monitor['thread'] is None:
+        _start_replica_monitor()
+    with _replica_lock:
+        for _ in range(len(_replicas)):
+            replica = _replicas[next(_replica_cycle)]
+            if replica['healthy'] and replica['connection'] is not None:
+                return replica
+    return None
+
+def get_read_connection(primary: bool = False):
+    """Shared connection for SELECT traffic: a healthy replica when configured, else the primary.
+    
+    `primary` forces the primary, for reads whose result outlives the request (e.g. cached results).
+    """
+    replica = _next_replica() if _replicas and not primary else None
+    if replica is None:
+        return get_connection()
+    conn = replica['connection']
+    if conn.closed:
+        with _replica_lock:
+            replica.update({'healthy': False, 'connection': None})
+        return get_read_connection()
+    return conn
+
+def create_read_connection(autocommit: bool = True):
+    """Dedicated connection for long-running or cancellable reads, placed like get_read_connection()."""
+    replica = _next_replica() if _replicas else None
+    if replica is not None:
+        try:
+            return _connect_replica(replica, autocommit)
+        except ConnectionError as e:
+            logger.warning("Replica %s refused a dedicated connection: %s", replica['host'], e)
+    return create_connection(autocommit)
+
+def get_replica_status() -> List[Dict]:
+    with _replica_lock:
+        return [
+            {key: replica[key] for key in ('host', 'port', 'healthy', 'lag_seconds', 'error')}
+            for replica in _replicas
+        ]
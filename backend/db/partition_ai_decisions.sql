@@ -0,0 +1,60 @@
+-- Converts an unpartitioned ai_decisions table (created before monthly partitioning) into the
+-- partitioned layout, keeping ids and rows. Run once, before schema.sql; a no-op when the table
+-- is already partitioned or does not exist.
+
+DO $$
+DECLARE
+    idx TEXT;
+    month_start DATE;
+    last_month DATE;
+BEGIN
+    IF to_regclass('ai_decisions') IS NULL
+       OR EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'ai_decisions'::regclass) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE ai_decisions RENAME TO ai_decisions_unpartitioned;
+    ALTER TABLE ai_decisions_unpartitioned ADD COLUMN IF NOT EXISTS entities JSONB;
+
+    -- Free the index and constraint names for the partitioned table
+    FOR idx IN
+        SELECT indexname FROM pg_indexes
+        WHERE tablename = 'ai_decisions_unpartitioned' AND indexname <> 'ai_decisions_pkey'
+    LOOP
+        EXECUTE format('DROP INDEX %I', idx);
+    END LOOP;
+    ALTER TABLE ai_decisions_unpartitioned DROP CONSTRAINT IF EXISTS ai_decisions_pkey;
+
+    CREATE TABLE ai_decisions (
+        id INTEGER NOT NULL DEFAULT nextval('ai_decisions_id_seq'),
+        decision_json JSONB NOT NULL,
+        decision_type VARCHAR(50),
+        source_tables JSONB,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        entities JSONB,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+    -- Keep the sequence when the old table is dropped
+    ALTER SEQUENCE ai_decisions_id_seq OWNED BY ai_decisions.id;
+
+    SELECT date_trunc('month', COALESCE(MIN(timestamp), CURRENT_TIMESTAMP))::date
+    INTO month_start FROM ai_decisions_unpartitioned;
+    last_month := (date_trunc('month', CURRENT_DATE) + INTERVAL '2 months')::date;
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF ai_decisions FOR VALUES FROM (%L) TO (%L)',
+            'ai_decisions_p' || to_char(month_start, 'YYYY_MM'),
+            month_start,
+            (month_start + INTERVAL '1 month')::date
+        );
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    CREATE TABLE ai_decisions_default PARTITION OF ai_decisions DEFAULT;
+
+    INSERT INTO ai_decisions (id, decision_json, decision_type, source_tables, timestamp, entities)
+    SELECT id, decision_json, decision_type, source_tables, COALESCE(timestamp, CURRENT_TIMESTAMP), entities
+    FROM ai_decisions_unpartitioned;
+
+    DROP TABLE ai_decisions_unpartitioned;
+END;
+$$;
@@ -1,10 +1,84 @@
+-- ai_decisions is range-partitioned by month on timestamp. Partitions are created ahead of time
+-- and archived by tools/partition_manager.py; existing unpartitioned tables are converted by
+-- db/partition_ai_decisions.sql.
 CREATE TABLE IF NOT EXISTS ai_decisions (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     decision_json JSONB NOT NULL,
     decision_type VARCHAR(50),
     source_tables JSONB,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catches rows outside the managed monthly partitions
+CREATE TABLE IF NOT EXISTS ai_decisions_default PARTITION OF ai_decisions DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_ai_decisions_type ON ai_decisions(decision_type);
+
+-- Audit query columns. ADD COLUMN IF NOT EXISTS keeps this file re-runnable on existing databases;
+-- adding a stored generated column rewrites the table once.
+ALTER TABLE ai_decisions ADD COLUMN IF NOT EXISTS entities JSONB;
+ALTER TABLE ai_decisions ADD COLUMN IF NOT EXISTS severity VARCHAR(20)
+    GENERATED ALWAYS AS (upper(decision_json->>'severity')) STORED;
+ALTER TABLE ai_decisions ADD COLUMN IF NOT EXISTS decision VARCHAR(10)
+    GENERATED ALWAYS AS (upper(decision_json->>'decision')) STORED;
+ALTER TABLE ai_decisions ADD COLUMN IF NOT EXISTS trial_key TEXT
+    GENERATED ALWAYS AS (lower(entities->>'trial_id')) STORED;
+ALTER TABLE ai_decisions ADD COLUMN IF NOT EXISTS country_key TEXT
+    GENERATED ALWAYS AS (lower(entities->>'country')) STORED;
+
+-- Keyset pagination is ordered by (timestamp, id); each filter gets a matching composite index
+CREATE INDEX IF NOT EXISTS idx_ai_decisions_keyset ON ai_decisions(timestamp DESC, id DESC);
+-- The keyset index leads with timestamp and serves the same lookups; the old one only cost writes
+DROP INDEX IF EXISTS idx_ai_decisions_timestamp;
+CREATE INDEX IF NOT EXISTS idx_ai_decisions_type_keyset ON ai_decisions(decision_type, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_ai_decisions_severity_keyset ON ai_decisions(severity, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_ai_decisions_trial_keyset ON ai_decisions(trial_key, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_ai_decisions_country_keyset ON ai_decisions(country_key, timestamp DESC, id DESC);
+-- Ad-hoc containment queries, e.g. decision_json @> '{"risk_type": "EXPIRY"}'
+CREATE INDEX IF NOT EXISTS idx_ai_decisions_json ON ai_decisions USING GIN (decision_json jsonb_path_ops);
+
+-- Daily counts maintained by tools/partition_manager.py; they outlive archived partitions
+CREATE TABLE IF NOT EXISTS ai_decision_daily_rollups (
+    day DATE NOT NULL,
+    decision_type VARCHAR(50) NOT NULL,
+    severity VARCHAR(20) NOT NULL,
+    decision_count INTEGER NOT NULL,
+    yes_count INTEGER NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (day, decision_type, severity)
 );
 
-CREATE INDEX idx_ai_decisions_timestamp ON ai_decisions(timestamp DESC);
-CREATE INDEX idx_ai_decisions_type ON ai_decisions(decision_type);
+-- Last day rolled up by any backend process; the next run refreshes from there
+CREATE TABLE IF NOT EXISTS ai_decision_rollup_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    rolled_up_through DATE NOT NULL
+);
+
+-- Deduplicated storage: identical decisions for the same entities within AUDIT_DEDUP_WINDOW_MINUTES
+-- share one row with an occurrence counter, and long text fields are stored once by hash
+ALTER TABLE ai_decisions ADD COLUMN IF NOT EXISTS decision_hash CHAR(64);
+ALTER TABLE ai_decisions ADD COLUMN IF NOT EXISTS occurrence_count INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE ai_decisions ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_ai_decisions_hash ON ai_decisions(decision_hash, timestamp DESC);
+
+-- One row per decision hash pointing at the row of its current dedup window; writers claim it with
+-- INSERT ... ON CONFLICT, so concurrent first occurrences cannot both insert
+CREATE TABLE IF NOT EXISTS ai_decision_dedup (
+    decision_hash CHAR(64) PRIMARY KEY,
+    window_start TIMESTAMP NOT NULL,
+    decision_id BIGINT,
+    decision_timestamp TIMESTAMP
+);
+INSERT INTO ai_decision_dedup (decision_hash, window_start, decision_id, decision_timestamp)
+SELECT DISTINCT ON (decision_hash) decision_hash, timestamp, id, timestamp
+FROM ai_decisions
+WHERE decision_hash IS NOT NULL
+ORDER BY decision_hash, timestamp DESC
+ON CONFLICT (decision_hash) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS ai_decision_texts (
+    hash CHAR(64) PRIMARY KEY,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,270 @@
+from typing import Dict, Iterator, List, Optional
+import logging
+import re
+import threading
+import time
+from tools.sql_executor import run_sql_query
+from tools.dynamic_schema import get_dynamic_schema, find_column
+from tools.telemetry import span
+from config import APPROVAL_MATRIX_REFRESH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+RIM_TABLE = 'rim'
+REQUIREMENTS_TABLE = 'material_country_requirements'
+SOURCE_TABLES = [RIM_TABLE, REQUIREMENTS_TABLE]
+
+MATERIAL_TERMS = ['material', 'product', 'item']
+COUNTRY_TERMS = ['country', 'location', 'region']
+# Statuses held as bitsets; anything neither approved nor rejected counts as pending
+RIM_STATUSES = ('approved', 'pending', 'rejected')
+REQUIREMENT_FLAGS = ('required', 'non_compliant')
+# Whole status tokens: "Pending Approval" and "Not Approved" must not read as approved
+REJECTED_TOKENS = {'REJECTED', 'NOT_APPROVED', 'DENIED', 'REFUSED', 'WITHDRAWN', 'REVOKED', 'SUSPENDED'}
+PENDING_TOKENS = {'PENDING', 'PENDING_APPROVAL', 'SUBMITTED', 'UNDER_REVIEW', 'IN_REVIEW', 'DRAFT'}
+APPROVED_TOKENS = {'APPROVED', 'GRANTED', 'AUTHORISED', 'AUTHORIZED'}
+NON_COMPLIANT_TOKENS = {'NON_COMPLIANT', 'NONCOMPLIANT', 'NOT_COMPLIANT'}
+
+def _bits(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def _popcount(mask: int) -> int:
+    # int.bit_count() needs Python 3.10
+    return bin(mask).count('1')
+
+def _token(value: Optional[str]) -> str:
+    return re.sub(r'[^A-Z]+', '_', (value or '').upper()).strip('_')
+
+def _classify(status: Optional[str]) -> str:
+    token = _token(status)
+    if token in REJECTED_TOKENS:
+        return 'rejected'
+    if token in PENDING_TOKENS:
+        return 'pending'
+    if token in APPROVED_TOKENS:
+        return 'approved'
+    return 'pending'
+
+def _is_true(value) -> bool:
+    return str(value).strip().lower() in ('true', 't', 'yes', 'y', '1')
+
+class ApprovalMatrix:
+    """Material x country approval state as Python int bitsets, in both orientations.
+    
+    Every status has one mask per material (bit i = country i) and one per country (bit j = material j),
+    so "approved everywhere?" is a single AND and a per-country summary is a popcount. Country and
+    material indices are append-only, which keeps masks from the two tables aligned across reloads.
+    The change feed is statement-level and names only the table, so a change reloads that one table;
+    new masks are built aside and swapped in, and readers never see a half-applied reload.
+    """
+    
+    def __init__(self, refresh_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self._countries, self._country_index = [], {}
+        self._materials, self._material_index = [], {}
+        self._by_material = {status: {} for status in RIM_STATUSES + REQUIREMENT_FLAGS}
+        self._by_country = {status: {} for status in RIM_STATUSES + REQUIREMENT_FLAGS}
+        self._loaded_at = {table: None for table in SOURCE_TABLES}
+        self._dirty = set(SOURCE_TABLES)
+        self._lock = threading.Lock()
+        self.reloads = {table: 0 for table in SOURCE_TABLES}
+        self.last_error = None
+    
+    def _country(self, name: str) -> int:
+        key = name.strip().lower()
+        if key not in self._country_index:
+            self._country_index[key] = len(self._countries)
+            self._countries.append(name.strip())
+        return self._country_index[key]
+    
+    def _material(self, name: str) -> int:
+        key = name.strip().lower()
+        if key not in self._material_index:
+            self._material_index[key] = len(self._materials)
+            self._materials.append(name.strip())
+        return self._material_index[key]
+    
+    @staticmethod
+    def _query(table: str) -> Optional[str]:
+        schema = get_dynamic_schema(table)
+        if not schema['exists']:
+            return None
+        name = schema['table_name']
+        material, country = find_column(name, MATERIAL_TERMS), find_column(name, COUNTRY_TERMS)
+        if not (material and country):
+            return None
+        column = lambda found: f'"{found}"::text' if found else 'NULL::text'
+        if table == RIM_TABLE:
+            dated = find_column(name, ['approval_date', 'date'])
+            values = f"{column(find_column(name, ['approval_status', 'status', 'approval']))} AS status"
+            group = 'status'
+        else:
+            dated = None
+            values = (f"{column(find_column(name, ['required', 'mandatory']))} AS required, "
+                      f"{column(find_column(name, ['compliance', 'status']))} AS compliance_status")
+            group = 'required, compliance_status'
+        # Latest row per pair, then one row per material and state with its countries aggregated
+        return f"""
+        SELECT material_id, {group}, array_agg(country) AS countries
+        FROM (
+            SELECT DISTINCT ON (lower("{material}"::text), lower("{country}"::text))
+                   "{material}"::text AS material_id, "{country}"::text AS country, {values}
+            FROM "{name}"
+            WHERE "{material}" IS NOT NULL AND "{country}" IS NOT NULL
+            ORDER BY lower("{material}"::text), lower("{country}"::text){f', "{dated}" DESC NULLS LAST' if dated else ''}
+        ) latest
+        GROUP BY material_id, {group}
+        """
+    
+    def _reload(self, table: str) -> None:
+        self._dirty.discard(table)
+        query = self._query(table)
+        if query is None:
+            self._loaded_at[table] = time.time()
+            logger.warning("Approval matrix: table %s or its material/country columns not found", table)
+            return
+        try:
+            with span('approval_matrix_load', table=table):
+                rows = run_sql_query(query, primary=True)
+        except Exception as e:
+            self._dirty.add(table)
+            self.last_error = str(e)[:200]
+            raise
+        
+        statuses = RIM_STATUSES if table == RIM_TABLE else REQUIREMENT_FLAGS
+        by_material = {status: {} for status in statuses}
+        by_country = {status: {} for status in statuses}
+        for row in rows:
+            material = self._material(row['material_id'])
+            countries = 0
+            for name in row['countries']:
+                countries |= 1 << self._country(name)
+            if table == RIM_TABLE:
+                flags = [_classify(row['status'])]
+            else:
+                flags = [flag for flag, on in (
+                    ('required', _is_true(row['required'])),
+                    ('non_compliant', _token(row['compliance_status']) in NON_COMPLIANT_TOKENS)
+                ) if on]
+            for flag in flags:
+                by_material[flag][material] = by_material[flag].get(material, 0) | countries
+                for country in _bits(countries):
+                    by_country[flag][country] = by_country[flag].get(country, 0) | (1 << material)
+        
+        # Swap whole dicts so a reader holding the old one sees a consistent snapshot
+        self._by_material = dict(self._by_material, **by_material)
+        self._by_country = dict(self._by_country, **by_country)
+        self._loaded_at[table] = time.time()
+        self.reloads[table] += 1
+        self.last_error = None
+        logger.info("Approval matrix loaded %s: %s aggregate rows, %s materials x %s countries",
+                    table, len(rows), len(self._materials), len(self._countries))
+    
+    def _stale(self) -> List[str]:
+        now = time.time()
+        return [
+            table for table in SOURCE_TABLES
+            if table in self._dirty or self._loaded_at[table] is None or now - self._loaded_at[table] > self.refresh_seconds
+        ]
+    
+    def ensure_fresh(self) -> None:
+        if self._stale():
+            with self._lock:
+                for table in self._stale():
+                    self._reload(table)
+    
+    def handle_table_change(self, event: Dict) -> None:
+        # '*' follows a change-feed reconnect; reload both tables
+        self._dirty.update(SOURCE_TABLES if event['table'] == '*' else [event['table']])
+    
+    def check_material(self, material: str, countries: Optional[List[str]] = None) -> Optional[Dict]:
+        """Is `material` approved (and compliant) in every target country?
+        
+        Targets default to the countries where the material is required, else every country with an
+        approval record for it. None when the material is unknown.
+        """
+        self.ensure_fresh()
+        index = self._material_index.get(material.strip().lower())
+        if index is None:
+            return None
+        by_material = self._by_material
+        mask = lambda status: by_material[status].get(index, 0)
+        
+        unknown = []
+        if countries:
+            targets = 0
+            for name in countries:
+                country = self._country_index.get(name.strip().lower())
+                if country is None:
+                    unknown.append(name.strip())
+                else:
+                    targets |= 1 << country
+        else:
+            targets = mask('required') or (mask('approved') | mask('pending') | mask('rejected'))
+        
+        noncompliant = mask('non_compliant') & mask('required')
+        blocked = targets & ~(mask('approved') & ~noncompliant)
+        blocking = [{'country': name, 'reason': 'no approval record'} for name in unknown]
+        for country in _bits(blocked):
+            bit = 1 << country
+            if mask('rejected') & bit:
+                reason = 'rejected'
+            elif mask('pending') & bit:
+                reason = 'pending'
+            elif noncompliant & bit:
+                reason = 'non-compliant'
+            else:
+                reason = 'no approval record'
+            blocking.append({'country': self._countries[country], 'reason': reason})
+        
+        return {
+            'material_id': self._materials[index],
+            'approved_in_all': not blocking,
+            'target_countries': _popcount(targets) + len(unknown),
+            'approved_countries': _popcount(targets & ~blocked),
+            'blocking': blocking
+        }
+    
+    def country_summary(self, country: str) -> Optional[Dict]:
+        """Approval counts for every material in `country`, with the blocking materials. None if unknown."""
+        self.ensure_fresh()
+        index = self._country_index.get(country.strip().lower())
+        if index is None:
+            return None
+        by_country = self._by_country
+        mask = lambda status: by_country[status].get(index, 0)
+        noncompliant = mask('non_compliant') & mask('required')
+        unrecorded = mask('required') & ~(mask('approved') | mask('pending') | mask('rejected'))
+        
+        blocking = [
+            {'material_id': self._materials[material], 'reason': reason}
+            for reason, status_mask in (('rejected', mask('rejected')), ('pending', mask('pending')),
+                                        ('non-compliant', noncompliant & mask('approved')),
+                                        ('no approval record', unrecorded))
+            for material in _bits(status_mask)
+        ]
+        return {
+            'country': self._countries[index],
+            'approved': _popcount(mask('approved')),
+            'pending': _popcount(mask('pending')),
+            'rejected': _popcount(mask('rejected')),
+            'non_compliant': _popcount(noncompliant),
+            'no_record': _popcount(unrecorded),
+            'blocking': blocking
+        }
+    
+    def stats(self) -> Dict:
+        return {
+            'materials': len(self._materials),
+            'countries': len(self._countries),
+            'loaded_at': dict(self._loaded_at),
+            'reloads': dict(self.reloads),
+            'dirty': sorted(self._dirty),
+            'refresh_seconds': self.refresh_seconds,
+            'error': self.last_error
+        }
+
+approvals = ApprovalMatrix(APPROVAL_MATRIX_REFRESH_SECONDS)
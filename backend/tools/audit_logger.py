@@ -1,35 +1,291 @@
-from typing import Dict
-from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+import base64
+import hashlib
 import json
-from db.connection import get_connection
+import threading
+import psycopg2
+from db.connection import create_pool
+from tools.sql_executor import run_sql_query
+from config import AUDIT_DEDUP_WINDOW_MINUTES, AUDIT_TEXT_MIN_CHARS, AUDIT_WRITE_POOL_SIZE
 
-def log_decision(payload: Dict) -> None:
-    conn = get_connection()
+AUDIT_PAGE_MAX = 200
+# Seconds a write waits for a pooled connection before failing
+AUDIT_POOL_WAIT_SECONDS = 10
+# Marker for text fields moved to ai_decision_texts
+TEXT_REF = '$text'
+
+# Filter name -> (column, normalisation) for the generated/indexed columns in db/schema.sql
+AUDIT_FILTERS = {
+    'decision_type': ('decision_type', str.upper),
+    'severity': ('severity', str.upper),
+    'decision': ('decision', str.upper),
+    'trial': ('trial_key', str.lower),
+    'country': ('country_key', str.lower)
+}
+
+def decision_hash(payload: Dict, entities: Optional[Dict]) -> str:
+    canonical = json.dumps({'decision': payload, 'entities': entities or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def compact_decision(payload: Dict) -> Tuple[Dict, Dict[str, str]]:
+    """Replace long strings with {"$text": hash} references and drop fields stored in their own columns."""
+    texts = {}
+    
+    def compact(value):
+        if isinstance(value, str) and len(value) >= AUDIT_TEXT_MIN_CHARS:
+            digest = hashlib.sha256(value.encode()).hexdigest()
+            texts[digest] = value
+            return {TEXT_REF: digest}
+        if isinstance(value, dict):
+            return {key: compact(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [compact(item) for item in value]
+        return value
+    
+    compacted = {key: compact(value) for key, value in payload.items() if key != 'source_tables'}
+    return compacted, texts
+
+def _collect_refs(value, refs: set) -> None:
+    if isinstance(value, dict):
+        if set(value) == {TEXT_REF}:
+            refs.add(value[TEXT_REF])
+            return
+        for item in value.values():
+            _collect_refs(item, refs)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_refs(item, refs)
+
+def _expand(value, texts: Dict[str, str]):
+    if isinstance(value, dict):
+        if set(value) == {TEXT_REF}:
+            return texts.get(value[TEXT_REF], value)
+        return {key: _expand(item, texts) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand(item, texts) for item in value]
+    return value
+
+def expand_decisions(rows: List[Dict]) -> List[Dict]:
+    """Rebuild the original decision payload in row['decision_json'] with one text lookup per page."""
+    refs = set()
+    for row in rows:
+        _collect_refs(row.get('decision_json'), refs)
+    texts = {}
+    if refs:
+        texts = {
+            row['hash']: row['content']
+            for row in run_sql_query(
+                "SELECT hash, content FROM ai_decision_texts WHERE hash = ANY(%s)", (sorted(refs),)
+            )
+        }
+    for row in rows:
+        decision = row.get('decision_json')
+        if isinstance(decision, dict):
+            decision = _expand(decision, texts)
+            if row.get('source_tables') is not None:
+                decision.setdefault('source_tables', row['source_tables'])
+            row['decision_json'] = decision
+    return rows
+
+# Dedup needs a real transaction (the claim's row lock is held until commit), which the shared
+# autocommit connection cannot give. The pool is bounded and the semaphore makes writers queue for
+# a connection instead of getting PoolError when all are checked out.
+_pool = {'pool': None}
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(AUDIT_WRITE_POOL_SIZE)
+
+def _write_pool():
+    with _pool_lock:
+        if _pool['pool'] is None:
+            _pool['pool'] = create_pool(AUDIT_WRITE_POOL_SIZE)
+        return _pool['pool']
+
+def log_decision(payload: Dict, entities: Optional[Dict] = None) -> None:
+    if not _pool_slots.acquire(timeout=AUDIT_POOL_WAIT_SECONDS):
+        raise RuntimeError("Failed to log decision: no audit connection free")
+    try:
+        pool = _write_pool()
+        conn = pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        raise
+    try:
+        _log_decision(conn, payload, entities)
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+        _pool_slots.release()
+
+def _log_decision(conn, payload: Dict, entities: Optional[Dict]) -> None:
     cursor = conn.cursor()
     
     try:
-        insert_query = """
-        INSERT INTO ai_decisions (
-            decision_json,
-            decision_type,
-            source_tables,
-            timestamp
-        ) VALUES (%s, %s, %s, %s)
-        """
+        digest = decision_hash(payload, entities)
+        now = datetime.utcnow()
         
+        # Claim the hash. The row stays locked until commit, so a concurrent identical decision waits
+        # here and then sees the row this one inserts; only the claim that opens a window inserts
         cursor.execute(
-            insert_query,
-            (
-                json.dumps(payload),
-                payload.get('risk_type', 'UNKNOWN'),
-                json.dumps(payload.get('source_tables', [])),
-                datetime.utcnow()
-            )
+            """
+            INSERT INTO ai_decision_dedup AS d (decision_hash, window_start)
+            VALUES (%s, %s)
+            ON CONFLICT (decision_hash) DO UPDATE
+            SET window_start = CASE WHEN d.window_start < %s THEN EXCLUDED.window_start ELSE d.window_start END,
+                decision_id = CASE WHEN d.window_start < %s THEN NULL ELSE d.decision_id END,
+                decision_timestamp = CASE WHEN d.window_start < %s THEN NULL ELSE d.decision_timestamp END
+            RETURNING decision_id, decision_timestamp
+            """,
+            (digest, now) + (now - timedelta(minutes=AUDIT_DEDUP_WINDOW_MINUTES),) * 3
         )
+        claim = cursor.fetchone()
+        
+        if claim['decision_id'] is not None:
+            # Repeats within the window only bump the counter
+            cursor.execute(
+                """
+                UPDATE ai_decisions
+                SET occurrence_count = occurrence_count + 1, last_seen = %s
+                WHERE id = %s AND timestamp = %s
+                """,
+                (now, claim['decision_id'], claim['decision_timestamp'])
+            )
+        else:
+            compacted, texts = compact_decision(payload)
+            if texts:
+                cursor.executemany(
+                    "INSERT INTO ai_decision_texts (hash, content) VALUES (%s, %s) ON CONFLICT (hash) DO NOTHING",
+                    list(texts.items())
+                )
+            
+            insert_query = """
+            INSERT INTO ai_decisions (
+                decision_json,
+                decision_type,
+                source_tables,
+                entities,
+                decision_hash,
+                last_seen,
+                timestamp
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, timestamp
+            """
+            
+            cursor.execute(
+                insert_query,
+                (
+                    json.dumps(compacted),
+                    payload.get('risk_type', 'UNKNOWN'),
+                    json.dumps(payload.get('source_tables', [])),
+                    json.dumps(entities or {}, default=str),
+                    digest,
+                    now,
+                    now
+                )
+            )
+            inserted = cursor.fetchone()
+            cursor.execute(
+                "UPDATE ai_decision_dedup SET decision_id = %s, decision_timestamp = %s WHERE decision_hash = %s",
+                (inserted['id'], inserted['timestamp'], digest)
+            )
         
         conn.commit()
     except Exception as e:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            # Broken connection; closed here so the pool discards it
+            conn.close()
         raise RuntimeError(f"Failed to log decision: {str(e)}")
     finally:
         cursor.close()
+
+def encode_cursor(timestamp: datetime, decision_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{decision_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, decision_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(decision_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def _where(filters: Dict) -> Tuple[List[str], List]:
+    clauses, params = [], []
+    for name, (column, normalise) in AUDIT_FILTERS.items():
+        value = filters.get(name)
+        if value:
+            clauses.append(f"{column} = %s")
+            params.append(normalise(str(value).strip()))
+    if filters.get('since'):
+        clauses.append("timestamp >= %s")
+        params.append(filters['since'])
+    if filters.get('until'):
+        clauses.append("timestamp < %s")
+        params.append(filters['until'])
+    return clauses, params
+
+def query_decisions(filters: Dict, limit: int = 50, cursor: Optional[str] = None,
+                    include_json: bool = False) -> Dict:
+    """Newest-first page of decisions using keyset pagination on (timestamp, id)."""
+    limit = max(1, min(int(limit), AUDIT_PAGE_MAX))
+    clauses, params = _where(filters)
+    if cursor:
+        timestamp, decision_id = decode_cursor(cursor)
+        clauses.append("(timestamp, id) < (%s, %s)")
+        params.extend([timestamp, decision_id])
+    
+    columns = """
+        id, decision_type, severity, decision,
+        entities->>'trial_id' AS trial_id, entities->>'country' AS country,
+        source_tables, occurrence_count, last_seen, timestamp
+    """
+    if include_json:
+        columns += ", decision_json"
+    
+    query = f"""
+    SELECT {columns}
+    FROM ai_decisions
+    {'WHERE ' + ' AND '.join(clauses) if clauses else ''}
+    ORDER BY timestamp DESC, id DESC
+    LIMIT %s
+    """
+    rows = run_sql_query(query, params + [limit + 1])
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if include_json:
+        expand_decisions(rows)
+    next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id']) if has_more else None
+    return {'items': rows, 'count': len(rows), 'has_more': has_more, 'next_cursor': next_cursor}
+
+def summarize_decisions(filters: Dict) -> Dict:
+    clauses, params = _where(filters)
+    query = f"""
+    SELECT decision_type, severity, decision, SUM(occurrence_count) AS count,
+           GROUPING(decision_type) AS g_type, GROUPING(severity) AS g_severity, GROUPING(decision) AS g_decision
+    FROM ai_decisions
+    {'WHERE ' + ' AND '.join(clauses) if clauses else ''}
+    GROUP BY GROUPING SETS ((decision_type), (severity), (decision), ())
+    """
+    summary = {'total': 0, 'by_type': {}, 'by_severity': {}, 'by_decision': {}}
+    for row in run_sql_query(query, params or None):
+        if row['g_type'] and row['g_severity'] and row['g_decision']:
+            summary['total'] = row['count']
+        elif not row['g_type']:
+            summary['by_type'][row['decision_type'] or 'UNKNOWN'] = row['count']
+        elif not row['g_severity']:
+            summary['by_severity'][row['severity'] or 'UNKNOWN'] = row['count']
+        else:
+            summary['by_decision'][row['decision'] or 'UNKNOWN'] = row['count']
+    return summary
+
+def get_decision(decision_id: int) -> Optional[Dict]:
+    rows = run_sql_query("""
+        SELECT id, decision_json, decision_type, source_tables, entities,
+               occurrence_count, last_seen, timestamp
+        FROM ai_decisions
+        WHERE id = %s
+    """, (decision_id,))
+    return expand_decisions(rows)[0] if rows else None
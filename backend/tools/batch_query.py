@@ -0,0 +1,60 @@
+from typing import Callable, Dict, List, Optional, Sequence
+from datetime import date, datetime
+from decimal import Decimal
+import re
+from tools.sql_executor import run_sql_query
+from config import BATCH_QUERY_CHUNK_SIZE
+
+_NUMBER_PATTERN = re.compile(r'-?\d+(?:\.\d+)?')
+
+def _clean(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return None if value.lower() in ('', 'null', 'none') else value
+
+def build_keys_cte(entity_sets: Sequence[Dict], fields: Sequence[str]) -> tuple:
+    placeholders = '(%s' + ', %s::text' * len(fields) + ')'
+    params = []
+    for index, entities in enumerate(entity_sets):
+        params.append(index)
+        params.extend(_clean((entities or {}).get(field)) for field in fields)
+    values = ', '.join([placeholders] * len(entity_sets))
+    return f"keys(key_idx, {', '.join(fields)}) AS (VALUES {values})", params
+
+def key_match(column_expr: str, field: str) -> str:
+    # Same substring semantics as the single-query agents' ILIKE filters
+    return f"(k.{field} IS NULL OR {column_expr}::text ILIKE '%%' || k.{field} || '%%')"
+
+def run_keyed_query(entity_sets: Sequence[Dict], fields: Sequence[str],
+                    build_query: Callable[[str], str]) -> List[List[Dict]]:
+    groups = []
+    for start in range(0, len(entity_sets), BATCH_QUERY_CHUNK_SIZE):
+        chunk = entity_sets[start:start + BATCH_QUERY_CHUNK_SIZE]
+        cte, params = build_keys_cte(chunk, fields)
+        rows = run_sql_query(build_query(cte), params)
+        chunk_groups = [[] for _ in chunk]
+        for row in rows:
+            chunk_groups[row.pop('key_idx')].append(row)
+        groups.extend(chunk_groups)
+    return groups
+
+def to_date(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value.strip()[:10])
+        except ValueError:
+            return None
+    return None
+
+def to_number(value) -> Optional[float]:
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return float(value)
+    match = _NUMBER_PATTERN.search(str(value))
+    return float(match.group()) if match else None
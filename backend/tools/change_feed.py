@@ -0,0 +1,139 @@
+from typing import Callable, Dict, List, Optional
+from collections import deque
+from datetime import datetime
+import itertools
+import json
+import logging
+import re
+import select
+import threading
+from db.connection import create_connection
+from tools.query_cache import normalize_table_name
+from config import CHANGE_FEED_CHANNEL, CHANGE_FEED_HISTORY
+
+logger = logging.getLogger(__name__)
+
+# '*' is published after (re)connecting, since notifications may have been missed
+ALL_TABLES = '*'
+
+_subscribers = {}
+_subscriber_ids = itertools.count(1)
+_events = deque(maxlen=CHANGE_FEED_HISTORY)
+_sequence = 0
+_lock = threading.Lock()
+_listener_thread = None
+_stop_event = threading.Event()
+
+def subscribe(callback: Callable[[Dict], None], tables: Optional[List[str]] = None) -> int:
+    token = next(_subscriber_ids)
+    table_filter = {normalize_table_name(t) for t in tables} if tables else None
+    with _lock:
+        _subscribers[token] = (callback, table_filter)
+    return token
+
+def unsubscribe(token: int) -> None:
+    with _lock:
+        _subscribers.pop(token, None)
+
+def publish(table: str, op: str = 'UPDATE') -> Dict:
+    global _sequence
+    table = table if table == ALL_TABLES else normalize_table_name(table)
+    
+    with _lock:
+        _sequence += 1
+        event = {
+            'sequence': _sequence,
+            'table': table,
+            'op': op,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+        _events.append(event)
+        subscribers = list(_subscribers.values())
+    
+    for callback, table_filter in subscribers:
+        if table_filter is not None and table != ALL_TABLES and table not in table_filter:
+            continue
+        try:
+            callback(event)
+        except Exception as e:
+            logger.warning("Subscriber failed for %s: %s", table, e)
+    
+    return event
+
+def get_recent_events(since: int = 0) -> Dict:
+    with _lock:
+        return {
+            'sequence': _sequence,
+            'events': [event for event in _events if event['sequence'] > since]
+        }
+
+def _handle_payload(payload: str) -> None:
+    try:
+        message = json.loads(payload)
+        publish(message['table'], message.get('op', 'UPDATE'))
+    except (ValueError, KeyError):
+        publish(payload or ALL_TABLES)
+
+def _channel() -> str:
+    if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', CHANGE_FEED_CHANNEL):
+        raise ValueError(f"Invalid CHANGE_FEED_CHANNEL: {CHANGE_FEED_CHANNEL!r}")
+    return CHANGE_FEED_CHANNEL
+
+def check_notify_channel(cursor) -> bool:
+    """Warn when notify_table_change() (installed by db/change_feed.sql) publishes on another channel."""
+    cursor.execute("SELECT prosrc FROM pg_proc WHERE oid = to_regproc('notify_table_change')")
+    row = cursor.fetchone()
+    if row is None:
+        logger.warning("notify_table_change() is not installed; run db/change_feed.sql")
+        return False
+    if f"'{_channel()}'" not in row['prosrc']:
+        logger.warning("notify_table_change() does not publish on channel '%s'; re-run db/change_feed.sql "
+                       "with -v channel=%s", CHANGE_FEED_CHANNEL, CHANGE_FEED_CHANNEL)
+        return False
+    return True
+
+def _listen_loop() -> None:
+    backoff = 1
+    while not _stop_event.is_set():
+        conn = None
+        try:
+            conn = create_connection()
+            cursor = conn.cursor()
+            check_notify_channel(cursor)
+            # Quoted so a mixed-case channel is not folded to lower case and still matches pg_notify
+            cursor.execute(f'LISTEN "{_channel()}"')
+            cursor.close()
+            logger.info("Listening on channel '%s'", CHANGE_FEED_CHANNEL)
+            publish(ALL_TABLES, 'RESYNC')
+            backoff = 1
+            
+            while not _stop_event.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    _handle_payload(conn.notifies.pop(0).payload)
+        except Exception as e:
+            logger.warning("Listener error: %s. Reconnecting in %ss", e, backoff)
+            _stop_event.wait(backoff)
+            backoff = min(backoff * 2, 60)
+        finally:
+            if conn is not None and not conn.closed:
+                conn.close()
+
+def start_listener() -> bool:
+    global _listener_thread
+    if _listener_thread is not None and _listener_thread.is_alive():
+        return False
+    _stop_event.clear()
+    _listener_thread = threading.Thread(target=_listen_loop, name='change-feed-listener', daemon=True)
+    _listener_thread.start()
+    return True
+
+def stop_listener(timeout: float = 5.0) -> None:
+    _stop_event.set()
+    if _listener_thread is not None:
+        _listener_thread.join(timeout)
+
+def is_listener_running() -> bool:
+    return _listener_thread is not None and _listener_thread.is_alive()
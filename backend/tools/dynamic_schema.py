@@ -1,5 +1,9 @@
 from typing import Dict, List
+import logging
 from tools.sql_executor import run_sql_query
+from tools.telemetry import span
+
+logger = logging.getLogger(__name__)
 
 _schema_cache = None
 
@@ -14,7 +18,7 @@ def get_all_tables() -> List[str]:
         result = run_sql_query(query)
         return [row['table_name'] for row in result]
     except Exception as e:
-        print(f"Error fetching tables: {str(e)}")
+        logger.error("Error fetching tables: %s", e)
         return []
 
 def get_table_columns(table_name: str) -> List[str]:
@@ -28,7 +32,7 @@ def get_table_columns(table_name: str) -> List[str]:
         result = run_sql_query(query)
         return [row['column_name'] for row in result]
     except Exception as e:
-        print(f"Error fetching columns for {table_name}: {str(e)}")
+        logger.error("Error fetching columns for %s: %s", table_name, e)
         return []
 
 def build_schema_registry() -> Dict[str, List[str]]:
@@ -37,7 +41,7 @@ def build_schema_registry() -> Dict[str, List[str]]:
     if _schema_cache is not None:
         return _schema_cache
     
-    print("Building dynamic schema registry from database...")
+    logger.info("Building dynamic schema registry from database...")
     schema = {}
     tables = get_all_tables()
     
@@ -47,10 +51,14 @@ def build_schema_registry() -> Dict[str, List[str]]:
             schema[table] = columns
     
     _schema_cache = schema
-    print(f"Schema registry built with {len(schema)} tables")
+    logger.info("Schema registry built with %s tables", len(schema))
     return schema
 
 def get_dynamic_schema(table_name: str) -> Dict:
+    with span('schema_resolution'):
+        return _resolve_schema(table_name)
+
+def _resolve_schema(table_name: str) -> Dict:
     schema_registry = build_schema_registry()
     
     table_name_normalized = table_name.lower().replace('_', '').replace('-', '')
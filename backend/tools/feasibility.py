@@ -0,0 +1,377 @@
+from typing import Dict, List, Optional
+from datetime import date
+import logging
+import re
+import threading
+import time
+from tools.sql_executor import run_sql_query
+from tools.dynamic_schema import get_dynamic_schema, find_column
+from tools.telemetry import span
+from config import FEASIBILITY_REFRESH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Tables joined by the feasibility query; a change to any of them marks the index stale
+SOURCE_TABLES = [
+    're-evaluation', 'stability_documents', 'qdocs', 'rim', 'material_country_requirements',
+    'available_inventory_report'
+]
+
+BATCH_TERMS = ['batch', 'lot']
+MATERIAL_TERMS = ['material', 'product', 'item']
+COUNTRY_TERMS = ['country', 'location', 'region']
+
+# Statuses are compared as whole tokens ("Pending Approval" is neither approved nor passed)
+PASS_TOKENS = {'PASS', 'PASSED', 'SUCCESS', 'SUCCESSFUL', 'EXTENDED', 'ACCEPTED', 'APPROVED', 'STABLE', 'WITHIN_SPEC'}
+FAIL_TOKENS = {'FAIL', 'FAILED', 'REJECTED', 'NOT_APPROVED', 'OOS', 'OUT_OF_SPEC', 'OUT_OF_SPECIFICATION',
+               'UNSTABLE', 'NOT_STABLE'}
+APPROVED_TOKENS = {'APPROVED', 'GRANTED', 'AUTHORISED', 'AUTHORIZED'}
+REJECTED_TOKENS = {'REJECTED', 'NOT_APPROVED', 'DENIED', 'REFUSED', 'WITHDRAWN', 'REVOKED', 'SUSPENDED'}
+NON_COMPLIANT_TOKENS = {'NON_COMPLIANT', 'NONCOMPLIANT', 'NOT_COMPLIANT'}
+SEVERITY_ORDER = {'MEDIUM': 1, 'HIGH': 2, 'CRITICAL': 3}
+# A failed build is retried after this many seconds, doubling per consecutive failure up to the refresh interval
+RETRY_BASE_SECONDS = 30
+
+_index = {
+    'batches': {}, 'materials': {}, 'built_at': None, 'build_ms': None, 'stale': True, 'error': None,
+    'failed_at': None, 'failures': 0
+}
+_build_lock = threading.Lock()
+_lookups = 0
+
+def _column(table: str, terms: List[str], alias: str) -> str:
+    column = find_column(table, terms)
+    return f'{alias}."{column}"' if column else 'NULL'
+
+def _source(table: str) -> Optional[str]:
+    schema = get_dynamic_schema(table)
+    return '"' + schema['table_name'] + '"' if schema['exists'] else None
+
+def _empty(columns: str) -> str:
+    return f"SELECT {columns} WHERE FALSE"
+
+def build_query() -> str:
+    """One set-based query returning a row per batch with its QA, stability, document and regulatory facts.
+    
+    A missing table or batch/material/country column degrades to an empty CTE, so the index still
+    builds from whatever subset of the five sources exists.
+    """
+    reeval, stability, qdocs = _source('re-evaluation'), _source('stability_documents'), _source('qdocs')
+    rim, requirements = _source('rim'), _source('material_country_requirements')
+    inventory = _source('available_inventory_report')
+    
+    batch = _column('re-evaluation', BATCH_TERMS, 'r')
+    evaluated = _column('re-evaluation', ['evaluation_date', 'date'], 'r')
+    reeval_cte = f"""
+        SELECT DISTINCT ON (lower({batch}::text)) lower({batch}::text) AS batch_key, {batch}::text AS batch_id,
+               {_column('re-evaluation', ['result', 'outcome', 'status'], 'r')}::text AS reeval_result,
+               {evaluated}::date AS reeval_date,
+               {_column('re-evaluation', ['extended_expiry', 'expiry'], 'r')}::date AS extended_expiry,
+               COUNT(*) OVER (PARTITION BY lower({batch}::text)) AS reeval_count
+        FROM {reeval} r
+        ORDER BY lower({batch}::text), {evaluated} DESC NULLS LAST
+    """ if reeval and batch != 'NULL' else _empty(
+        "NULL::text AS batch_key, NULL::text AS batch_id, NULL::text AS reeval_result, "
+        "NULL::date AS reeval_date, NULL::date AS extended_expiry, 0::bigint AS reeval_count"
+    )
+    
+    batch = _column('stability_documents', BATCH_TERMS, 's')
+    tested = _column('stability_documents', ['test_date', 'date'], 's')
+    stability_cte = f"""
+        SELECT DISTINCT ON (lower({batch}::text)) lower({batch}::text) AS batch_key, {batch}::text AS batch_id,
+               {_column('stability_documents', ['stability_status', 'status', 'result'], 's')}::text AS stability_status,
+               {tested}::date AS stability_date
+        FROM {stability} s
+        ORDER BY lower({batch}::text), {tested} DESC NULLS LAST
+    """ if stability and batch != 'NULL' else _empty(
+        "NULL::text AS batch_key, NULL::text AS batch_id, NULL::text AS stability_status, NULL::date AS stability_date"
+    )
+    
+    batch = _column('qdocs', BATCH_TERMS, 'd')
+    doc_type = _column('qdocs', ['doc_type', 'type', 'doc_id'], 'd')
+    doc_status = _column('qdocs', ['status', 'approval'], 'd')
+    docs_cte = f"""
+        SELECT lower({batch}::text) AS batch_key, MIN({batch}::text) AS batch_id, COUNT(*) AS doc_count,
+               array_agg({doc_type}::text ORDER BY {doc_type}::text)
+                   FILTER (WHERE btrim(regexp_replace(upper(COALESCE({doc_status}::text, '')), '[^A-Z]+', '_', 'g'), '_')
+                           NOT IN ({', '.join(f"'{token}'" for token in sorted(APPROVED_TOKENS))})) AS open_docs
+        FROM {qdocs} d
+        GROUP BY lower({batch}::text)
+    """ if qdocs and batch != 'NULL' else _empty(
+        "NULL::text AS batch_key, NULL::text AS batch_id, 0::bigint AS doc_count, NULL::text[] AS open_docs"
+    )
+    
+    # Batches only reach RIM and the country requirements through the material they were made from
+    batch = _column('available_inventory_report', BATCH_TERMS, 'i')
+    material = _column('available_inventory_report', MATERIAL_TERMS, 'i')
+    materials_cte = f"""
+        SELECT DISTINCT ON (lower({batch}::text)) lower({batch}::text) AS batch_key, {batch}::text AS batch_id,
+               {material}::text AS material_id
+        FROM {inventory} i
+        WHERE {material} IS NOT NULL
+        ORDER BY lower({batch}::text)
+    """ if inventory and 'NULL' not in (batch, material) else _empty(
+        "NULL::text AS batch_key, NULL::text AS batch_id, NULL::text AS material_id"
+    )
+    
+    material, country = _column('rim', MATERIAL_TERMS, 'a'), _column('rim', COUNTRY_TERMS, 'a')
+    approvals_cte = f"""
+        SELECT lower({material}::text) AS material_key, lower({country}::text) AS country_key,
+               {country}::text AS country,
+               {_column('rim', ['approval_status', 'status', 'approval'], 'a')}::text AS approval_status
+        FROM {rim} a
+    """ if rim and 'NULL' not in (material, country) else _empty(
+        "NULL::text AS material_key, NULL::text AS country_key, NULL::text AS country, NULL::text AS approval_status"
+    )
+    
+    table = 'material_country_requirements'
+    material, country = _column(table, MATERIAL_TERMS, 'q'), _column(table, COUNTRY_TERMS, 'q')
+    requirements_cte = f"""
+        SELECT lower({material}::text) AS material_key, lower({country}::text) AS country_key,
+               {country}::text AS country,
+               {_column(table, ['required', 'mandatory'], 'q')}::text AS required,
+               {_column(table, ['compliance', 'status'], 'q')}::text AS compliance_status
+        FROM {requirements} q
+    """ if requirements and 'NULL' not in (material, country) else _empty(
+        "NULL::text AS material_key, NULL::text AS country_key, NULL::text AS country, "
+        "NULL::text AS required, NULL::text AS compliance_status"
+    )
+    
+    return f"""
+    WITH reeval AS ({reeval_cte}),
+    stability AS ({stability_cte}),
+    docs AS ({docs_cte}),
+    materials AS ({materials_cte}),
+    approvals AS ({approvals_cte}),
+    requirements AS ({requirements_cte}),
+    regulatory AS (
+        SELECT COALESCE(a.material_key, q.material_key) AS material_key,
+               jsonb_object_agg(COALESCE(a.country_key, q.country_key), jsonb_build_object(
+                   'country', COALESCE(a.country, q.country),
+                   'approval_status', a.approval_status,
+                   'required', q.required,
+                   'compliance_status', q.compliance_status
+               )) AS countries
+        FROM approvals a
+        FULL JOIN requirements q ON q.material_key = a.material_key AND q.country_key = a.country_key
+        WHERE COALESCE(a.material_key, q.material_key) IS NOT NULL
+          AND COALESCE(a.country_key, q.country_key) IS NOT NULL
+        GROUP BY 1
+    ),
+    batches AS (
+        SELECT batch_key, MIN(batch_id) AS batch_id
+        FROM (
+            SELECT batch_key, batch_id FROM reeval
+            UNION ALL SELECT batch_key, batch_id FROM stability
+            UNION ALL SELECT batch_key, batch_id FROM docs
+            UNION ALL SELECT batch_key, batch_id FROM materials
+        ) keys
+        WHERE batch_key IS NOT NULL
+        GROUP BY batch_key
+    )
+    SELECT b.batch_key, b.batch_id, m.material_id,
+           r.reeval_result, r.reeval_date, r.extended_expiry, COALESCE(r.reeval_count, 0) AS reeval_count,
+           s.stability_status, s.stability_date,
+           COALESCE(d.doc_count, 0) AS doc_count, d.open_docs,
+           lower(m.material_id) AS material_key, g.countries
+    FROM batches b
+    LEFT JOIN reeval r ON r.batch_key = b.batch_key
+    LEFT JOIN stability s ON s.batch_key = b.batch_key
+    LEFT JOIN docs d ON d.batch_key = b.batch_key
+    LEFT JOIN materials m ON m.batch_key = b.batch_key
+    LEFT JOIN regulatory g ON g.material_key = lower(m.material_id)
+    """
+
+def _rebuild() -> None:
+    started = time.perf_counter()
+    # Cleared before querying, so a change that lands mid-build triggers another one
+    _index['stale'] = False
+    try:
+        with span('feasibility_build'):
+            rows = run_sql_query(build_query(), primary=True)
+    except Exception as e:
+        _index.update({'error': str(e)[:200], 'stale': True, 'failed_at': time.time(),
+                       'failures': _index['failures'] + 1})
+        logger.error("Feasibility index build failed (%s in a row): %s", _index['failures'], e)
+        raise
+    
+    batches, materials = {}, {}
+    for row in rows:
+        countries = row.pop('countries')
+        material_key = row.pop('material_key')
+        if material_key and material_key not in materials:
+            # Every batch of a material shares one country map
+            materials[material_key] = countries or {}
+        for key in ('reeval_date', 'extended_expiry', 'stability_date'):
+            if isinstance(row[key], date):
+                row[key] = row[key].isoformat()
+        row['open_docs'] = row['open_docs'] or []
+        row['material_key'] = material_key
+        batches[row.pop('batch_key')] = row
+    
+    _index.update({
+        'batches': batches,
+        'materials': materials,
+        'built_at': time.time(),
+        'build_ms': round((time.perf_counter() - started) * 1000, 1),
+        'error': None,
+        'failed_at': None,
+        'failures': 0
+    })
+    logger.info("Feasibility index built: %s batches, %s materials in %.0f ms",
+                len(batches), len(materials), _index['build_ms'])
+
+def _is_stale() -> bool:
+    built_at = _index['built_at']
+    return _index['stale'] or built_at is None or time.time() - built_at > FEASIBILITY_REFRESH_SECONDS
+
+def refresh() -> Dict:
+    """Rebuild the per-batch index from one execution of the feasibility query."""
+    with _build_lock:
+        _rebuild()
+    return stats()
+
+def handle_table_change(event: Dict) -> None:
+    # Subscribed with SOURCE_TABLES, so every event here touches a joined table
+    _index['stale'] = True
+
+def _backing_off() -> bool:
+    failed_at = _index['failed_at']
+    if failed_at is None:
+        return False
+    delay = min(FEASIBILITY_REFRESH_SECONDS, RETRY_BASE_SECONDS * 2 ** (_index['failures'] - 1))
+    return time.time() - failed_at < delay
+
+def _ensure_fresh() -> None:
+    if _is_stale() and not _backing_off():
+        with _build_lock:
+            # Concurrent lookups wait for one rebuild instead of each running the query
+            if _is_stale() and not _backing_off():
+                try:
+                    _rebuild()
+                except Exception:
+                    if _index['built_at'] is None:
+                        raise
+    # After a failed build the last good index keeps serving until the retry
+    if _index['built_at'] is None:
+        raise RuntimeError(f"Feasibility index unavailable: {_index['error']}")
+
+def _token(value: Optional[str]) -> str:
+    return re.sub(r'[^A-Z]+', '_', (value or '').upper()).strip('_')
+
+def _has(value: Optional[str], tokens: set) -> bool:
+    return _token(value) in tokens
+
+def _quality_checks(record: Dict) -> List[Dict]:
+    checks = []
+    
+    result = record['reeval_result']
+    if not record['reeval_count']:
+        checks.append({'check': 're-evaluation', 'status': 'blocked', 'severity': 'HIGH',
+                       'detail': 'No re-evaluation on record; required before extension'})
+    elif _has(result, FAIL_TOKENS):
+        checks.append({'check': 're-evaluation', 'status': 'blocked', 'severity': 'HIGH',
+                       'detail': f"Latest re-evaluation ({record['reeval_date']}) failed: {result}"})
+    elif _has(result, PASS_TOKENS):
+        checks.append({'check': 're-evaluation', 'status': 'ok', 'severity': None,
+                       'detail': f"Latest re-evaluation ({record['reeval_date']}) passed"})
+    else:
+        checks.append({'check': 're-evaluation', 'status': 'pending', 'severity': 'MEDIUM',
+                       'detail': f"Latest re-evaluation ({record['reeval_date']}) is {result or 'without a result'}"})
+    
+    status = record['stability_status']
+    if not status:
+        checks.append({'check': 'stability', 'status': 'pending', 'severity': 'MEDIUM',
+                       'detail': 'No stability data on record'})
+    elif _has(status, FAIL_TOKENS):
+        checks.append({'check': 'stability', 'status': 'blocked', 'severity': 'HIGH',
+                       'detail': f"Latest stability result ({record['stability_date']}) is {status}"})
+    elif _has(status, PASS_TOKENS):
+        checks.append({'check': 'stability', 'status': 'ok', 'severity': None,
+                       'detail': f"Stable as of {record['stability_date']}"})
+    else:
+        checks.append({'check': 'stability', 'status': 'pending', 'severity': 'MEDIUM',
+                       'detail': f"Latest stability result ({record['stability_date']}) is {status}"})
+    
+    if record['open_docs']:
+        checks.append({'check': 'qdocs', 'status': 'pending', 'severity': 'MEDIUM',
+                       'detail': f"Unapproved quality documents: {', '.join(record['open_docs'])}"})
+    elif not record['doc_count']:
+        checks.append({'check': 'qdocs', 'status': 'pending', 'severity': 'MEDIUM',
+                       'detail': 'No quality documents on record'})
+    else:
+        checks.append({'check': 'qdocs', 'status': 'ok', 'severity': None,
+                       'detail': f"All {record['doc_count']} quality documents approved"})
+    return checks
+
+def _regulatory_check(record: Dict, country: str) -> Dict:
+    if not record['material_key']:
+        return {'check': 'regulatory', 'status': 'pending', 'severity': 'MEDIUM',
+                'detail': 'Material of this batch is unknown; regulatory status not derivable'}
+    entry = _index['materials'].get(record['material_key'], {}).get(country.strip().lower())
+    if entry is None:
+        return {'check': 'regulatory', 'status': 'blocked', 'severity': 'CRITICAL',
+                'detail': f"No approval for {record['material_id']} in {country}"}
+    
+    approval = entry.get('approval_status')
+    required = str(entry.get('required') or '').lower() in ('true', 't', 'yes', 'y', '1')
+    if _has(approval, REJECTED_TOKENS):
+        return {'check': 'regulatory', 'status': 'blocked', 'severity': 'CRITICAL',
+                'detail': f"{record['material_id']} approval rejected in {entry['country']}"}
+    if required and _has(entry.get('compliance_status'), NON_COMPLIANT_TOKENS):
+        return {'check': 'regulatory', 'status': 'blocked', 'severity': 'HIGH',
+                'detail': f"{record['material_id']} is non-compliant with requirements in {entry['country']}"}
+    if not _has(approval, APPROVED_TOKENS):
+        return {'check': 'regulatory', 'status': 'pending', 'severity': 'MEDIUM',
+                'detail': f"{record['material_id']} approval in {entry['country']} is {approval or 'not on record'}"}
+    return {'check': 'regulatory', 'status': 'ok', 'severity': None,
+            'detail': f"{record['material_id']} approved in {entry['country']}"}
+
+def approved_countries(record: Dict) -> List[str]:
+    countries = _index['materials'].get(record['material_key'] or '', {}).values()
+    return sorted(entry['country'] for entry in countries if _has(entry.get('approval_status'), APPROVED_TOKENS))
+
+def check_extension(batch_id: str, country: Optional[str] = None) -> Optional[Dict]:
+    """Can `batch_id` have its expiry extended (in `country`)? None when the batch is not indexed."""
+    global _lookups
+    _ensure_fresh()
+    record = _index['batches'].get((batch_id or '').strip().lower())
+    if record is None:
+        return None
+    _lookups += 1
+    
+    checks = _quality_checks(record)
+    if country:
+        checks.append(_regulatory_check(record, country))
+    blocked = [check for check in checks if check['status'] == 'blocked']
+    pending = [check for check in checks if check['status'] == 'pending']
+    
+    if blocked:
+        severity = max((check['severity'] for check in blocked), key=SEVERITY_ORDER.get)
+    else:
+        severity = 'MEDIUM'
+    return {
+        'batch_id': record['batch_id'],
+        'material_id': record['material_id'],
+        'country': country,
+        'feasible': not blocked and not pending,
+        'decision': 'NO' if blocked or pending else 'YES',
+        'severity': severity,
+        'extended_expiry': record['extended_expiry'],
+        'checks': checks,
+        'approved_countries': None if country else approved_countries(record),
+        'index_built_at': _index['built_at']
+    }
+
+def stats() -> Dict:
+    return {
+        'batches': len(_index['batches']),
+        'materials': len(_index['materials']),
+        'built_at': _index['built_at'],
+        'build_ms': _index['build_ms'],
+        'stale': _index['stale'],
+        'refresh_seconds': FEASIBILITY_REFRESH_SECONDS,
+        'lookups': _lookups,
+        'error': _index['error'],
+        'consecutive_failures': _index['failures']
+    }
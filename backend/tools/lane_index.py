@@ -0,0 +1,326 @@
+from typing import Dict, List, Optional, Tuple
+from collections import Counter
+from datetime import date
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from tools.sql_executor import run_sql_query
+from tools.dynamic_schema import get_dynamic_schema, find_column
+from tools.telemetry import span
+from config import LANE_INDEX_REFRESH_SECONDS, LANE_INDEX_FULL_REBUILD_SECONDS, LANE_TRANSFER_DAYS, LANE_MIN_SHIPMENTS
+
+logger = logging.getLogger(__name__)
+
+SOURCE_TABLE = 'ip_shipping_timelines_report'
+LEAD_TIME_TERMS = ['lead_time', 'lead', 'transit', 'duration', 'days']
+PLANNED_TERMS = ['planned', 'target', 'promised']
+# Months of history the trend slope is fitted over
+TREND_MONTHS = 6
+# Slopes below this many days per month are reported as stable
+TREND_TOLERANCE = 0.25
+
+_state = {
+    'lanes': {}, 'stats': {}, 'graph': {}, 'watermark': None, 'columns': None,
+    'built_at': None, 'full_built_at': None, 'build_ms': None, 'dirty': True, 'error': None,
+    'full_builds': 0, 'incremental_builds': 0
+}
+_build_lock = threading.Lock()
+
+def _new_part() -> Dict:
+    return {'days': Counter(), 'months': {}, 'shipments': 0, 'on_time': 0, 'planned': 0}
+
+def lead_time_column(table: str = SOURCE_TABLE) -> Optional[str]:
+    """The actual lead-time column of `table`, never its planned one."""
+    schema = get_dynamic_schema(table)
+    if not schema['exists']:
+        return None
+    # 'planned_lead_time_days' also matches the lead time terms; prefer the actual column
+    planned = find_column(schema['table_name'], PLANNED_TERMS)
+    return next(
+        (column for column in schema['columns']
+         if column != planned and any(term in column.lower() for term in LEAD_TIME_TERMS)),
+        None
+    )
+
+def _resolve_columns() -> Optional[Dict]:
+    schema = get_dynamic_schema(SOURCE_TABLE)
+    if not schema['exists']:
+        return None
+    table = schema['table_name']
+    columns = {
+        'table': '"' + table + '"',
+        'origin': find_column(table, ['origin', 'source', 'from', 'depot']),
+        'destination': find_column(table, ['destination', 'location', 'country']),
+        'planned': find_column(table, PLANNED_TERMS),
+        'ship_date': find_column(table, ['ship_date', 'shipped', 'dispatch', 'date']),
+        'lead': lead_time_column(table)
+    }
+    if not (columns['origin'] and columns['destination'] and columns['lead']):
+        return None
+    return columns
+
+def build_query(columns: Dict, incremental: bool) -> str:
+    """Lead-time histogram per lane, month and tail flag, aggregated in the database over the full history.
+    
+    Rows shipped on or after the watermark (the latest ship date at the last full build) form the
+    lane's tail. Incremental refreshes re-read only the tail, so appended shipments are folded in
+    exactly without rescanning settled history.
+    """
+    col = lambda name: f't."{columns[name]}"' if columns[name] else 'NULL'
+    lead, planned, shipped = col('lead'), col('planned'), col('ship_date')
+    if not columns['ship_date']:
+        tail, since = 'FALSE', ''
+    elif incremental:
+        tail, since = 'TRUE', f'AND {shipped}::date >= %s'
+    else:
+        tail, since = f"{shipped}::date >= (SELECT MAX(\"{columns['ship_date']}\")::date FROM {columns['table']})", ''
+    return f"""
+    SELECT {col('origin')}::text AS origin, {col('destination')}::text AS destination,
+           date_trunc('month', {shipped}::date)::date AS month,
+           round({lead}::numeric, 1)::float AS days,
+           {tail} AS tail,
+           COUNT(*) AS shipments,
+           COUNT(*) FILTER (WHERE {lead} <= {planned}) AS on_time,
+           COUNT({planned}) AS planned,
+           MAX({shipped}::date) AS last_ship
+    FROM {columns['table']} t
+    WHERE {lead} IS NOT NULL AND {col('origin')} IS NOT NULL AND {col('destination')} IS NOT NULL {since}
+    GROUP BY 1, 2, 3, 4, 5
+    """
+
+def _fold(lanes: Dict, rows: List[Dict], tails_only: bool) -> Optional[date]:
+    latest = None
+    for row in rows:
+        key = (row['origin'].strip().lower(), row['destination'].strip().lower())
+        lane = lanes.get(key)
+        if lane is None:
+            lane = lanes[key] = {'origin': row['origin'].strip(), 'destination': row['destination'].strip(),
+                                 'settled': _new_part(), 'tail': _new_part()}
+        part = lane['tail'] if tails_only or row['tail'] else lane['settled']
+        shipments = row['shipments']
+        part['days'][row['days']] += shipments
+        part['shipments'] += shipments
+        part['on_time'] += row['on_time']
+        part['planned'] += row['planned']
+        if row['month'] is not None:
+            month = part['months'].setdefault(row['month'], [0, 0.0])
+            month[0] += shipments
+            month[1] += row['days'] * shipments
+        if row['last_ship'] is not None and (latest is None or row['last_ship'] > latest):
+            latest = row['last_ship']
+    return latest
+
+def _percentile(days: List[Tuple[float, int]], total: int, q: float) -> float:
+    # Nearest-rank percentile over the (value, count) histogram
+    rank = max(1, math.ceil(q * total))
+    seen = 0
+    for value, count in days:
+        seen += count
+        if seen >= rank:
+            return value
+    return days[-1][0]
+
+def _trend(months: Dict) -> Tuple[Optional[float], str]:
+    recent = sorted(months.items())[-TREND_MONTHS:]
+    if len(recent) < 3:
+        return None, 'insufficient history'
+    xs = [(month.year * 12 + month.month) for month, _ in recent]
+    ys = [total / count for _, (count, total) in recent]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread if spread else 0.0
+    if slope > TREND_TOLERANCE:
+        return round(slope, 2), 'worsening'
+    if slope < -TREND_TOLERANCE:
+        return round(slope, 2), 'improving'
+    return round(slope, 2), 'stable'
+
+def summarize(parts: List[Dict]) -> Optional[Dict]:
+    """Distribution statistics over one or more lane histograms (settled + tail, or several lanes)."""
+    days, months = Counter(), {}
+    shipments = on_time = planned = 0
+    for part in parts:
+        days.update(part['days'])
+        shipments += part['shipments']
+        on_time += part['on_time']
+        planned += part['planned']
+        for month, (count, total) in part['months'].items():
+            merged = months.setdefault(month, [0, 0.0])
+            merged[0] += count
+            merged[1] += total
+    if not shipments:
+        return None
+    ordered = sorted(days.items())
+    slope, direction = _trend(months)
+    return {
+        'shipments': shipments,
+        'mean_days': round(sum(value * count for value, count in ordered) / shipments, 1),
+        'p50_days': _percentile(ordered, shipments, 0.5),
+        'p90_days': _percentile(ordered, shipments, 0.9),
+        'p95_days': _percentile(ordered, shipments, 0.95),
+        'max_days': ordered[-1][0],
+        'on_time_rate': round(on_time / planned, 3) if planned else None,
+        'trend_days_per_month': slope,
+        'trend': direction
+    }
+
+def _derive(lanes: Dict) -> Tuple[Dict, Dict]:
+    stats, graph = {}, {}
+    for key, lane in lanes.items():
+        summary = summarize([lane['settled'], lane['tail']])
+        if summary is None:
+            continue
+        summary.update({'origin': lane['origin'], 'destination': lane['destination']})
+        stats[key] = summary
+        if summary['shipments'] >= LANE_MIN_SHIPMENTS:
+            graph.setdefault(key[0], []).append((key[1], summary))
+    return stats, graph
+
+def _rebuild(full: bool) -> None:
+    started = time.perf_counter()
+    _state['dirty'] = False
+    try:
+        columns = _resolve_columns() if full or _state['columns'] is None else _state['columns']
+        if columns is None:
+            raise RuntimeError(f'Table {SOURCE_TABLE} with origin, destination and lead time columns not found')
+        incremental = not full and columns['ship_date'] and _state['watermark'] is not None
+        with span('lane_index_build', incremental=bool(incremental)):
+            if incremental:
+                rows = run_sql_query(build_query(columns, True), (_state['watermark'],), primary=True)
+            else:
+                rows = run_sql_query(build_query(columns, False), primary=True)
+    except Exception as e:
+        _state['error'] = str(e)[:200]
+        _state['dirty'] = True
+        logger.error("Lane index build failed: %s", e)
+        raise
+    
+    # Built aside and swapped in, like the feasibility index; readers iterate the old dicts lock-free
+    if incremental:
+        # The query re-read every row since the watermark, so it replaces the previous tail; settled
+        # parts are never mutated after a full build and are shared with the new lanes
+        lanes = {key: dict(lane, tail=_new_part()) for key, lane in _state['lanes'].items()}
+        _fold(lanes, rows, tails_only=True)
+        _state['incremental_builds'] += 1
+    else:
+        lanes = {}
+        _state['watermark'] = _fold(lanes, rows, tails_only=False)
+        _state.update({'columns': columns, 'full_built_at': time.time()})
+        _state['full_builds'] += 1
+    stats, graph = _derive(lanes)
+    _state.update({'lanes': lanes, 'stats': stats, 'graph': graph, 'built_at': time.time(),
+                   'build_ms': round((time.perf_counter() - started) * 1000, 1), 'error': None})
+    logger.info("Lane index %s build: %s lanes from %s aggregate rows in %.0f ms",
+                'incremental' if incremental else 'full', len(_state['stats']), len(rows), _state['build_ms'])
+
+def _needs(now: float) -> Optional[str]:
+    if _state['full_built_at'] is None or now - _state['full_built_at'] > LANE_INDEX_FULL_REBUILD_SECONDS:
+        return 'full'
+    if _state['dirty'] or now - _state['built_at'] > LANE_INDEX_REFRESH_SECONDS:
+        return 'incremental'
+    return None
+
+def _ensure_fresh() -> None:
+    if _needs(time.time()):
+        with _build_lock:
+            # Concurrent lookups wait for one refresh instead of each running the query
+            needed = _needs(time.time())
+            if needed:
+                _rebuild(full=needed == 'full')
+
+def refresh(full: bool = True) -> Dict:
+    with _build_lock:
+        _rebuild(full)
+    return stats()
+
+def handle_table_change(event: Dict) -> None:
+    # '*' follows a change-feed reconnect, when updates to settled rows may have been missed
+    if event['table'] == '*':
+        _state['full_built_at'] = None
+    _state['dirty'] = True
+
+def _matches(value: str, needle: Optional[str]) -> bool:
+    return not needle or needle.strip().lower() in value
+
+def lane_stats(origin: Optional[str] = None, destination: Optional[str] = None) -> List[Dict]:
+    """Per-lane statistics, substring-matched on origin and destination like the agents' filters."""
+    _ensure_fresh()
+    return [
+        summary for (origin_key, destination_key), summary in sorted(_state['stats'].items())
+        if _matches(origin_key, origin) and _matches(destination_key, destination)
+    ]
+
+def destination_summary(destination: str) -> Optional[Dict]:
+    """Lead-time distribution over every lane into `destination`."""
+    _ensure_fresh()
+    lanes = [lane for (_, destination_key), lane in _state['lanes'].items() if _matches(destination_key, destination)]
+    return summarize([part for lane in lanes for part in (lane['settled'], lane['tail'])])
+
+def best_route(destination: str, origin: Optional[str] = None) -> Optional[Dict]:
+    """Shortest expected-time path to `destination`, possibly through intermediate depots.
+    
+    Lanes with fewer than LANE_MIN_SHIPMENTS shipments are ignored and every intermediate stop adds
+    LANE_TRANSFER_DAYS. Without an origin, every shipping origin is a candidate start.
+    """
+    _ensure_fresh()
+    graph = _state['graph']
+    targets = {node for edges in graph.values() for node, _ in edges if _matches(node, destination)}
+    if origin:
+        sources = [node for node in graph if _matches(node, origin)]
+    else:
+        sources = list(graph)
+    
+    # The counter breaks ties so legs (dicts) are never compared
+    order = itertools.count()
+    queue = [(0.0, next(order), 0.0, node, ()) for node in sources]
+    heapq.heapify(queue)
+    settled = set()
+    while queue:
+        expected, _, conservative, node, legs = heapq.heappop(queue)
+        if node in settled:
+            continue
+        if node in targets:
+            if not legs:
+                # A source that is itself a destination still needs a route from elsewhere
+                continue
+            return {
+                'origin': legs[0]['origin'],
+                'destination': legs[-1]['destination'],
+                'legs': list(legs),
+                'expected_days': round(expected, 1),
+                # Sum of leg p90s; an upper bound on the route's p90
+                'p90_days': round(conservative, 1),
+                'transfer_days': LANE_TRANSFER_DAYS * (len(legs) - 1)
+            }
+        settled.add(node)
+        transfer = LANE_TRANSFER_DAYS if legs else 0.0
+        for next_node, summary in graph.get(node, ()):
+            if next_node in settled:
+                continue
+            leg = {key: summary[key] for key in ('origin', 'destination', 'mean_days', 'p90_days', 'on_time_rate',
+                                                 'shipments')}
+            heapq.heappush(queue, (
+                expected + transfer + summary['mean_days'],
+                next(order),
+                conservative + transfer + summary['p90_days'],
+                next_node,
+                legs + (leg,)
+            ))
+    return None
+
+def stats() -> Dict:
+    return {
+        'lanes': len(_state['stats']),
+        'routable_lanes': sum(len(edges) for edges in _state['graph'].values()),
+        'watermark': _state['watermark'].isoformat() if _state['watermark'] else None,
+        'built_at': _state['built_at'],
+        'full_built_at': _state['full_built_at'],
+        'build_ms': _state['build_ms'],
+        'full_builds': _state['full_builds'],
+        'incremental_builds': _state['incremental_builds'],
+        'dirty': _state['dirty'],
+        'error': _state['error']
+    }
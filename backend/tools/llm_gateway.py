@@ -0,0 +1,226 @@
+from typing import Dict, List, Optional
+import logging
+import random
+import threading
+import time
+from config import (
+    get_llm_client, LLM_API_KEY, LLM_MODEL_NAME, LLM_TIMEOUT_SECONDS, LLM_MAX_RETRY, LLM_RETRY_BASE_DELAY,
+    LLM_RETRY_MAX_DELAY, LLM_HEALTH_TTL_SECONDS, LLM_MAX_CONCURRENCY, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS,
+    LLM_COMPLETION_STORE_PATH, LLM_COMPLETION_STORE_TTL_SECONDS, LLM_COMPLETION_STORE_MAX_ENTRIES
+)
+from tools.completion_store import CompletionStore
+from tools.llm_providers import LLMProvider, PROVIDERS, provider_for, get_provider_status
+from tools.metrics import histogram
+from tools.telemetry import span
+
+logger = logging.getLogger(__name__)
+
+class LLMUnavailableError(RuntimeError):
+    pass
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'CLOSED'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'CLOSED':
+                return True
+            if self.state == 'OPEN' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'HALF_OPEN'
+                self._probe_in_flight = False
+            if self.state == 'HALF_OPEN' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = 'CLOSED'
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == 'HALF_OPEN' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'OPEN':
+                    logger.warning("Circuit breaker OPEN after %s consecutive failures", self.consecutive_failures)
+                self.state = 'OPEN'
+                self.opened_at = time.monotonic()
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_seconds': self.reset_seconds
+            }
+
+_breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+_semaphore = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+_latency = histogram('llm_request_seconds')
+_reachability = {'reachable': None, 'error': None, 'latency_ms': None, 'checked_at': None}
+_reachability_lock = threading.Lock()
+_completion_store = CompletionStore(
+    LLM_COMPLETION_STORE_PATH, LLM_COMPLETION_STORE_TTL_SECONDS, LLM_COMPLETION_STORE_MAX_ENTRIES
+) if LLM_COMPLETION_STORE_PATH else None
+
+# Transport failures from the openai SDK and httpx, matched by name so neither is imported here
+TRANSPORT_ERRORS = {'APIConnectionError', 'APITimeoutError', 'TimeoutException', 'NetworkError', 'RemoteProtocolError'}
+
+def _is_retryable(error: Exception) -> bool:
+    status_code = getattr(error, 'status_code', None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    # Timeouts and connection errors carry no status code; anything else (TypeError, KeyError) is a bug
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSPORT_ERRORS for cls in type(error).__mro__)
+
+def _backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+
+def _call_once(provider: LLMProvider, model: str, messages: List[Dict], max_tokens: int, timeout: float,
+               response_format: Optional[Dict] = None) -> str:
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    started = time.monotonic()
+    status = 'error'
+    try:
+        with span('llm_call', model=model, provider=provider.name) as record:
+            text, usage = provider.complete(model, messages, max_tokens, timeout, response_format)
+            if usage is not None:
+                record.update(usage)
+        status = 'ok'
+        return text
+    finally:
+        _latency.observe(time.monotonic() - started, model=model, status=status)
+        with _in_flight_lock:
+            _in_flight -= 1
+
+def _with_store(model: str, messages: List[Dict], max_tokens: int, response_format: Optional[Dict], call) -> str:
+    if _completion_store is None:
+        return call()
+    key = CompletionStore.make_key(model, messages, max_tokens, response_format)
+    stored = _completion_store.get(key)
+    if stored is not None:
+        return stored
+    result = call()
+    _completion_store.put(key, model, result)
+    return result
+
+def _remote_completion(provider: LLMProvider, model: str, messages: List[Dict], max_tokens: int,
+                       timeout: Optional[float], response_format: Optional[Dict]) -> str:
+    deadline = time.monotonic() + (timeout or LLM_TIMEOUT_SECONDS)
+    last_error = None
+    attempts = 0
+    
+    while attempts <= LLM_MAX_RETRY:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not _semaphore.acquire(timeout=remaining):
+            last_error = TimeoutError("LLM call deadline exceeded")
+            break
+        # Asked only once a slot is held: in HALF_OPEN allow() claims the probe, which every
+        # path from here settles with record_success/record_failure
+        if not _breaker.allow():
+            _semaphore.release()
+            raise CircuitOpenError("LLM circuit breaker is open")
+        
+        attempts += 1
+        try:
+            result = _call_once(
+                provider, model, messages, max_tokens, max(deadline - time.monotonic(), 0.1), response_format
+            )
+            _breaker.record_success()
+            return result
+        except Exception as e:
+            last_error = e
+            if not _is_retryable(e):
+                # The upstream answered, so this says nothing about its health
+                _breaker.record_success()
+                break
+            _breaker.record_failure()
+        finally:
+            _semaphore.release()
+        
+        delay = _backoff_delay(attempts - 1)
+        if attempts > LLM_MAX_RETRY or time.monotonic() + delay >= deadline:
+            break
+        logger.warning("Attempt %s failed (%s), retrying in %.2fs", attempts, str(last_error)[:100], delay)
+        time.sleep(delay)
+    
+    raise LLMUnavailableError(f"LLM call failed after {attempts} attempt(s): {str(last_error)}") from last_error
+
+def chat_completion(messages: List[Dict], max_tokens: int = 1000, model: Optional[str] = None,
+                    timeout: Optional[float] = None, response_format: Optional[Dict] = None,
+                    task: Optional[str] = None) -> str:
+    """Complete with the provider routed for `task` (LLM_TASK_ROUTES), falling back to the remote endpoint."""
+    provider = provider_for(task)
+    if not provider.remote:
+        local_model = provider.default_model()
+        try:
+            return _with_store(local_model, messages, max_tokens, response_format, lambda: _call_once(
+                provider, local_model, messages, max_tokens, timeout or LLM_TIMEOUT_SECONDS, response_format
+            ))
+        except Exception as e:
+            logger.warning("Local model failed for task %s, using remote endpoint: %s", task, e)
+            provider = PROVIDERS['remote']
+    
+    if not LLM_API_KEY:
+        raise LLMUnavailableError("No LLM API key configured")
+    
+    model = model or LLM_MODEL_NAME
+    return _with_store(model, messages, max_tokens, response_format, lambda: _remote_completion(
+        provider, model, messages, max_tokens, timeout, response_format
+    ))
+
+def check_reachability(max_age: float = LLM_HEALTH_TTL_SECONDS) -> Dict:
+    """Cached upstream reachability; only probes (a /models listing, no tokens) when the result is stale."""
+    with _reachability_lock:
+        checked = _reachability['checked_at']
+        if checked is not None and time.time() - checked < max_age:
+            return dict(_reachability)
+        if not LLM_API_KEY:
+            _reachability.update({'reachable': False, 'error': 'No LLM API key configured', 'checked_at': time.time()})
+            return dict(_reachability)
+        started = time.monotonic()
+        try:
+            get_llm_client().with_options(max_retries=0, timeout=10).models.list()
+            _reachability.update({'reachable': True, 'error': None})
+        except Exception as e:
+            _reachability.update({'reachable': False, 'error': str(e)[:200]})
+        _reachability['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+        _reachability['checked_at'] = time.time()
+        return dict(_reachability)
+
+def get_llm_stats() -> Dict:
+    with _in_flight_lock:
+        in_flight = _in_flight
+    return {
+        'configured': bool(LLM_API_KEY),
+        'reachability': dict(_reachability),
+        'model': LLM_MODEL_NAME,
+        **get_provider_status(),
+        'max_concurrency': LLM_MAX_CONCURRENCY,
+        'in_flight': in_flight,
+        'timeout_seconds': LLM_TIMEOUT_SECONDS,
+        'max_retry': LLM_MAX_RETRY,
+        'circuit_breaker': _breaker.status(),
+        'completion_store': _completion_store.stats() if _completion_store is not None else None,
+        'latency': _latency.snapshot()
+    }
@@ -0,0 +1,143 @@
+from typing import Dict, List, Optional, Tuple
+from abc import ABC, abstractmethod
+import logging
+import os
+import threading
+from config import (
+    get_llm_client, LLM_API_KEY, LLM_MODEL_NAME, LLM_BASE_URL, LLM_TASK_ROUTES,
+    LOCAL_LLM_MODEL_PATH, LOCAL_LLM_CONTEXT, LOCAL_LLM_THREADS
+)
+
+logger = logging.getLogger(__name__)
+
+class LLMProvider(ABC):
+    name = 'base'
+    # Remote providers go through the gateway's retries, circuit breaker and concurrency limit
+    remote = True
+    
+    @abstractmethod
+    def available(self) -> bool:
+        ...
+    
+    @abstractmethod
+    def default_model(self) -> str:
+        ...
+    
+    @abstractmethod
+    def complete(self, model: str, messages: List[Dict], max_tokens: int, timeout: float,
+                 response_format: Optional[Dict] = None) -> Tuple[str, Optional[Dict]]:
+        """Return the completion text and token usage, if the backend reports it."""
+    
+    def status(self) -> Dict:
+        return {'available': self.available(), 'remote': self.remote, 'model': self.default_model()}
+
+class OpenAICompatibleProvider(LLMProvider):
+    name = 'remote'
+    
+    def available(self) -> bool:
+        return bool(LLM_API_KEY)
+    
+    def default_model(self) -> str:
+        return LLM_MODEL_NAME
+    
+    def complete(self, model, messages, max_tokens, timeout, response_format=None):
+        response = get_llm_client().with_options(max_retries=0, timeout=timeout).chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            **({'response_format': response_format} if response_format else {})
+        )
+        usage = getattr(response, 'usage', None)
+        tokens = {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens} if usage else None
+        return response.choices[0].message.content or '', tokens
+    
+    def status(self) -> Dict:
+        status = super().status()
+        status['base_url'] = LLM_BASE_URL
+        return status
+
+class LlamaCppProvider(LLMProvider):
+    """In-process GGUF model via llama-cpp-python, loaded on first use."""
+    name = 'local'
+    remote = False
+    
+    def __init__(self, model_path: str, n_ctx: int, n_threads: int):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.load_error = None
+        self._llama = None
+        # A llama.cpp context is not safe for concurrent use
+        self._lock = threading.Lock()
+    
+    def available(self) -> bool:
+        return bool(self.model_path) and self.load_error is None
+    
+    def default_model(self) -> str:
+        return f"local:{os.path.basename(self.model_path)}" if self.model_path else ''
+    
+    def _load(self):
+        if self._llama is None:
+            try:
+                from llama_cpp import Llama
+                self._llama = Llama(
+                    model_path=self.model_path,
+                    n_ctx=self.n_ctx,
+                    n_threads=self.n_threads or None,
+                    verbose=False
+                )
+                logger.info("Loaded local model %s", self.model_path)
+            except Exception as e:
+                # Don't retry a missing package or unreadable model on every call
+                self.load_error = str(e)[:200]
+                raise
+        return self._llama
+    
+    @staticmethod
+    def _format(response_format: Optional[Dict]) -> Optional[Dict]:
+        # llama.cpp enforces JSON (and an optional schema) with a grammar
+        if not response_format:
+            return None
+        if response_format.get('type') == 'json_schema':
+            return {'type': 'json_object', 'schema': response_format['json_schema']['schema']}
+        return {'type': 'json_object'}
+    
+    def complete(self, model, messages, max_tokens, timeout, response_format=None):
+        # Local inference cannot be interrupted, so `timeout` only bounds the wait for the model; a stuck
+        # generation then sends later calls to the remote endpoint instead of queueing them all
+        if not self._lock.acquire(timeout=timeout):
+            raise TimeoutError(f"Local model busy for more than {timeout:g}s")
+        try:
+            response = self._load().create_chat_completion(
+                messages=messages,
+                max_tokens=max_tokens,
+                response_format=self._format(response_format)
+            )
+        finally:
+            self._lock.release()
+        usage = response.get('usage')
+        tokens = {'prompt_tokens': usage['prompt_tokens'], 'completion_tokens': usage['completion_tokens']} if usage else None
+        return response['choices'][0]['message']['content'] or '', tokens
+    
+    def status(self) -> Dict:
+        status = super().status()
+        status.update({'loaded': self._llama is not None, 'load_error': self.load_error})
+        return status
+
+PROVIDERS = {
+    'remote': OpenAICompatibleProvider(),
+    'local': LlamaCppProvider(LOCAL_LLM_MODEL_PATH, LOCAL_LLM_CONTEXT, LOCAL_LLM_THREADS)
+}
+
+def provider_for(task: Optional[str]) -> LLMProvider:
+    """Provider configured for `task` in LLM_TASK_ROUTES; remote when unrouted or unavailable."""
+    provider = PROVIDERS.get(LLM_TASK_ROUTES.get(task or '', 'remote'))
+    if provider is None or not provider.available():
+        return PROVIDERS['remote']
+    return provider
+
+def get_provider_status() -> Dict:
+    return {
+        'providers': {name: provider.status() for name, provider in PROVIDERS.items()},
+        'task_routes': dict(LLM_TASK_ROUTES)
+    }
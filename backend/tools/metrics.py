@@ -0,0 +1,147 @@
+from typing import Dict, Optional, Sequence
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    def __init__(self, name: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {'counts': [0] * (len(self.buckets) + 1), 'count': 0, 'sum': 0.0}
+                self._series[key] = series
+            series['counts'][index] += 1
+            series['count'] += 1
+            series['sum'] += value
+
+    def _quantile(self, counts, total, q: float) -> Optional[float]:
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= rank:
+                break
+        # The overflow bucket has no upper bound; report the last finite one (inf is not valid JSON)
+        return self.buckets[min(i, len(self.buckets) - 1)]
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            series = {key: dict(s, counts=list(s['counts'])) for key, s in self._series.items()}
+        
+        result = {}
+        for key, s in series.items():
+            label = ','.join(f'{k}={v}' for k, v in key) or 'all'
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(list(self.buckets) + ['+Inf'], s['counts']):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            result[label] = {
+                'count': s['count'],
+                'sum': round(s['sum'], 6),
+                'buckets': buckets,
+                'p50': self._quantile(s['counts'], s['count'], 0.50),
+                'p95': self._quantile(s['counts'], s['count'], 0.95),
+                'p99': self._quantile(s['counts'], s['count'], 0.99)
+            }
+        return result
+
+class Counter:
+    def __init__(self, name: str):
+        self.name = name
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            series = dict(self._series)
+        return {','.join(f'{k}={v}' for k, v in key) or 'all': value for key, value in series.items()}
+
+    def samples(self):
+        with self._lock:
+            return list(self._series.items())
+
+_histograms = {}
+_counters = {}
+_gauge_callbacks = {}
+_registry_lock = threading.Lock()
+
+def histogram(name: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    with _registry_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, buckets)
+        return _histograms[name]
+
+def snapshot_all() -> Dict:
+    with _registry_lock:
+        histograms = list(_histograms.values())
+    return {h.name: h.snapshot() for h in histograms}
+
+def counter(name: str) -> Counter:
+    with _registry_lock:
+        if name not in _counters:
+            _counters[name] = Counter(name)
+        return _counters[name]
+
+def register_gauge(name: str, callback) -> None:
+    # callback returns {label_tuple: value}, evaluated at scrape time
+    with _registry_lock:
+        _gauge_callbacks[name] = callback
+
+def _format_labels(key, extra=None) -> str:
+    pairs = list(key) + (list(extra) if extra else [])
+    if not pairs:
+        return ''
+    escaped = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + escaped + '}'
+
+def render_prometheus() -> str:
+    with _registry_lock:
+        histograms = list(_histograms.values())
+        counters = list(_counters.values())
+        gauges = list(_gauge_callbacks.items())
+    
+    lines = []
+    for h in histograms:
+        with h._lock:
+            series = {key: dict(s, counts=list(s['counts'])) for key, s in h._series.items()}
+        lines.append(f'# TYPE {h.name} histogram')
+        for key, s in series.items():
+            cumulative = 0
+            for bound, count in zip(list(h.buckets) + ['+Inf'], s['counts']):
+                cumulative += count
+                lines.append(f'{h.name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+            lines.append(f'{h.name}_sum{_format_labels(key)} {s["sum"]}')
+            lines.append(f'{h.name}_count{_format_labels(key)} {s["count"]}')
+    
+    for c in counters:
+        lines.append(f'# TYPE {c.name} counter')
+        for key, value in c.samples():
+            lines.append(f'{c.name}{_format_labels(key)} {value}')
+    
+    for name, callback in gauges:
+        try:
+            values = callback()
+        except Exception:
+            continue
+        lines.append(f'# TYPE {name} gauge')
+        for key, value in values.items():
+            lines.append(f'{name}{_format_labels(key)} {value}')
+    
+    return '\n'.join(lines) + '\n'
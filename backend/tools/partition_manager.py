@@ -0,0 +1,263 @@
+from typing import Dict, List, Optional
+from datetime import date, datetime, timedelta
+import gzip
+import logging
+import os
+import re
+import threading
+import psycopg2
+from db.connection import create_connection
+from tools.sql_executor import run_sql_query
+from config import (
+    AUDIT_PARTITION_MONTHS_AHEAD, AUDIT_RETENTION_MONTHS, AUDIT_ARCHIVE_DIR, AUDIT_MAINTENANCE_INTERVAL_HOURS
+)
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'ai_decisions'
+PARTITION_PATTERN = re.compile(r'^ai_decisions_p(\d{4})_(\d{2})$')
+# Session advisory lock shared by every backend process; released on unlock or disconnect
+MAINTENANCE_LOCK = 'ai_decisions_maintenance'
+
+_maintenance = {'thread': None, 'stop': None, 'last_run': None, 'last_result': None}
+_run_lock = threading.Lock()
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_p{month.year:04d}_{month.month:02d}"
+
+def _is_partitioned(cursor) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+        (PARENT_TABLE,)
+    )
+    return cursor.fetchone() is not None
+
+def list_partitions(cursor) -> List[Dict]:
+    cursor.execute("""
+        SELECT c.relname AS name, pg_total_relation_size(c.oid) AS bytes,
+               COALESCE(s.n_live_tup, 0) AS approx_rows
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+    """, (PARENT_TABLE,))
+    partitions = []
+    for row in cursor.fetchall():
+        match = PARTITION_PATTERN.match(row['name'])
+        partitions.append({
+            'name': row['name'],
+            'month': date(int(match.group(1)), int(match.group(2)), 1).isoformat() if match else None,
+            'bytes': row['bytes'],
+            'approx_rows': row['approx_rows']
+        })
+    return partitions
+
+def ensure_partitions(cursor, months_ahead: int = AUDIT_PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Create monthly partitions from the current month through `months_ahead` months ahead."""
+    created = []
+    current = month_start(date.today())
+    for offset in range(months_ahead + 1):
+        start = add_months(current, offset)
+        name = partition_name(start)
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (name,))
+        if cursor.fetchone()['present']:
+            continue
+        try:
+            cursor.execute(
+                f'CREATE TABLE "{name}" PARTITION OF {PARENT_TABLE} FOR VALUES FROM (%s) TO (%s)',
+                (start, add_months(start, 1))
+            )
+            created.append(name)
+            logger.info("Created partition %s", name)
+        except psycopg2.Error as e:
+            # Typically rows for this month already landed in the default partition
+            logger.warning("Could not create partition %s: %s", name, e)
+    return created
+
+def refresh_rollups(cursor, since: date, until: Optional[date] = None) -> int:
+    """Recompute daily rollups for [since, until); rows for archived days are left untouched."""
+    until = until or date.today() + timedelta(days=1)
+    cursor.execute("""
+        INSERT INTO ai_decision_daily_rollups (day, decision_type, severity, decision_count, yes_count, refreshed_at)
+        SELECT timestamp::date,
+               COALESCE(decision_type, 'UNKNOWN'),
+               COALESCE(severity, 'UNKNOWN'),
+               SUM(occurrence_count),
+               COALESCE(SUM(occurrence_count) FILTER (WHERE decision = 'YES'), 0),
+               CURRENT_TIMESTAMP
+        FROM ai_decisions
+        WHERE timestamp >= %s AND timestamp < %s
+        GROUP BY 1, 2, 3
+        ON CONFLICT (day, decision_type, severity) DO UPDATE
+        SET decision_count = EXCLUDED.decision_count,
+            yes_count = EXCLUDED.yes_count,
+            refreshed_at = EXCLUDED.refreshed_at
+    """, (since, until))
+    return cursor.rowcount
+
+def list_detached(cursor) -> List[Dict]:
+    """Monthly partition tables that are no longer attached, e.g. left behind by a failed drop."""
+    cursor.execute("""
+        SELECT c.relname AS name
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r' AND n.nspname = current_schema() AND c.relname ~ %s
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+        ORDER BY c.relname
+    """, (PARTITION_PATTERN.pattern,))
+    detached = []
+    for row in cursor.fetchall():
+        match = PARTITION_PATTERN.match(row['name'])
+        detached.append({'name': row['name'], 'month': date(int(match.group(1)), int(match.group(2)), 1).isoformat()})
+    return detached
+
+def _export(cursor, name: str, archive_dir: str) -> str:
+    # Written aside and renamed once fsynced, so a file under the final name is always complete
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    partial = path + '.partial'
+    with open(partial, 'wb') as raw:
+        with gzip.open(raw, 'wt', encoding='utf-8') as archive:
+            cursor.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)', archive)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(partial, path)
+    directory = os.open(archive_dir, os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    return path
+
+def archive_partitions(conn, retention_months: int = AUDIT_RETENTION_MONTHS,
+                       archive_dir: str = AUDIT_ARCHIVE_DIR) -> List[Dict]:
+    """Export partitions older than the retention window to gzip CSV, then detach and drop them.
+    
+    The export runs while the partition is still attached, so a failed write leaves its rows queryable
+    and the next run retries it. Tables already detached by an earlier, interrupted run are archived too.
+    """
+    cutoff = add_months(month_start(date.today()), -retention_months)
+    os.makedirs(archive_dir, exist_ok=True)
+    cursor = conn.cursor()
+    archived = []
+    try:
+        for partition in list_partitions(cursor):
+            if not partition['month'] or date.fromisoformat(partition['month']) >= cutoff:
+                continue
+            name = partition['name']
+            start = date.fromisoformat(partition['month'])
+            # Rollups must cover the month before its rows leave the table
+            refresh_rollups(cursor, start, add_months(start, 1))
+            path = _export(cursor, name, archive_dir)
+            cursor.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+            archived.append({'partition': name, 'file': path, 'bytes': os.path.getsize(path)})
+            logger.info("Archived partition %s to %s", name, path)
+        
+        for partition in list_detached(cursor):
+            if date.fromisoformat(partition['month']) >= cutoff:
+                continue
+            name = partition['name']
+            path = _export(cursor, name, archive_dir)
+            cursor.execute(f'DROP TABLE "{name}"')
+            archived.append({'partition': name, 'file': path, 'bytes': os.path.getsize(path), 'detached': True})
+            logger.info("Archived previously detached partition %s to %s", name, path)
+    finally:
+        cursor.close()
+    return archived
+
+def _rollup_since(cursor) -> date:
+    # The stored day was only partly over when it was rolled up, so it is redone along with any
+    # days missed while no process ran maintenance; a fresh database backfills the retention window
+    floor = add_months(month_start(date.today()), -AUDIT_RETENTION_MONTHS)
+    cursor.execute("SELECT rolled_up_through FROM ai_decision_rollup_state")
+    row = cursor.fetchone()
+    return max(row['rolled_up_through'], floor) if row and row['rolled_up_through'] else floor
+
+def _record_rollup(cursor, day: date) -> None:
+    cursor.execute("""
+        INSERT INTO ai_decision_rollup_state (id, rolled_up_through) VALUES (TRUE, %s)
+        ON CONFLICT (id) DO UPDATE SET rolled_up_through = EXCLUDED.rolled_up_through
+    """, (day,))
+
+def run_maintenance(archive: bool = True) -> Dict:
+    with _run_lock:
+        conn = create_connection()
+        cursor = conn.cursor()
+        result = {'started': datetime.now().isoformat()}
+        try:
+            # Other backend processes run the same loop; only one may export, detach or drop at a time
+            cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s)) AS locked", (MAINTENANCE_LOCK,))
+            if not cursor.fetchone()['locked']:
+                result['skipped'] = 'maintenance is running in another process'
+                logger.info(result['skipped'])
+                return result
+            if _is_partitioned(cursor):
+                result['created'] = ensure_partitions(cursor)
+            else:
+                result['warning'] = 'ai_decisions is not partitioned; run db/partition_ai_decisions.sql'
+                logger.warning(result['warning'])
+            today = date.today()
+            result['rollup_rows'] = refresh_rollups(cursor, _rollup_since(cursor))
+            _record_rollup(cursor, today)
+            if archive and 'warning' not in result:
+                result['archived'] = archive_partitions(conn)
+            result['partitions'] = list_partitions(cursor)
+            _maintenance['last_run'] = result['started']
+            _maintenance['last_result'] = result
+            return result
+        finally:
+            cursor.close()
+            # Closing the session also releases the advisory lock
+            conn.close()
+
+def get_rollups(since: Optional[date] = None, until: Optional[date] = None) -> List[Dict]:
+    clauses, params = [], []
+    if since:
+        clauses.append("day >= %s")
+        params.append(since)
+    if until:
+        clauses.append("day < %s")
+        params.append(until)
+    return run_sql_query(f"""
+        SELECT day, decision_type, severity, decision_count, yes_count
+        FROM ai_decision_daily_rollups
+        {'WHERE ' + ' AND '.join(clauses) if clauses else ''}
+        ORDER BY day DESC, decision_type, severity
+    """, params or None)
+
+def _maintenance_loop(stop: threading.Event) -> None:
+    while True:
+        try:
+            run_maintenance()
+        except Exception:
+            logger.exception("Partition maintenance failed")
+        if stop.wait(AUDIT_MAINTENANCE_INTERVAL_HOURS * 3600):
+            return
+
+def start_maintenance() -> None:
+    if _maintenance['thread'] and _maintenance['thread'].is_alive():
+        return
+    stop = threading.Event()
+    thread = threading.Thread(target=_maintenance_loop, args=(stop,), name='partition-maintenance', daemon=True)
+    _maintenance.update({'thread': thread, 'stop': stop})
+    thread.start()
+
+def stop_maintenance() -> None:
+    if _maintenance['stop']:
+        _maintenance['stop'].set()
+
+def get_maintenance_status() -> Dict:
+    thread = _maintenance['thread']
+    return {
+        'running': bool(thread and thread.is_alive()),
+        'last_run': _maintenance['last_run'],
+        'last_result': _maintenance['last_result']
+    }
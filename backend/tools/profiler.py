@@ -0,0 +1,226 @@
+from typing import Dict, List, Optional
+from collections import deque, Counter as StackCounter
+from contextlib import contextmanager
+from datetime import datetime
+import cProfile
+import io
+import logging
+import marshal
+import math
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from config import PROFILE_HISTORY, PROFILE_SAMPLE_INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+# Distinct collapsed stacks kept by the sampler before new ones are folded into one bucket
+MAX_SAMPLED_STACKS = 20000
+# Below ~1 ms the sampler thread mostly holds the GIL and slows the requests it is measuring
+MIN_SAMPLE_INTERVAL_MS = 1.0
+MAX_SAMPLE_INTERVAL_MS = 10000.0
+
+_lock = threading.Lock()
+# Only one deterministic profiler can be active per interpreter
+_capture_lock = threading.Lock()
+_armed = {'remaining': 0, 'scope': None, 'target': None}
+_profiles = deque(maxlen=PROFILE_HISTORY)
+_active = threading.local()
+
+# thread id -> stack of tag dicts, read by the sampler to prefix stacks with intent/agent
+_thread_tags: Dict[int, List[dict]] = {}
+_sampler = {'thread': None, 'stop': None, 'interval_ms': PROFILE_SAMPLE_INTERVAL_MS, 'started': None, 'samples': 0}
+_stacks = StackCounter()
+
+def arm(count: int, agent: Optional[str] = None) -> dict:
+    """Profile the next `count` /api/query requests, or the next `count` calls of one agent's work()."""
+    with _lock:
+        _armed.update({
+            'remaining': max(0, int(count)),
+            'scope': 'agent' if agent else 'api_query',
+            'target': agent.strip().lower() if agent else None
+        })
+        return dict(_armed)
+
+def disarm() -> None:
+    with _lock:
+        _armed.update({'remaining': 0, 'scope': None, 'target': None})
+
+def _claim(scope: str, tags: dict) -> bool:
+    with _lock:
+        if _armed['remaining'] <= 0 or _armed['scope'] != scope:
+            return False
+        target = _armed['target']
+        if target and target not in (str(tags.get('agent', '')).lower(), str(tags.get('intent', '')).lower()):
+            return False
+        if not _capture_lock.acquire(blocking=False):
+            return False
+        _armed['remaining'] -= 1
+        return True
+
+@contextmanager
+def profiled(scope: str, **tags):
+    """Tag the current thread for the sampler and run cProfile if this scope is armed.
+    
+    Callers may add tags (e.g. intent) to the yielded dict after it is known.
+    """
+    thread_id = threading.get_ident()
+    _thread_tags.setdefault(thread_id, []).append(tags)
+    
+    profile = None
+    if not getattr(_active, 'profiling', False) and _claim(scope, tags):
+        profile = cProfile.Profile()
+        _active.profiling = True
+    
+    started = time.perf_counter()
+    try:
+        if profile:
+            profile.enable()
+        yield tags
+    finally:
+        if profile:
+            profile.disable()
+            _active.profiling = False
+            _capture_lock.release()
+            _store(scope, tags, profile, time.perf_counter() - started)
+        stack = _thread_tags.get(thread_id)
+        if stack:
+            stack.pop()
+            # Let enclosing scopes (e.g. the request) pick up tags only known here (e.g. the agent)
+            for outer in stack:
+                for key, value in tags.items():
+                    outer.setdefault(key, value)
+            if not stack:
+                _thread_tags.pop(thread_id, None)
+
+def _store(scope: str, tags: dict, profile: cProfile.Profile, duration: float) -> None:
+    profile.create_stats()
+    # Serialize before pstats.Stats takes ownership of (and empties) profile.stats
+    raw_stats = marshal.dumps(profile.stats)
+    summary = io.StringIO()
+    pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(40)
+    record = {
+        'id': uuid.uuid4().hex[:12],
+        'scope': scope,
+        'intent': tags.get('intent'),
+        'agent': tags.get('agent'),
+        'created': datetime.now().isoformat(),
+        'duration_ms': round(duration * 1000, 2),
+        'summary': summary.getvalue(),
+        'stats': raw_stats
+    }
+    with _lock:
+        _profiles.append(record)
+    logger.info("Captured %s profile %s (intent=%s, agent=%s, %.1f ms)",
+                scope, record['id'], record['intent'], record['agent'], record['duration_ms'])
+
+def list_profiles() -> List[dict]:
+    with _lock:
+        return [{k: v for k, v in p.items() if k not in ('summary', 'stats')} for p in reversed(_profiles)]
+
+def get_profile(profile_id: str) -> Optional[dict]:
+    with _lock:
+        for profile in _profiles:
+            if profile['id'] == profile_id:
+                return profile
+    return None
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _sample_loop(stop: threading.Event, interval: float) -> None:
+    own_id = threading.get_ident()
+    while not stop.wait(interval):
+        frames = sys._current_frames()
+        for thread_id, frame in frames.items():
+            if thread_id == own_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.reverse()
+            tag_stack = _thread_tags.get(thread_id)
+            if tag_stack:
+                merged = {}
+                for tags in list(tag_stack):
+                    merged.update(tags)
+                labels[:0] = [f"{key}:{merged[key]}" for key in ('intent', 'agent') if merged.get(key)]
+            key = ';'.join(labels)
+            with _lock:
+                if key in _stacks or len(_stacks) < MAX_SAMPLED_STACKS:
+                    _stacks[key] += 1
+                else:
+                    _stacks['[truncated]'] += 1
+                _sampler['samples'] += 1
+
+def sample_interval(interval_ms=None) -> float:
+    """Validated sampling interval in ms; ValueError unless a number within the allowed range."""
+    if interval_ms is None:
+        interval_ms = PROFILE_SAMPLE_INTERVAL_MS
+    if isinstance(interval_ms, bool):
+        raise ValueError("interval_ms must be a number")
+    try:
+        interval = float(interval_ms)
+    except (TypeError, ValueError):
+        raise ValueError("interval_ms must be a number")
+    if not (math.isfinite(interval) and MIN_SAMPLE_INTERVAL_MS <= interval <= MAX_SAMPLE_INTERVAL_MS):
+        raise ValueError(f"interval_ms must be between {MIN_SAMPLE_INTERVAL_MS:g} and {MAX_SAMPLE_INTERVAL_MS:g}")
+    return interval
+
+def start_sampler(interval_ms: Optional[float] = None) -> dict:
+    interval = sample_interval(interval_ms)
+    with _lock:
+        if _sampler['thread'] and _sampler['thread'].is_alive():
+            return sampler_status()
+        stop = threading.Event()
+        _sampler.update({
+            'stop': stop,
+            'interval_ms': interval,
+            'started': datetime.now().isoformat()
+        })
+        thread = threading.Thread(
+            target=_sample_loop, args=(stop, _sampler['interval_ms'] / 1000.0), name='stack-sampler', daemon=True
+        )
+        _sampler['thread'] = thread
+    thread.start()
+    logger.info("Stack sampler started (%.1f ms interval)", _sampler['interval_ms'])
+    return sampler_status()
+
+def stop_sampler() -> dict:
+    thread, stop = _sampler['thread'], _sampler['stop']
+    if stop:
+        stop.set()
+    if thread:
+        thread.join(timeout=5)
+        logger.info("Stack sampler stopped after %s samples", _sampler['samples'])
+    _sampler['thread'] = None
+    return sampler_status()
+
+def sampler_status() -> dict:
+    thread = _sampler['thread']
+    return {
+        'running': bool(thread and thread.is_alive()),
+        'interval_ms': _sampler['interval_ms'],
+        'started': _sampler['started'],
+        'samples': _sampler['samples'],
+        'distinct_stacks': len(_stacks)
+    }
+
+def collapsed_stacks(reset: bool = False) -> str:
+    """Samples in Brendan Gregg's collapsed format, readable by flamegraph.pl and speedscope."""
+    with _lock:
+        lines = [f"{stack} {count}" for stack, count in _stacks.most_common()]
+        if reset:
+            _stacks.clear()
+            _sampler['samples'] = 0
+    return '\n'.join(lines) + ('\n' if lines else '')
+
+def get_profiler_status() -> dict:
+    with _lock:
+        armed = dict(_armed)
+    return {'armed': armed, 'sampler': sampler_status(), 'profiles': len(_profiles)}
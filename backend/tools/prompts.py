@@ -0,0 +1,13 @@
+from typing import Dict, List
+import json
+
+def agent_messages(system_prompt: str, data: list, label: str = 'Data') -> List[Dict]:
+    """Static instructions as the system message, query data last.
+    
+    Keeping everything that varies per call out of the system message gives every request of an
+    agent a byte-identical prefix that providers can serve from their prefix/KV cache.
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"{label}:\n{json.dumps(data, indent=2, sort_keys=True)}"}
+    ]
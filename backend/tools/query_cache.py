@@ -0,0 +1,125 @@
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+from collections import OrderedDict
+import json
+import re
+import threading
+import time
+
+_TABLE_PATTERN = re.compile(r'\b(?:from|join)\s+("[^"]+"|[a-z_][\w.$-]*)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_table_name(table: str) -> str:
+    name = table.strip().strip('"').lower()
+    if name.startswith('public.'):
+        name = name[len('public.'):]
+    return name.strip('"')
+
+
+def extract_tables(query: str) -> List[str]:
+    return sorted({normalize_table_name(match) for match in _TABLE_PATTERN.findall(query)})
+
+
+def normalize_sql(query: str) -> str:
+    return _WHITESPACE.sub(' ', query).strip().rstrip(';').strip()
+
+
+def make_key(query: str, params: Optional[Sequence] = None) -> str:
+    return normalize_sql(query) + '\x00' + json.dumps(params, default=str)
+
+
+class QueryCache:
+    def __init__(self, max_bytes: int, ttl_seconds: int):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._table_versions = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _versions_for(self, tables: Iterable[str]) -> tuple:
+        return tuple(self._table_versions.get(table, 0) for table in tables)
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry['size']
+
+    def get_or_load(self, query: str, params: Optional[Sequence], tables: Optional[List[str]],
+                    loader: Callable[[], List[Dict]]) -> List[Dict]:
+        key = make_key(query, params)
+        tables = sorted({normalize_table_name(t) for t in tables}) if tables else extract_tables(query)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                fresh = (
+                    entry['versions'] == self._versions_for(entry['tables'])
+                    and time.monotonic() - entry['stored_at'] < self.ttl_seconds
+                )
+                if fresh:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return [dict(row) for row in entry['rows']]
+                self._drop(key)
+                self.invalidations += 1
+            self.misses += 1
+            # Snapshot versions before loading so a change during execution marks the result stale
+            versions = self._versions_for(tables)
+
+        rows = loader()
+        size = len(json.dumps(rows, default=str)) + len(key)
+
+        if size > self.max_bytes:
+            return rows
+
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = {
+                'rows': [dict(row) for row in rows],
+                'tables': tables,
+                'versions': versions,
+                'size': size,
+                'stored_at': time.monotonic()
+            }
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+        return rows
+
+    def bump_table_version(self, table: str) -> int:
+        table = normalize_table_name(table)
+        with self._lock:
+            self._table_versions[table] = self._table_versions.get(table, 0) + 1
+            return self._table_versions[table]
+
+    def get_table_version(self, table: str) -> int:
+        with self._lock:
+            return self._table_versions.get(normalize_table_name(table), 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'table_versions': dict(self._table_versions)
+            }
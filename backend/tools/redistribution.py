@@ -0,0 +1,379 @@
+from typing import Dict, List, Optional, Tuple
+from bisect import bisect_right
+from datetime import date
+import logging
+import time
+from tools.sql_executor import run_sql_query
+from tools.dynamic_schema import get_dynamic_schema, find_column
+from tools.batch_query import to_date, to_number
+from tools.telemetry import span
+from tools import lane_index
+from tools.approval_matrix import approvals
+from config import (
+    REDISTRIBUTION_HORIZON_WEEKS, REDISTRIBUTION_MIN_SHELF_DAYS, REDISTRIBUTION_DEFAULT_LEAD_DAYS,
+    REDISTRIBUTION_SOLVER
+)
+
+logger = logging.getLogger(__name__)
+
+SOLVERS = ['greedy', 'flow']
+# Demand is extrapolated from the last 28 days; beyond two years the plan means nothing
+MAX_HORIZON_WEEKS = 104
+# Flow costs: a unit that fills a shortfall is worth far more than any lead time, and moving a unit
+# that would otherwise expire is preferred over moving long-dated excess
+SHORTFALL_REWARD = 10000
+EXPIRY_REWARD = 1000
+
+def load_lots(trial_id: Optional[str] = None) -> List[Dict]:
+    schema = get_dynamic_schema('available_inventory_report')
+    if not schema['exists']:
+        raise RuntimeError('Table available_inventory_report not found')
+    table = schema['table_name']
+    columns = {
+        'batch_id': find_column(table, ['batch', 'lot']),
+        'trial_id': find_column(table, ['trial', 'study']),
+        'country': find_column(table, ['country', 'location', 'site']),
+        'material_id': find_column(table, ['material', 'product', 'item']),
+        'quantity': find_column(table, ['available_quantity', 'qty', 'quantity']),
+        'expiry_date': find_column(table, ['expiry', 'expiration'])
+    }
+    missing = [name for name in ('batch_id', 'country', 'quantity', 'expiry_date') if not columns[name]]
+    if missing:
+        raise RuntimeError(f"available_inventory_report lacks columns for: {', '.join(missing)}")
+    select = ', '.join(
+        f'"{column}"::text AS {name}' if name != 'expiry_date' else f'"{column}"::date AS {name}'
+        for name, column in columns.items() if column
+    )
+    query = f"""
+    SELECT {select}
+    FROM "{table}"
+    WHERE "{columns['quantity']}" > 0 AND "{columns['expiry_date']}"::date > CURRENT_DATE
+    """
+    params = None
+    if trial_id and columns['trial_id']:
+        query += f' AND "{columns["trial_id"]}" ILIKE %s'
+        params = (f'%{trial_id}%',)
+    return run_sql_query(query, params)
+
+def load_demand(trial_id: Optional[str] = None) -> Dict[Tuple[str, str], Dict]:
+    """Weekly consumption per (trial, country), as DemandAgent computes it from the last 28 days."""
+    schema = get_dynamic_schema('enrollment_rate_report')
+    if not schema['exists']:
+        return {}
+    table = schema['table_name']
+    country = find_column(table, ['country', 'location', 'site'])
+    trial = find_column(table, ['trial', 'study'])
+    rate = find_column(table, ['enrollment_rate', 'rate', 'enrollment', 'enrolled', 'patients'])
+    dated = find_column(table, ['date', 'week', 'period', 'month'])
+    if not all([country, trial, rate, dated]):
+        return {}
+    query = f"""
+    SELECT "{trial}"::text AS trial_id, "{country}"::text AS country, AVG("{rate}") * 7 AS weekly_consumption
+    FROM "{table}"
+    WHERE "{dated}"::date >= CURRENT_DATE - INTERVAL '28 days'
+    """
+    params = None
+    if trial_id:
+        query += f' AND "{trial}" ILIKE %s'
+        params = (f'%{trial_id}%',)
+    query += ' GROUP BY 1, 2'
+    demand = {}
+    for row in run_sql_query(query, params):
+        row['weekly_consumption'] = to_number(row['weekly_consumption']) or 0.0
+        demand[(row['trial_id'].strip().lower(), row['country'].strip().lower())] = row
+    return demand
+
+def simulate_sites(lots: List[Dict], demand: Dict, horizon_days: int) -> Dict:
+    """First-expiry-first-out consumption per (trial, country) site over the horizon.
+    
+    Each lot is split into what the site consumes before it expires, what expires unused within the
+    horizon (waste) and what is simply not needed within the horizon (excess). Sites with demand left
+    uncovered get a shortfall.
+    """
+    sites = {}
+    for lot in lots:
+        key = ((lot.get('trial_id') or '').strip().lower(), lot['country'].strip().lower())
+        site = sites.get(key)
+        if site is None:
+            weekly = demand[key]['weekly_consumption'] if key in demand else 0.0
+            site = sites[key] = {'trial_id': lot.get('trial_id'), 'country': lot['country'].strip(), 'lots': [],
+                                 'daily': weekly / 7}
+        site['lots'].append(lot)
+    # Sites with enrollment but no stock at all
+    for key, row in demand.items():
+        if key not in sites and row['weekly_consumption'] > 0:
+            sites[key] = {'trial_id': row['trial_id'], 'country': row['country'].strip(), 'lots': [],
+                          'daily': row['weekly_consumption'] / 7}
+    
+    for site in sites.values():
+        consumed = 0.0
+        need = site['daily'] * horizon_days
+        site['consumed_days'], site['consumed_by'] = [], []
+        for lot in sorted(site['lots'], key=lambda item: item['days_left']):
+            capacity = min(site['daily'] * lot['days_left'], need) - consumed
+            used = max(0.0, min(lot['quantity'], capacity))
+            consumed += used
+            leftover = lot['quantity'] - used
+            lot['waste'] = leftover if lot['days_left'] <= horizon_days else 0.0
+            lot['excess'] = leftover - lot['waste']
+            site['consumed_days'].append(lot['days_left'])
+            site['consumed_by'].append(consumed)
+        site['shortfall'] = max(0.0, need - consumed)
+        site['need'] = need
+    return sites
+
+def _own_consumption_before(site: Dict, days_left: float) -> float:
+    """Units the site consumes from its own lots expiring no later than `days_left` (FEFO order)."""
+    position = bisect_right(site['consumed_days'], days_left)
+    return site['consumed_by'][position - 1] if position else 0.0
+
+class _LeadTimes:
+    def __init__(self):
+        self._cache = {}
+        self.fallbacks = 0
+    
+    def __call__(self, origin: str, destination: str) -> float:
+        key = (origin.lower(), destination.lower())
+        if key not in self._cache:
+            days = None
+            try:
+                route = lane_index.best_route(destination, origin)
+                if route is not None:
+                    days = route['p90_days']
+                else:
+                    # Lanes start at depots; without a country-to-country lane use the destination's inbound p90
+                    summary = lane_index.destination_summary(destination)
+                    days = summary['p90_days'] if summary else None
+            except Exception as e:
+                logger.debug("Lane index unavailable for %s -> %s: %s", origin, destination, e)
+            if days is None:
+                self.fallbacks += 1
+                days = REDISTRIBUTION_DEFAULT_LEAD_DAYS
+            self._cache[key] = days
+        return self._cache[key]
+
+class _Approvals:
+    def __init__(self):
+        self._cache = {}
+        try:
+            approvals.ensure_fresh()
+            # Without any RIM data every transfer would be refused; plan unchecked instead
+            self.enabled = approvals.stats()['materials'] > 0
+        except Exception as e:
+            logger.warning("Approval matrix unavailable; transfers are not checked for approval: %s", e)
+            self.enabled = False
+    
+    def __call__(self, material: Optional[str], country: str) -> bool:
+        if not self.enabled or not material:
+            return True
+        key = (material.lower(), country.lower())
+        if key not in self._cache:
+            result = approvals.check_material(material, [country])
+            self._cache[key] = bool(result and result['approved_in_all'])
+        return self._cache[key]
+
+def _candidates(sites: Dict, lead_time: _LeadTimes, approved: _Approvals) -> List[Tuple[Dict, List[Tuple[float, Dict]]]]:
+    """Movable lots, earliest expiry first, each with its feasible destination sites by lead time."""
+    receivers = {}
+    for (trial, _), site in sites.items():
+        if site['shortfall'] > 0:
+            receivers.setdefault(trial, []).append(site)
+    
+    candidates = []
+    movable = [
+        (lot, site) for site in sites.values() for lot in site['lots'] if lot['waste'] + lot['excess'] >= 1
+    ]
+    for lot, source in sorted(movable, key=lambda item: item[0]['days_left']):
+        options = []
+        for site in receivers.get((lot.get('trial_id') or '').strip().lower(), ()):
+            if site is source or not approved(lot.get('material_id'), site['country']):
+                continue
+            lead = lead_time(source['country'], site['country'])
+            if lot['days_left'] - lead >= REDISTRIBUTION_MIN_SHELF_DAYS:
+                options.append((lead, site))
+        if options:
+            options.sort(key=lambda option: option[0])
+            candidates.append(((lot, source), options))
+    return candidates
+
+def _arrival_capacity(lot: Dict, site: Dict, lead: float, received: float) -> float:
+    # Units the site can still consume from this lot between arrival and expiry
+    window = site['daily'] * (lot['days_left'] - lead)
+    return window - _own_consumption_before(site, lot['days_left']) - received
+
+def solve_greedy(candidates: List, sites: Dict) -> List[Dict]:
+    """Earliest-expiring stock first, each unit to the nearest site that can consume it before expiry."""
+    remaining = {id(site): site['shortfall'] for site in sites.values()}
+    received = {id(site): 0.0 for site in sites.values()}
+    transfers = []
+    for (lot, source), options in candidates:
+        available = lot['waste'] + lot['excess']
+        for lead, site in options:
+            if available < 1:
+                break
+            capacity = min(remaining[id(site)], _arrival_capacity(lot, site, lead, received[id(site)]))
+            quantity = int(min(available, capacity))
+            if quantity < 1:
+                continue
+            available -= quantity
+            remaining[id(site)] -= quantity
+            received[id(site)] += quantity
+            transfers.append(_transfer(lot, source, site, lead, quantity))
+    return transfers
+
+def _site_windows(candidates: List) -> Dict[int, List[Tuple[Tuple[float, float], float]]]:
+    """Per receiving site: (expiry day, lead) arrival slots, ordered as a chain, each with a cumulative cap.
+    
+    A lot expiring on day d that arrives after `lead` days can only be used in between, on top of the
+    site's own lots expiring by then; the cap bounds everything received up to that slot in the chain.
+    Slots sharing an expiry day put the longest lead first, where fewer units have accumulated.
+    """
+    slots, by_id = {}, {}
+    for (lot, _), options in candidates:
+        for lead, site in options:
+            by_id[id(site)] = site
+            slots.setdefault(id(site), set()).add((lot['days_left'], lead))
+    return {
+        key: [((days, lead), by_id[key]['daily'] * (days - lead) - _own_consumption_before(by_id[key], days))
+              for days, lead in sorted(site_slots, key=lambda slot: (slot[0], -slot[1]))]
+        for key, site_slots in slots.items()
+    }
+
+def solve_flow(candidates: List, sites: Dict) -> List[Dict]:
+    """Global min-cost flow over the same candidate arcs (requires networkx).
+    
+    Each receiving site is a chain of arrival slots (see `_site_windows`). A lot enters the slot of its
+    expiry day and lead, and every chain edge is capped by what the site can consume up to that slot, so
+    lots sharing a site cannot together deliver more than it uses before they expire.
+    """
+    import networkx as nx
+    graph = nx.DiGraph()
+    windows = _site_windows(candidates)
+    total = 0
+    for index, ((lot, source), options) in enumerate(candidates):
+        supply = int(lot['waste'] + lot['excess'])
+        if supply < 1:
+            continue
+        total += supply
+        graph.add_edge('source', ('lot', index), capacity=supply, weight=0)
+        # Stock that stays put; costs nothing here, the rewards on the other arcs make moving preferable
+        graph.add_edge(('lot', index), 'sink', capacity=supply, weight=0)
+        reward = EXPIRY_REWARD if lot['waste'] >= 1 else 0
+        for lead, site in options:
+            capacity = int(min(supply, _arrival_capacity(lot, site, lead, 0.0)))
+            if capacity >= 1:
+                graph.add_edge(('lot', index), ('site', id(site), lot['days_left'], lead), capacity=capacity,
+                               weight=int(round(lead)) - reward)
+    for site in sites.values():
+        chain = windows.get(id(site))
+        if site['shortfall'] < 1 or not chain:
+            continue
+        for position, (slot, window) in enumerate(chain):
+            node = ('site', id(site)) + slot
+            if position + 1 < len(chain):
+                graph.add_edge(node, ('site', id(site)) + chain[position + 1][0],
+                               capacity=max(0, int(window)), weight=0)
+            else:
+                graph.add_edge(node, 'sink', capacity=max(0, int(min(window, site['shortfall']))),
+                               weight=-SHORTFALL_REWARD)
+    if not total:
+        return []
+    graph.nodes['source']['demand'] = -total
+    graph.nodes['sink']['demand'] = total
+    flow = nx.min_cost_flow(graph)
+    
+    # Re-check each arc with the same received accounting as the greedy solver, in the same expiry order;
+    # lots expiring on the same day can be ordered differently in the chain
+    by_id = {id(site): site for site in sites.values()}
+    remaining = {id(site): site['shortfall'] for site in sites.values()}
+    received = {id(site): 0.0 for site in sites.values()}
+    transfers = []
+    for index, ((lot, source), options) in enumerate(candidates):
+        leads = {id(site): lead for lead, site in options}
+        for node, quantity in flow.get(('lot', index), {}).items():
+            if node == 'sink' or quantity < 1:
+                continue
+            site, lead = by_id[node[1]], leads[node[1]]
+            quantity = int(min(quantity, remaining[id(site)], _arrival_capacity(lot, site, lead, received[id(site)])))
+            if quantity >= 1:
+                remaining[id(site)] -= quantity
+                received[id(site)] += quantity
+                transfers.append(_transfer(lot, source, site, lead, quantity))
+    return transfers
+
+def _transfer(lot: Dict, source: Dict, site: Dict, lead: float, quantity: int) -> Dict:
+    return {
+        'batch_id': lot['batch_id'],
+        'trial_id': lot.get('trial_id'),
+        'material_id': lot.get('material_id'),
+        'from_country': source['country'],
+        'to_country': site['country'],
+        'quantity': quantity,
+        'lead_days': lead,
+        'expiry_date': lot['expiry_date'].isoformat(),
+        'days_left_on_arrival': round(lot['days_left'] - lead, 1),
+        'reason': 'expiring' if lot['waste'] >= 1 else 'excess'
+    }
+
+def build_plan(trial_id: Optional[str] = None, solver: Optional[str] = None,
+               horizon_weeks: Optional[int] = None) -> Dict:
+    """Transfer plan that moves stock which would expire unused, or is not needed, to sites short of stock.
+    
+    `solver` is 'greedy' (default) or 'flow'; 'flow' falls back to greedy when networkx is not installed.
+    """
+    started = time.perf_counter()
+    solver = (solver or REDISTRIBUTION_SOLVER).lower()
+    if solver not in SOLVERS:
+        raise ValueError(f"solver must be one of {', '.join(SOLVERS)}")
+    horizon_days = int((horizon_weeks or REDISTRIBUTION_HORIZON_WEEKS) * 7)
+    today = date.today()
+    
+    with span('redistribution_load'):
+        rows, demand = load_lots(trial_id), load_demand(trial_id)
+    lots = []
+    for row in rows:
+        expiry, quantity = to_date(row['expiry_date']), to_number(row['quantity'])
+        if expiry is None or not quantity or not row.get('country'):
+            continue
+        row.update({'expiry_date': expiry, 'quantity': quantity, 'days_left': (expiry - today).days})
+        lots.append(row)
+    
+    with span('redistribution_solve', lots=len(lots)):
+        sites = simulate_sites(lots, demand, horizon_days)
+        lead_time, approved = _LeadTimes(), _Approvals()
+        candidates = _candidates(sites, lead_time, approved)
+        used = solver
+        if solver == 'flow':
+            try:
+                transfers = solve_flow(candidates, sites)
+            except ImportError:
+                logger.warning("networkx is not installed; using the greedy solver")
+                used = 'greedy'
+                transfers = solve_greedy(candidates, sites)
+        else:
+            transfers = solve_greedy(candidates, sites)
+    
+    moved_waste = sum(t['quantity'] for t in transfers if t['reason'] == 'expiring')
+    received = sum(t['quantity'] for t in transfers)
+    waste_before = sum(lot['waste'] for lot in lots)
+    shortfall_before = sum(site['shortfall'] for site in sites.values())
+    transfers.sort(key=lambda t: (t['expiry_date'], t['batch_id'], t['to_country']))
+    return {
+        'generated_at': today.isoformat(),
+        'solver': used,
+        'horizon_weeks': horizon_days / 7,
+        'summary': {
+            'lots': len(lots),
+            'sites': len(sites),
+            'transfers': len(transfers),
+            'units_moved': received,
+            'expected_waste_before': round(waste_before),
+            'expected_waste_after': round(max(0.0, waste_before - moved_waste)),
+            'stockout_units_before': round(shortfall_before),
+            'stockout_units_after': round(max(0.0, shortfall_before - received)),
+            'lead_time_fallbacks': lead_time.fallbacks,
+            'approval_checked': approved.enabled,
+            'solve_ms': round((time.perf_counter() - started) * 1000, 1)
+        },
+        'transfers': transfers
+    }
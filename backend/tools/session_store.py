@@ -0,0 +1,173 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict, deque
+import copy
+import json
+import threading
+import time
+
+# Follow-up turns kept per session for context
+MAX_TURNS = 10
+# Agent result sets kept per session; the oldest is dropped first
+MAX_RESULTS_PER_SESSION = 8
+
+def clean_entities(entities: Optional[Dict]) -> Dict[str, str]:
+    return {
+        key: str(value).strip()
+        for key, value in (entities or {}).items()
+        if value not in (None, '', 'null')
+    }
+
+def filter_rows(rows: List[Dict], columns: Dict[str, str], entities: Dict[str, str]) -> List[Dict]:
+    """Apply the agents' ILIKE '%value%' entity filters to rows already in memory."""
+    for key, value in entities.items():
+        column = columns.get(key)
+        if column:
+            needle = value.lower()
+            rows = [row for row in rows if needle in str(row.get(column) or '').lower()]
+    return rows
+
+class SessionStore:
+    """Per-session conversational state: recent turns, last intent/entities and agent result sets.
+    
+    Sessions are evicted least-recently-used past `max_sessions`, after `ttl_seconds` idle, and when
+    the estimated size of all stored result sets exceeds `max_bytes`. Result sets are only reused for
+    `result_ttl_seconds`, so follow-ups never see data much older than the SQL cache would serve.
+    """
+    
+    def __init__(self, max_sessions: int, ttl_seconds: int, result_ttl_seconds: int, max_bytes: int):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.result_hits = 0
+        self.filtered_hits = 0
+        self.evictions = 0
+    
+    def _new_session(self) -> Dict:
+        return {'turns': deque(maxlen=MAX_TURNS), 'intent': None, 'entities': {},
+                'results': OrderedDict(), 'size': 0, 'touched': time.monotonic()}
+    
+    def _drop(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session:
+            self._bytes -= session['size']
+    
+    def _get(self, session_id: str, create: bool = False) -> Optional[Dict]:
+        session = self._sessions.get(session_id)
+        if session is not None and time.monotonic() - session['touched'] > self.ttl_seconds:
+            self._drop(session_id)
+            session = None
+        if session is None and create:
+            session = self._sessions[session_id] = self._new_session()
+        if session is not None:
+            session['touched'] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+    
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for session_id in [sid for sid, s in self._sessions.items() if now - s['touched'] > self.ttl_seconds]:
+            self._drop(session_id)
+            self.evictions += 1
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._sessions)))
+            self.evictions += 1
+    
+    def context(self, session_id: str) -> Tuple[Optional[str], Dict[str, str]]:
+        """Last intent and entities of the session, for resolving elliptical follow-ups."""
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                return None, {}
+            return session['intent'], dict(session['entities'])
+    
+    def record_turn(self, session_id: str, query: str, intent: str, entities: Dict) -> None:
+        with self._lock:
+            session = self._get(session_id, create=True)
+            session['intent'] = intent
+            session['entities'] = clean_entities(entities)
+            session['turns'].append({'query': query, 'intent': intent, 'entities': session['entities'],
+                                     'at': time.time()})
+            self._evict()
+    
+    def find_result(self, session_id: str, intent: str, entities: Dict) -> Tuple[Optional[Dict], Optional[List[Dict]]]:
+        """Return (decision, None) for a repeat, (None, rows) when a stored set can be narrowed locally."""
+        wanted = {key: value.lower() for key, value in clean_entities(entities).items()}
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                return None, None
+            for result in reversed(session['results'].values()):
+                if result['intent'] != intent or time.monotonic() - result['stored_at'] > self.result_ttl_seconds:
+                    continue
+                columns = result['columns']
+                stored = {key: value.lower() for key, value in result['entities'].items() if key in columns}
+                requested = {key: value for key, value in wanted.items() if key in columns}
+                if stored == requested:
+                    self.result_hits += 1
+                    return copy.deepcopy(result['decision']), None
+                # A complete set with fewer filters is a superset of the narrower question
+                narrower = all(requested.get(key) == value for key, value in stored.items())
+                if result['complete'] and narrower and all(columns.get(key) for key in requested):
+                    self.filtered_hits += 1
+                    return None, filter_rows(result['rows'], columns, requested)
+        return None, None
+    
+    def store_result(self, session_id: str, intent: str, entities: Dict, decision: Dict,
+                     result_set: Optional[Dict]) -> None:
+        rows = result_set['rows'] if result_set else []
+        entry = {
+            'intent': intent,
+            'entities': clean_entities(entities),
+            'decision': copy.deepcopy(decision),
+            'rows': rows,
+            'columns': {key: column for key, column in (result_set or {}).get('columns', {}).items() if column},
+            'complete': bool(result_set and result_set.get('complete'))
+        }
+        size = len(json.dumps([decision, rows], default=str))
+        if size > self.max_bytes:
+            return
+        entry.update({'size': size, 'stored_at': time.monotonic()})
+        key = (intent, tuple(sorted(entry['entities'].items())))
+        with self._lock:
+            session = self._get(session_id, create=True)
+            previous = session['results'].pop(key, None)
+            if previous:
+                session['size'] -= previous['size']
+                self._bytes -= previous['size']
+            session['results'][key] = entry
+            session['size'] += size
+            self._bytes += size
+            while len(session['results']) > MAX_RESULTS_PER_SESSION:
+                _, oldest = session['results'].popitem(last=False)
+                session['size'] -= oldest['size']
+                self._bytes -= oldest['size']
+            self._evict()
+    
+    def history(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            session = self._get(session_id)
+            return list(session['turns']) if session else []
+    
+    def clear(self, session_id: str) -> bool:
+        with self._lock:
+            present = session_id in self._sessions
+            self._drop(session_id)
+            return present
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_sessions': self.max_sessions,
+                'ttl_seconds': self.ttl_seconds,
+                'result_ttl_seconds': self.result_ttl_seconds,
+                'result_hits': self.result_hits,
+                'filtered_hits': self.filtered_hits,
+                'evictions': self.evictions
+            }
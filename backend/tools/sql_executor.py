@@ -1,16 +1,127 @@
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Sequence
+import csv
+import io
 import psycopg2
-from db.connection import get_connection
+import psycopg2.extensions
+from db.connection import get_read_connection, create_read_connection
+from tools.query_cache import QueryCache, make_key
+from tools.single_flight import SingleFlight
+from tools.telemetry import span
+from config import SQL_CACHE_ENABLED, SQL_CACHE_MAX_MB, SQL_CACHE_TTL_SECONDS, SQL_PAGE_MAX_ROWS, SQL_EXPORT_BATCH_ROWS
 
-def run_sql_query(query: str) -> List[Dict]:
-    conn = get_connection()
+_query_cache = QueryCache(SQL_CACHE_MAX_MB * 1024 * 1024, SQL_CACHE_TTL_SECONDS)
+_query_flights = SingleFlight('sql')
+
+def _execute(query: str, params: Optional[Sequence] = None, primary: bool = False) -> List[Dict]:
+    conn = get_read_connection(primary)
     cursor = conn.cursor()
     
     try:
-        cursor.execute(query)
-        results = cursor.fetchall()
+        with span('sql_execution') as record:
+            cursor.execute(query, params)
+            results = cursor.fetchall()
+            record['rows'] = len(results)
         return [dict(row) for row in results]
     except psycopg2.Error as e:
         raise RuntimeError(f"SQL execution failed: {str(e)}")
     finally:
         cursor.close()
+
+def run_sql_query(query: str, params: Optional[Sequence] = None, cache: bool = False,
+                  tables: Optional[List[str]] = None, primary: bool = False) -> List[Dict]:
+    # Identical statements running concurrently share one execution. Results that get cached are read
+    # from the primary: invalidation follows primary writes, and a lagging replica's result would
+    # otherwise be served for the whole TTL. `primary` does the same for other long-lived results,
+    # e.g. indexes rebuilt on a change-feed event
+    cached = cache and SQL_CACHE_ENABLED
+    primary = primary or cached
+    load = lambda: _query_flights.do((make_key(query, params), primary), lambda: _execute(query, params, primary))
+    if cached:
+        return _query_cache.get_or_load(query, params, tables, load)
+    return load()
+
+def invalidate_tables(tables: List[str]) -> None:
+    for table in tables:
+        _query_cache.bump_table_version(table)
+
+def handle_table_change(event: Dict) -> None:
+    if event['table'] == '*':
+        _query_cache.clear()
+    else:
+        _query_cache.bump_table_version(event['table'])
+
+def clear_query_cache() -> None:
+    _query_cache.clear()
+
+def get_cache_stats() -> Dict:
+    stats = _query_cache.stats()
+    stats['enabled'] = SQL_CACHE_ENABLED
+    stats['coalescing'] = _query_flights.stats()
+    return stats
+
+def wrap_select(query: str, columns: Optional[List[str]] = None) -> str:
+    # User SQL is embedded as a subquery next to bound parameters, so literal % must be escaped
+    inner = query.strip().rstrip(';').replace('%', '%%')
+    projection = ', '.join('"' + column.replace('"', '""') + '"' for column in columns) if columns else '*'
+    return f"SELECT {projection} FROM ({inner}) AS q"
+
+def run_sql_page(query: str, offset: int = 0, limit: int = 100, columns: Optional[List[str]] = None,
+                 with_total: bool = False) -> Dict:
+    """One page of an ad-hoc SELECT, projected to `columns` before rows leave the database."""
+    offset = max(0, int(offset))
+    limit = max(1, min(int(limit), SQL_PAGE_MAX_ROWS))
+    rows = run_sql_query(f"{wrap_select(query, columns)} LIMIT %s OFFSET %s", (limit + 1, offset))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    page = {
+        'data': rows,
+        'row_count': len(rows),
+        'columns': list(rows[0].keys()) if rows else list(columns or []),
+        'offset': offset,
+        'limit': limit,
+        'has_more': has_more,
+        'next_offset': offset + limit if has_more else None
+    }
+    if with_total:
+        page['total_rows'] = run_sql_query(f"SELECT COUNT(*) AS total FROM ({wrap_select(query)}) AS counted", ())[0]['total']
+    return page
+
+def stream_query_csv(query: str, columns: Optional[List[str]] = None,
+                     batch_rows: int = SQL_EXPORT_BATCH_ROWS, statement_timeout_ms: Optional[int] = None) -> Iterator[str]:
+    """CSV chunks from a server-side cursor on a dedicated connection; memory stays at one batch.
+    
+    `statement_timeout_ms` bounds each statement, i.e. the DECLARE and every batch FETCH.
+    """
+    conn = create_read_connection(autocommit=False)
+    finished = False
+    try:
+        if statement_timeout_ms:
+            with conn.cursor() as setup:
+                setup.execute("SET statement_timeout = %s", (statement_timeout_ms,))
+        # Named cursors are server-side; plain tuples avoid building a dict per row
+        cursor = conn.cursor(name='csv_export', cursor_factory=psycopg2.extensions.cursor)
+        cursor.itersize = batch_rows
+        cursor.execute(wrap_select(query, columns), ())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header_written = False
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not header_written:
+                writer.writerow([column[0] for column in cursor.description])
+                header_written = True
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+        cursor.close()
+        finished = True
+    finally:
+        if not finished:
+            # Client went away mid-export; stop the statement instead of waiting for it
+            conn.cancel()
+        conn.rollback()
+        conn.close()
@@ -0,0 +1,220 @@
+from typing import Callable, Dict, Iterator, List, Optional
+import base64
+import contextvars
+import hashlib
+import json
+import logging
+import threading
+import psycopg2
+from db.connection import create_read_connection
+from tools.sql_executor import wrap_select
+from tools.telemetry import span
+from config import (
+    SQL_GUARD_MAX_COST, SQL_GUARD_MAX_ROWS, SQL_GUARD_TIMEOUT_MS, SQL_GUARD_DEFAULT_LIMIT, SQL_PAGE_MAX_ROWS
+)
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE for statements stopped by statement_timeout or pg_cancel_backend
+QUERY_CANCELED = '57014'
+
+class QueryRejectedError(RuntimeError):
+    pass
+
+class QueryCancelledError(RuntimeError):
+    pass
+
+class QueryIdInUseError(ValueError):
+    pass
+
+# query_id -> connection running it, for cancellation
+_running: Dict[str, object] = {}
+_running_lock = threading.Lock()
+
+def encode_more_token(query: str, offset: int, limit: int) -> str:
+    digest = hashlib.sha256(query.strip().encode()).hexdigest()[:16]
+    raw = json.dumps({'q': digest, 'o': offset, 'l': limit}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_more_token(query: str, token: str) -> Dict:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        offset, limit = int(data['o']), int(data['l'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid more_token")
+    if data.get('q') != hashlib.sha256(query.strip().encode()).hexdigest()[:16]:
+        raise ValueError("more_token does not belong to this query")
+    return {'offset': offset, 'limit': limit}
+
+def _plan_estimate(cursor, sql: str, params) -> Dict:
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+    plan = cursor.fetchone()['QUERY PLAN'][0]['Plan']
+    # Under an injected Limit node the child carries the estimate for the unbounded result
+    inner = plan.get('Plans', [plan])[0] if plan.get('Node Type') == 'Limit' else plan
+    return {'cost': plan['Total Cost'], 'rows': inner['Plan Rows']}
+
+def check_plan(cursor, sql: str, params) -> Dict:
+    estimate = _plan_estimate(cursor, sql, params)
+    if estimate['cost'] > SQL_GUARD_MAX_COST:
+        raise QueryRejectedError(
+            f"Query rejected: estimated cost {estimate['cost']:.0f} exceeds limit {SQL_GUARD_MAX_COST:.0f}"
+        )
+    if estimate['rows'] > SQL_GUARD_MAX_ROWS:
+        raise QueryRejectedError(
+            f"Query rejected: estimated {estimate['rows']:.0f} rows exceeds limit {SQL_GUARD_MAX_ROWS:.0f}"
+        )
+    return estimate
+
+def cancel(query_id: str) -> bool:
+    with _running_lock:
+        conn = _running.get(query_id)
+    if conn is None:
+        return False
+    try:
+        conn.cancel()
+    except psycopg2.Error as e:
+        # The statement finished and its connection closed in the meantime
+        logger.info("SQL query %s could not be cancelled: %s", query_id, e)
+        return False
+    logger.info("Cancelled SQL query %s", query_id)
+    return True
+
+def _sql_error(e: psycopg2.Error) -> RuntimeError:
+    if getattr(e, 'pgcode', None) == QUERY_CANCELED:
+        return QueryCancelledError(f"Query cancelled or exceeded statement_timeout ({SQL_GUARD_TIMEOUT_MS} ms)")
+    return RuntimeError(f"SQL execution failed: {str(e)}")
+
+def _release(prepared: Dict) -> None:
+    if prepared['registered']:
+        with _running_lock:
+            _running.pop(prepared['query_id'], None)
+    prepared['cursor'].close()
+    prepared['conn'].close()
+
+def prepare_page(query: str, offset: int = 0, limit: Optional[int] = None, columns: Optional[List[str]] = None,
+                 query_id: Optional[str] = None) -> Dict:
+    """Open a guarded connection for one page and run the plan check; pass the result to run_page().
+    
+    Raises QueryRejectedError before anything executes, so callers can answer with a 4xx, and
+    QueryIdInUseError when `query_id` already names a running query.
+    """
+    offset = max(0, int(offset))
+    limit = max(1, min(int(limit or SQL_GUARD_DEFAULT_LIMIT), SQL_PAGE_MAX_ROWS))
+    conn = create_read_connection()
+    prepared = {
+        'query': query, 'query_id': query_id, 'registered': False, 'conn': conn, 'cursor': conn.cursor(),
+        'sql': f"{wrap_select(query, columns)} LIMIT %s OFFSET %s", 'params': (limit + 1, offset),
+        'offset': offset, 'limit': limit
+    }
+    if query_id:
+        with _running_lock:
+            in_use = query_id in _running
+            if not in_use:
+                _running[query_id] = conn
+        if in_use:
+            _release(prepared)
+            raise QueryIdInUseError(f"A query with id {query_id} is already running")
+        prepared['registered'] = True
+    try:
+        prepared['cursor'].execute("SET statement_timeout = %s", (SQL_GUARD_TIMEOUT_MS,))
+        with span('sql_guard_explain'):
+            prepared['estimate'] = check_plan(prepared['cursor'], prepared['sql'], prepared['params'])
+    except psycopg2.Error as e:
+        _release(prepared)
+        raise _sql_error(e)
+    except BaseException:
+        _release(prepared)
+        raise
+    return prepared
+
+def run_page(prepared: Dict, with_total: bool = False) -> Dict:
+    """Execute a page checked by prepare_page() and release its connection."""
+    query, cursor, limit, offset = prepared['query'], prepared['cursor'], prepared['limit'], prepared['offset']
+    try:
+        with span('sql_execution') as record:
+            cursor.execute(prepared['sql'], prepared['params'])
+            rows = [dict(row) for row in cursor.fetchall()]
+            record['rows'] = len(rows)
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        page = {
+            'data': rows,
+            'row_count': len(rows),
+            'columns': [column[0] for column in cursor.description],
+            'offset': offset,
+            'limit': limit,
+            'has_more': has_more,
+            'next_offset': offset + limit if has_more else None,
+            'more_token': encode_more_token(query, offset + limit, limit) if has_more else None,
+            'estimate': prepared['estimate']
+        }
+        if with_total:
+            count_sql = f"SELECT COUNT(*) AS total FROM ({wrap_select(query)}) AS counted"
+            try:
+                check_plan(cursor, count_sql, ())
+                cursor.execute(count_sql, ())
+                page['total_rows'] = cursor.fetchone()['total']
+            except QueryRejectedError as e:
+                # Paging still works; the client just does not get an exact total
+                page['total_rows'] = None
+                page['total_rows_skipped'] = str(e)
+        return page
+    except psycopg2.Error as e:
+        raise _sql_error(e)
+    finally:
+        _release(prepared)
+
+def guarded_page(query: str, offset: int = 0, limit: Optional[int] = None, columns: Optional[List[str]] = None,
+                 with_total: bool = False, query_id: Optional[str] = None) -> Dict:
+    """Run one page of an ad-hoc SELECT with a plan cost check and statement_timeout on its own connection."""
+    return run_page(prepare_page(query, offset, limit, columns, query_id), with_total)
+
+def check_export(query: str, columns: Optional[List[str]] = None) -> Dict:
+    """Plan check for a CSV export of the whole result; raises QueryRejectedError."""
+    conn = create_read_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET statement_timeout = %s", (SQL_GUARD_TIMEOUT_MS,))
+        with span('sql_guard_explain', export=True):
+            return check_plan(cursor, wrap_select(query, columns), ())
+    except psycopg2.Error as e:
+        raise _sql_error(e)
+    finally:
+        cursor.close()
+        conn.close()
+
+def stream_with_heartbeat(work: Callable[[], Dict], query_id: str, serialize: Callable[[Dict], str],
+                          interval: float = 1.0) -> Iterator[str]:
+    """Run `work` in a thread and stream whitespace until it finishes, then the JSON body.
+    
+    Leading whitespace is valid JSON. A failed heartbeat write means the client disconnected;
+    the generator is closed and the running statement is cancelled.
+    """
+    outcome = {}
+    
+    def run():
+        try:
+            outcome['result'] = work()
+        except QueryRejectedError as e:
+            outcome['result'] = {'success': False, 'error': str(e), 'rejected': True}
+        except QueryCancelledError as e:
+            outcome['result'] = {'success': False, 'error': str(e), 'cancelled': True}
+        except Exception as e:
+            outcome['result'] = {'success': False, 'error': str(e)}
+    
+    # Copy the context so spans and log lines in the worker keep the request id
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(run,), name=f'sql-{query_id}', daemon=True)
+    worker.start()
+    try:
+        while True:
+            worker.join(interval)
+            if not worker.is_alive():
+                break
+            yield ' '
+        yield serialize(outcome['result'])
+    except GeneratorExit:
+        if worker.is_alive():
+            logger.info("Client disconnected; cancelling SQL query %s", query_id)
+            cancel(query_id)
+        raise
@@ -0,0 +1,235 @@
+from typing import Dict, List, Optional
+import json
+import logging
+import re
+import threading
+import time
+from tools.llm_gateway import chat_completion, LLMUnavailableError
+from tools.metrics import counter
+from tools.telemetry import span
+from config import LLM_RESPONSE_FORMAT, LLM_MAX_OUTPUT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Response formats in order of preference; structured_completion falls back along this list when one is rejected
+FORMATS = ['json_schema', 'json_object', 'none']
+CHARS_PER_TOKEN = 3.5
+# maxLength is a hint to most providers, not a limit, so the budget leaves ample headroom over the schema size
+BUDGET_HEADROOM = 2.0
+MIN_TOKEN_BUDGET = 256
+# Cuts at the last comma tried before giving up on a truncated response
+MAX_REPAIR_CUTS = 8
+
+FENCE = re.compile(r'```(?:json)?', re.IGNORECASE)
+TRAILING_COMMA = re.compile(r',\s*([}\]])')
+# A 400 naming one of these is about the requested format, not the prompt or its length
+FORMAT_ERROR = re.compile(r'response_format|json_schema|json_object|structured output', re.IGNORECASE)
+# Rejected formats are retried after this long, in case the rejection was transient or the endpoint changed
+UNSUPPORTED_TTL_SECONDS = 3600
+
+_decoder = json.JSONDecoder()
+_parse_results = counter('llm_structured_output_total')
+# Formats the endpoint has rejected with a 400, per model, with the time of the rejection
+_unsupported: Dict[str, Dict[str, float]] = {}
+_unsupported_lock = threading.Lock()
+
+class StructuredOutputError(ValueError):
+    def __init__(self, message: str, text: str = ''):
+        super().__init__(message)
+        self.text = text
+
+def decision_schema(risk_type: Optional[str] = None, weeks_of_cover: bool = False) -> Dict:
+    """Agent decision shape; source_tables is set by the agent, not generated."""
+    reasoning = {'type': 'string', 'maxLength': 400}
+    return {
+        'type': 'object',
+        'properties': {
+            'decision': {'type': 'string', 'enum': ['YES', 'NO']},
+            'severity': {'type': 'string', 'enum': ['CRITICAL', 'HIGH', 'MEDIUM']},
+            'risk_type': {'type': 'string', 'enum': [risk_type]} if risk_type else {'type': 'string', 'maxLength': 30},
+            'weeks_of_cover': {'type': ['number', 'null']} if weeks_of_cover else {'type': 'null'},
+            'reasoning': {
+                'type': 'object',
+                'properties': {'technical': reasoning, 'regulatory': reasoning, 'logistical': reasoning},
+                'required': ['technical', 'regulatory', 'logistical'],
+                'additionalProperties': False
+            },
+            'recommended_action': {'type': 'string', 'maxLength': 300}
+        },
+        'required': ['decision', 'severity', 'risk_type', 'weeks_of_cover', 'reasoning', 'recommended_action'],
+        'additionalProperties': False
+    }
+
+INTENT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'intent': {'type': 'string', 'enum': ['STOCK', 'DEMAND', 'LOGISTICS', 'REGULATORY', 'QA', 'GENERAL']},
+        'entities': {
+            'type': 'object',
+            'properties': {
+                'trial_id': {'type': ['string', 'null'], 'maxLength': 64},
+                'country': {'type': ['string', 'null'], 'maxLength': 64},
+                'batch_id': {'type': ['string', 'null'], 'maxLength': 64}
+            },
+            'required': ['trial_id', 'country', 'batch_id'],
+            'additionalProperties': False
+        },
+        'confidence': {'type': 'number'}
+    },
+    'required': ['intent', 'entities', 'confidence'],
+    'additionalProperties': False
+}
+
+def token_budget(schema: Dict) -> int:
+    """Upper bound on output tokens for a pretty-printed instance of `schema`."""
+    def size(node: Dict) -> float:
+        kind = node.get('type')
+        if isinstance(kind, list):
+            return max(size(dict(node, type=item)) for item in kind)
+        if 'enum' in node:
+            return max(len(json.dumps(value)) for value in node['enum'])
+        if kind == 'object':
+            # Key, quotes, colon and indentation per property
+            return 4 + sum(len(key) + 12 + size(child) for key, child in node.get('properties', {}).items())
+        if kind == 'array':
+            return 4 + node.get('maxItems', 10) * (size(node.get('items', {})) + 8)
+        if kind == 'string':
+            return node.get('maxLength', 200) + 2
+        if kind in ('number', 'integer'):
+            return 12
+        if kind == 'boolean':
+            return 5
+        return 4
+    return max(MIN_TOKEN_BUDGET, int(size(schema) / CHARS_PER_TOKEN * BUDGET_HEADROOM) + 16)
+
+def _repair(text: str) -> str:
+    """Close strings and containers left open by a truncated response and drop trailing commas."""
+    text = TRAILING_COMMA.sub(r'\1', text.rstrip())
+    closers, in_string, escaped = [], False, False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+        elif char in '}]' and closers:
+            closers.pop()
+    if in_string:
+        text = (text[:-1] if escaped else text) + '"'
+    text = text.rstrip()
+    if text.endswith(','):
+        text = text[:-1]
+    elif text.endswith(':'):
+        text += ' null'
+    return text + ''.join(reversed(closers))
+
+def missing_required(value, schema: Dict, path: str = '') -> List[str]:
+    """Required keys absent from `value`, recursing into nested object properties."""
+    if schema.get('type') != 'object' or not isinstance(value, dict):
+        return []
+    missing = [path + key for key in schema.get('required', []) if key not in value]
+    for key, child in schema.get('properties', {}).items():
+        if key in value:
+            missing.extend(missing_required(value[key], child, f'{path}{key}.'))
+    return missing
+
+def parse_json(text: str, schema: Optional[Dict] = None):
+    """Parse the first JSON value in `text`, ignoring fences and trailing prose, repairing if needed.
+    
+    Repair drops a truncated trailing member, so with `schema` a repaired value that lost required
+    keys is a parse failure rather than a silently incomplete object.
+    """
+    cleaned = FENCE.sub('', text or '').strip()
+    starts = [index for index in (cleaned.find('{'), cleaned.find('[')) if index >= 0]
+    if not starts:
+        _parse_results.inc(outcome='failed')
+        raise StructuredOutputError('No JSON value in LLM response', text)
+    body = cleaned[min(starts):]
+    
+    try:
+        value = _decoder.raw_decode(body)[0]
+        _parse_results.inc(outcome='ok')
+        return value
+    except ValueError:
+        pass
+    
+    candidate = body
+    for _ in range(MAX_REPAIR_CUTS):
+        try:
+            value = _decoder.raw_decode(_repair(candidate))[0]
+        except ValueError:
+            # Usually truncated inside a key or value; retry without the incomplete member
+            cut = candidate.rfind(',')
+            if cut <= 0:
+                break
+            candidate = candidate[:cut]
+            continue
+        missing = missing_required(value, schema) if schema else []
+        if missing:
+            _parse_results.inc(outcome='failed')
+            raise StructuredOutputError(f"Truncated LLM response lacks required keys: {', '.join(missing)}", text)
+        _parse_results.inc(outcome='repaired')
+        logger.debug("Repaired malformed LLM JSON (%s chars dropped)", len(body) - len(candidate))
+        return value
+    _parse_results.inc(outcome='failed')
+    raise StructuredOutputError('Could not parse JSON from LLM response', text)
+
+def _response_format(mode: str, name: str, schema: Dict) -> Optional[Dict]:
+    if mode == 'json_schema':
+        return {'type': 'json_schema', 'json_schema': {'name': name, 'schema': schema}}
+    if mode == 'json_object':
+        return {'type': 'json_object'}
+    return None
+
+def _modes(model: str) -> List[str]:
+    preferred = LLM_RESPONSE_FORMAT if LLM_RESPONSE_FORMAT in FORMATS else 'none'
+    now = time.time()
+    with _unsupported_lock:
+        rejected = _unsupported.get(model, {})
+        for mode in [mode for mode, rejected_at in rejected.items() if now - rejected_at > UNSUPPORTED_TTL_SECONDS]:
+            del rejected[mode]
+        return [mode for mode in FORMATS[FORMATS.index(preferred):] if mode not in rejected]
+
+def _is_format_error(error: Exception) -> bool:
+    cause = error.__cause__
+    if getattr(cause, 'status_code', None) != 400:
+        return False
+    return bool(FORMAT_ERROR.search(f"{cause} {getattr(cause, 'body', '') or ''}"))
+
+def structured_completion(messages: List[Dict], schema: Dict, name: str, model: str,
+                          max_tokens: Optional[int] = None, task: Optional[str] = None):
+    """Chat completion constrained to `schema` where the endpoint supports it, parsed tolerantly."""
+    max_tokens = max_tokens or min(token_budget(schema), LLM_MAX_OUTPUT_TOKENS)
+    modes = _modes(model)
+    for mode in modes:
+        try:
+            text = chat_completion(
+                messages,
+                max_tokens=max_tokens,
+                model=model,
+                response_format=_response_format(mode, name, schema),
+                task=task
+            )
+        except LLMUnavailableError as e:
+            # A 400 about the response_format means the endpoint does not support it; remember and degrade.
+            # Other 400s (context length, a bad prompt) say nothing about the format and are raised
+            if mode != 'none' and _is_format_error(e):
+                logger.warning("Endpoint rejected response_format=%s for %s; falling back", mode, model)
+                with _unsupported_lock:
+                    _unsupported.setdefault(model, {})[mode] = time.time()
+                continue
+            raise
+        with span('json_parsing'):
+            return parse_json(text, schema)
+    raise LLMUnavailableError(f"No supported response format for {model}")
+
+def get_structured_output_stats() -> Dict:
+    with _unsupported_lock:
+        unsupported = {model: sorted(modes) for model, modes in _unsupported.items()}
+    return {'response_format': LLM_RESPONSE_FORMAT, 'unsupported': unsupported}
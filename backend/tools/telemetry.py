@@ -0,0 +1,119 @@
+from typing import Dict, Optional
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import sys
+import time
+import uuid
+from tools.metrics import histogram, counter
+from config import LOG_LEVEL, LOG_FORMAT, OTEL_ENABLED
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_stage_seconds = histogram('pipeline_stage_seconds', STAGE_BUCKETS)
+_stage_items = counter('pipeline_stage_items_total')
+_request_id = contextvars.ContextVar('request_id', default=None)
+_span_labels = contextvars.ContextVar('span_labels', default={})
+
+logger = logging.getLogger(__name__)
+
+_tracer = None
+if OTEL_ENABLED:
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer('clinical_supply_control_tower')
+    except ImportError:
+        logger.warning("OTEL_ENABLED is set but opentelemetry is not installed; tracing disabled")
+
+# Attributes that become metric labels; everything else is only logged/traced
+_LABEL_ATTRIBUTES = ('agent', 'intent')
+# Numeric attributes that are also accumulated as item counters
+_COUNT_ATTRIBUTES = ('rows', 'prompt_tokens', 'completion_tokens')
+
+def new_request_id() -> str:
+    request_id = uuid.uuid4().hex[:12]
+    _request_id.set(request_id)
+    return request_id
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+@contextmanager
+def span(stage: str, **attributes):
+    # Nested spans inherit agent/intent labels from the enclosing span
+    inherited = _span_labels.get()
+    record = {**inherited, **attributes}
+    labels_token = _span_labels.set({key: record[key] for key in _LABEL_ATTRIBUTES if record.get(key)})
+    otel_context = _tracer.start_as_current_span(stage) if _tracer else None
+    otel_span = otel_context.__enter__() if otel_context else None
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield record
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _span_labels.reset(labels_token)
+        labels = {key: record[key] for key in _LABEL_ATTRIBUTES if record.get(key)}
+        _stage_seconds.observe(duration, stage=stage, status=status, **labels)
+        for key in _COUNT_ATTRIBUTES:
+            if isinstance(record.get(key), (int, float)):
+                _stage_items.inc(record[key], stage=stage, kind=key, **labels)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span %s finished in %.1f ms", stage, duration * 1000, extra={
+                'stage': stage, 'duration_ms': round(duration * 1000, 2), 'status': status, **record
+            })
+        
+        if otel_span is not None:
+            otel_span.set_attribute('status', status)
+            for key, value in record.items():
+                if isinstance(value, (str, bool, int, float)):
+                    otel_span.set_attribute(key, value)
+            otel_context.__exit__(None, None, None)
+
+_STANDARD_RECORD_FIELDS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        request_id = get_request_id()
+        if request_id:
+            payload['request_id'] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_FIELDS:
+                payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = get_request_id() or '-'
+        return True
+
+def configure_logging() -> None:
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.addFilter(RequestIdFilter())
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s'))
+    
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+
+def get_stage_stats() -> Dict:
+    return {
+        'stages': _stage_seconds.snapshot(),
+        'items': _stage_items.snapshot()
+    }
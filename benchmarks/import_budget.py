@@ -0,0 +1,61 @@
+import argparse
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+# Imported lazily on first use; pulling them in at boot is a cold-start regression
+DEFERRED_MODULES = ['openai', 'google.generativeai', 'llama_cpp', 'networkx']
+
+def measure(module: str) -> list:
+    env = dict(os.environ)
+    # Keep background workers out of the measurement
+    env.setdefault('CHANGE_FEED_ENABLED', 'false')
+    env.setdefault('AUDIT_PARTITION_MAINTENANCE', 'false')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000
+        })
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser(description='Check backend import time against a budget')
+    parser.add_argument('--module', default='app', help='Module to import from backend/')
+    parser.add_argument('--budget-ms', type=float, default=1000.0)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+    
+    imports = measure(args.module)
+    top_level = [entry for entry in imports if entry['depth'] == 0]
+    total_ms = sum(entry['cumulative_ms'] for entry in top_level)
+    
+    print(f"{'module':<50} {'cumulative ms':>14}")
+    for entry in sorted(top_level, key=lambda e: e['cumulative_ms'], reverse=True)[:args.top]:
+        print(f"{entry['module']:<50} {entry['cumulative_ms']:>14.1f}")
+    print(f"\nTotal import time for {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    
+    loaded = {entry['module'] for entry in imports}
+    eager = [name for name in DEFERRED_MODULES if name in loaded]
+    if eager:
+        print(f"Imported at startup but expected to be lazy: {', '.join(eager)}")
+    
+    if total_ms > args.budget_ms or eager:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from report import summarize, print_table, compare, print_comparison, load_results
+from run_benchmarks import QUERY_TEMPLATES
+from synthetic_data import COUNTRIES
+
+RISK_TYPE_AGENTS = {
+    'EXPIRY': 'Inventory Agent',
+    'INVENTORY': 'Inventory Agent',
+    'SHORTFALL': 'Demand Agent',
+    'DEMAND': 'Demand Agent',
+    'LOGISTICS': 'Logistics Agent',
+    'REGULATORY': 'Regulatory Agent',
+    'QA': 'QA Agent'
+}
+
+def load_records(path: str) -> list:
+    records, skipped = [], 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                skipped += 1
+                continue
+            if not isinstance(record, dict) or not record.get('query'):
+                skipped += 1
+                continue
+            records.append({'query': record['query'], 'intent': str(record.get('intent') or 'UNLABELLED').upper()})
+    if skipped:
+        print(f"Skipped {skipped} lines without a 'query' field in {path}")
+    return records
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(','):
+        intent, _, weight = part.partition('=')
+        weights[intent.strip().upper()] = float(weight or 1)
+    return weights
+
+def synthesize(weights: dict, count: int, rng: random.Random, trials: int = 20, batches: int = 2000) -> list:
+    templates = dict(QUERY_TEMPLATES)
+    unknown = set(weights) - set(templates)
+    if unknown:
+        raise SystemExit(f"Unknown intents in mix: {', '.join(sorted(unknown))}")
+    intents = list(weights)
+    records = []
+    for intent in rng.choices(intents, [weights[i] for i in intents], k=count):
+        records.append({
+            'intent': intent,
+            'query': templates[intent].format(
+                trial=f'TRIAL-{rng.randint(1, trials):03d}',
+                country=rng.choice(COUNTRIES),
+                batch=f'B{rng.randint(1, batches):06d}'
+            )
+        })
+    return records
+
+def send(base_url: str, query: str, timeout: float) -> dict:
+    request = urllib.request.Request(
+        base_url.rstrip('/') + '/api/query',
+        data=json.dumps({'query': query}).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def run(args) -> None:
+    rng = random.Random(args.seed)
+    if args.replay:
+        source = load_records(args.replay)
+        if not source:
+            raise SystemExit(f"No replayable records in {args.replay}")
+        records = [source[i % len(source)] for i in range(args.requests or len(source))]
+    else:
+        records = synthesize(parse_mix(args.mix), args.requests or 500, rng)
+    
+    samples = {}
+    lock = threading.Lock()
+    
+    def record(groups, latency):
+        with lock:
+            for group in groups:
+                bucket = samples.setdefault(group, {'latencies': [], 'errors': 0})
+                if latency is None:
+                    bucket['errors'] += 1
+                else:
+                    bucket['latencies'].append(latency)
+    
+    def fire(entry, scheduled):
+        intent_group = f"intent:{entry['intent']}"
+        try:
+            decision = send(args.base_url, entry['query'], args.timeout)
+        except (urllib.error.URLError, OSError, ValueError):
+            record(['all', intent_group], None)
+            return
+        # Measured from the scheduled arrival so queueing in the generator counts as latency
+        latency = time.perf_counter() - scheduled
+        agent = RISK_TYPE_AGENTS.get(str(decision.get('risk_type', '')).upper(), 'unrouted')
+        if 'error' in decision:
+            record(['all', intent_group, f'agent:{agent}'], None)
+        else:
+            record(['all', intent_group, f'agent:{agent}'], latency)
+    
+    print(f"Sending {len(records)} requests at {args.rps} rps (open loop) to {args.base_url}")
+    started = time.perf_counter()
+    next_arrival = started
+    with ThreadPoolExecutor(max_workers=args.max_in_flight) as pool:
+        for entry in records:
+            next_arrival += rng.expovariate(args.rps)
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, entry, next_arrival)
+    wall = time.perf_counter() - started
+    
+    results = {name: summarize(s['latencies'], s['errors'], wall) for name, s in sorted(samples.items())}
+    for summary in results.values():
+        summary['offered_rps'] = args.rps
+    print()
+    print_table(results)
+    
+    output = args.output if os.path.isabs(args.output) else os.path.join(BENCHMARK_DIR, args.output)
+    with open(output, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(),
+            'settings': {k: v for k, v in vars(args).items() if k not in ('output', 'func')},
+            'results': results
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+
+def compare_runs(args) -> None:
+    comparison = compare(load_results(args.baseline), load_results(args.current), args.threshold)
+    if print_comparison(comparison):
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load generator for /api/query')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    run_parser = subparsers.add_parser('run', help='Generate load against a running backend')
+    run_parser.add_argument('--base-url', default='http://localhost:5000')
+    run_parser.add_argument('--rps', type=float, default=5.0, help='Mean arrival rate (Poisson arrivals)')
+    run_parser.add_argument('--requests', type=int, default=0, help='Total requests (default: replay file length or 500)')
+    run_parser.add_argument('--replay', help='JSONL file of {"query": ..., "intent": ...} records to replay')
+    run_parser.add_argument('--mix', default='STOCK=30,DEMAND=20,LOGISTICS=20,REGULATORY=15,QA=15',
+                            help='Intent weights for synthesized queries when --replay is not given')
+    run_parser.add_argument('--max-in-flight', type=int, default=256, help='Upper bound on concurrent requests')
+    run_parser.add_argument('--timeout', type=float, default=120.0)
+    run_parser.add_argument('--seed', type=int, default=7)
+    run_parser.add_argument('--output', default=f'loadtest_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
+    run_parser.set_defaults(func=run)
+    
+    compare_parser = subparsers.add_parser('compare', help='Compare two load test result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help='Regression threshold in percent')
+    compare_parser.set_defaults(func=compare_runs)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INTENT_KEYWORDS = [
+    ('REGULATORY', ['regulatory', 'approval', 'compliance']),
+    ('QA', ['stability', 're-evaluation', 'extend expiry', 'quality']),
+    ('LOGISTICS', ['shipping', 'shipment', 'lead time', 'logistics']),
+    ('DEMAND', ['demand', 'enrollment', 'forecast', 'shortfall']),
+    ('STOCK', ['stock', 'inventory', 'expiry', 'expiring'])
+]
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    latency_ms = 500.0
+    jitter_ms = 100.0
+    error_rate = 0.0
+    tokens_per_second = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send(200, {'object': 'list', 'data': [{'id': 'mock-model', 'object': 'model'}]})
+        else:
+            self._send(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send(404, {'error': {'message': 'not found'}})
+            return
+        
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        prompt = '\n'.join(str(m.get('content', '')) for m in request.get('messages', []))
+        content = self._completion_for(prompt)
+        completion_tokens = max(1, len(content) // 4)
+        
+        delay = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        if self.tokens_per_second:
+            delay += completion_tokens / self.tokens_per_second
+        time.sleep(delay)
+        
+        if random.random() < self.error_rate:
+            self._send(503, {'error': {'message': 'mock upstream unavailable', 'type': 'server_error'}})
+            return
+        
+        self._send(200, {
+            'id': f'chatcmpl-{uuid.uuid4().hex[:12]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock-model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': max(1, len(prompt) // 4),
+                'completion_tokens': completion_tokens,
+                'total_tokens': max(1, len(prompt) // 4) + completion_tokens
+            }
+        })
+
+    def _completion_for(self, prompt: str) -> str:
+        if '"intent"' in prompt:
+            query_match = re.search(r'User Query:\s*(.*)', prompt)
+            query = (query_match.group(1) if query_match else prompt).lower()
+            intent = next((name for name, words in INTENT_KEYWORDS if any(w in query for w in words)), 'GENERAL')
+            return json.dumps({
+                'intent': intent,
+                'entities': {'trial_id': None, 'country': None, 'batch_id': None},
+                'confidence': 0.9
+            })
+        
+        if 'Return plain text only' in prompt:
+            return 'Mock narrative: risk reviewed, follow the recommended action.'
+        
+        risk_match = re.search(r'"risk_type":\s*"([A-Z]+)"', prompt)
+        return json.dumps({
+            'decision': random.choice(['YES', 'NO']),
+            'severity': random.choice(['CRITICAL', 'HIGH', 'MEDIUM']),
+            'risk_type': risk_match.group(1) if risk_match else 'GENERAL',
+            'weeks_of_cover': None,
+            'reasoning': {
+                'technical': 'Mock technical analysis',
+                'regulatory': 'N/A',
+                'logistical': 'N/A'
+            },
+            'source_tables': [],
+            'recommended_action': 'Mock recommended action'
+        })
+
+def start_server(host: str = '127.0.0.1', port: int = 0, latency_ms: float = 500.0, jitter_ms: float = 100.0,
+                 error_rate: float = 0.0, tokens_per_second: float = 0.0) -> ThreadingHTTPServer:
+    handler = type('ConfiguredMockLLMHandler', (MockLLMHandler,), {
+        'latency_ms': latency_ms,
+        'jitter_ms': jitter_ms,
+        'error_rate': error_rate,
+        'tokens_per_second': tokens_per_second
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI-compatible mock LLM server with configurable latency')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=500.0)
+    parser.add_argument('--jitter-ms', type=float, default=100.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--tokens-per-second', type=float, default=0.0,
+                        help='Add generation time proportional to completion length (0 disables)')
+    args = parser.parse_args()
+    
+    server = start_server(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.tokens_per_second)
+    print(f"Mock LLM listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
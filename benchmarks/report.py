@@ -0,0 +1,68 @@
+from typing import Dict, List, Optional
+import json
+import resource
+import sys
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def summarize(latencies: List[float], errors: int, wall_seconds: float) -> Dict:
+    ordered = sorted(latencies)
+    completed = len(ordered)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': completed + errors,
+        'errors': errors,
+        'throughput_rps': round(completed / wall_seconds, 2) if wall_seconds > 0 else None,
+        'p50_ms': ms(percentile(ordered, 0.50)),
+        'p95_ms': ms(percentile(ordered, 0.95)),
+        'p99_ms': ms(percentile(ordered, 0.99)),
+        'max_ms': ms(ordered[-1] if ordered else None),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def print_table(results: Dict[str, Dict]) -> None:
+    columns = ['requests', 'errors', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb']
+    width = max([len(name) for name in results] + [8])
+    print(f"{'scenario':<{width}}  " + '  '.join(f'{c:>14}' for c in columns))
+    for name, summary in results.items():
+        print(f'{name:<{width}}  ' + '  '.join(f'{str(summary.get(c)):>14}' for c in columns))
+
+def compare(baseline: Dict[str, Dict], current: Dict[str, Dict], threshold_pct: float = 10.0) -> Dict[str, Dict]:
+    comparison = {}
+    for name, now in current.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        row = {}
+        for metric, higher_is_better in (('p50_ms', False), ('p95_ms', False), ('p99_ms', False),
+                                         ('throughput_rps', True), ('peak_rss_mb', False)):
+            old, new = before.get(metric), now.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            regressed = change < -threshold_pct if higher_is_better else change > threshold_pct
+            row[metric] = {'baseline': old, 'current': new, 'change_pct': round(change, 1), 'regressed': regressed}
+        comparison[name] = row
+    return comparison
+
+def print_comparison(comparison: Dict[str, Dict]) -> bool:
+    regressed_any = False
+    for name, metrics in comparison.items():
+        for metric, row in metrics.items():
+            flag = 'REGRESSED' if row['regressed'] else ''
+            regressed_any = regressed_any or row['regressed']
+            print(f"{name:<32} {metric:<16} {row['baseline']:>10} -> {row['current']:>10}  {row['change_pct']:>+7.1f}%  {flag}")
+    return regressed_any
+
+def load_results(path: str) -> Dict[str, Dict]:
+    with open(path) as f:
+        return json.load(f)['results']
@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'backend')
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from report import summarize, print_table, compare, print_comparison, load_results
+from mock_llm_server import start_server
+
+QUERY_TEMPLATES = [
+    ('STOCK', 'Check stock levels for Trial {trial} in {country}'),
+    ('DEMAND', 'What is the enrollment-driven demand forecast for Trial {trial} in {country}?'),
+    ('LOGISTICS', 'Check shipping timelines for {country}'),
+    ('REGULATORY', 'Verify regulatory approval status for {country}'),
+    ('QA', 'Check stability data for batch {batch}')
+]
+
+SQL_QUERIES = [
+    "SELECT * FROM available_inventory_report WHERE country = '{country}' LIMIT 100",
+    "SELECT country, SUM(available_quantity) AS qty FROM available_inventory_report GROUP BY country",
+    "SELECT * FROM rim WHERE country = '{country}'",
+    "SELECT destination, AVG(lead_time_days) FROM ip_shipping_timelines_report GROUP BY destination",
+    "SELECT * FROM \"re-evaluation\" WHERE batch_id = '{batch}'"
+]
+
+def sample_entities(run_sql_query) -> dict:
+    pairs = run_sql_query("SELECT DISTINCT trial_id, country FROM available_inventory_report")
+    batches = run_sql_query("SELECT batch_id FROM available_inventory_report LIMIT 2000")
+    return {
+        'pairs': [(row['trial_id'], row['country']) for row in pairs],
+        'batches': [row['batch_id'] for row in batches]
+    }
+
+def random_entities(vocab: dict, rng: random.Random) -> dict:
+    trial, country = rng.choice(vocab['pairs'])
+    return {'trial_id': trial, 'country': country, 'batch_id': rng.choice(vocab['batches'])}
+
+def run_scenario(name: str, operation, total: int, concurrency: int) -> dict:
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    
+    def one(i):
+        started = time.perf_counter()
+        try:
+            operation(i)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+        except Exception:
+            with lock:
+                errors[0] += 1
+    
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    summary = summarize(latencies, errors[0], time.perf_counter() - wall_start)
+    summary['concurrency'] = concurrency
+    print(f"  {name}: p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms rps={summary['throughput_rps']} errors={summary['errors']}")
+    return summary
+
+def http_post(base_url: str, path: str, payload: dict, timeout: float = 120) -> dict:
+    request = urllib.request.Request(
+        base_url.rstrip('/') + path,
+        data=json.dumps(payload).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks for agents and API endpoints')
+    parser.add_argument('--scenarios', default='agents,query,sql', help='Comma-separated subset of agents,query,sql')
+    parser.add_argument('--concurrency', default='1,8', help='Comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per scenario and concurrency level')
+    parser.add_argument('--llm-latency-ms', type=float, default=300.0)
+    parser.add_argument('--llm-jitter-ms', type=float, default=50.0)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--real-llm', action='store_true', help='Use the configured LLM instead of the local mock')
+    parser.add_argument('--base-url', help='Benchmark a running backend over HTTP instead of in-process')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the SQL result cache')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default=f'benchmark_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    args = parser.parse_args()
+    
+    if not args.real_llm:
+        server = start_server(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, error_rate=args.llm_error_rate)
+        os.environ['LLM_BASE_URL'] = f'http://127.0.0.1:{server.server_address[1]}/v1'
+        os.environ['LLM_API_KEY'] = 'mock'
+        os.environ['LLM_MODEL_NAME'] = 'mock-model'
+    if args.no_cache:
+        os.environ['SQL_CACHE_ENABLED'] = 'false'
+    os.environ.setdefault('CHANGE_FEED_ENABLED', 'false')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    
+    # Backend modules read configuration at import time, so import only after the environment is set
+    os.chdir(BACKEND_DIR)
+    from tools.sql_executor import run_sql_query
+    
+    rng = random.Random(args.seed)
+    vocab = sample_entities(run_sql_query)
+    if not vocab['pairs']:
+        raise SystemExit("No inventory data found; run benchmarks/synthetic_data.py first")
+    
+    scenarios = {s.strip() for s in args.scenarios.split(',')}
+    levels = [int(c) for c in args.concurrency.split(',')]
+    results = {}
+    
+    if 'agents' in scenarios:
+        from agents.router_agent import RouterAgent
+        router = RouterAgent()
+        for intent, _ in QUERY_TEMPLATES:
+            agent_name, agent = router._agent_for(intent)
+            for level in levels:
+                name = f'agent:{intent.lower()}@{level}'
+                results[name] = run_scenario(
+                    name, lambda i, agent=agent: agent.work('', random_entities(vocab, rng)), args.requests, level
+                )
+    
+    if 'query' in scenarios or 'sql' in scenarios:
+        if args.base_url:
+            post = lambda path, payload: http_post(args.base_url, path, payload)
+        else:
+            from app import app
+            local = threading.local()
+            def post(path, payload):
+                if not hasattr(local, 'client'):
+                    local.client = app.test_client()
+                response = local.client.post(path, json=payload)
+                if response.status_code >= 500:
+                    raise RuntimeError(response.get_data(as_text=True)[:200])
+                return response.get_json()
+        
+        def query_payload():
+            entities = random_entities(vocab, rng)
+            _, template = rng.choice(QUERY_TEMPLATES)
+            return {'query': template.format(trial=entities['trial_id'], country=entities['country'], batch=entities['batch_id'])}
+        
+        def sql_payload():
+            entities = random_entities(vocab, rng)
+            return {'query': rng.choice(SQL_QUERIES).format(country=entities['country'], batch=entities['batch_id'])}
+        
+        for level in levels:
+            if 'query' in scenarios:
+                name = f'api:/api/query@{level}'
+                results[name] = run_scenario(name, lambda i: post('/api/query', query_payload()), args.requests, level)
+            if 'sql' in scenarios:
+                name = f'api:/api/sql@{level}'
+                results[name] = run_scenario(name, lambda i: post('/api/sql', sql_payload()), args.requests, level)
+    
+    print()
+    print_table(results)
+    
+    output = os.path.join(BENCHMARK_DIR, args.output) if not os.path.isabs(args.output) else args.output
+    with open(output, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(),
+            'settings': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+            'results': results
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+    
+    if args.baseline:
+        print("\nComparison with baseline:")
+        if print_comparison(compare(load_results(args.baseline), results)):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+COUNTRIES = [
+    'Germany', 'France', 'Spain', 'Italy', 'Poland', 'Netherlands', 'Belgium', 'Austria', 'Sweden', 'Denmark',
+    'United Kingdom', 'Ireland', 'Portugal', 'Czech Republic', 'Hungary', 'Romania', 'Greece', 'Finland',
+    'Norway', 'Switzerland', 'United States', 'Canada', 'Mexico', 'Brazil', 'Argentina', 'Chile', 'Japan',
+    'South Korea', 'Australia', 'India', 'China', 'Singapore', 'South Africa', 'Israel', 'Turkey',
+    'Saint Kitts and Nevis', 'New Zealand', 'Colombia', 'Peru', 'Taiwan'
+]
+DEPOTS = ['Frankfurt Depot', 'Memphis Depot', 'Singapore Depot', 'Sao Paulo Depot', 'Tokyo Depot']
+
+# One entry per table in tools/schema_fetcher.TABLE_REGISTRY, using the table names the agents query
+TABLES = {
+    'affiliate_warehouse_inventory': [
+        ('warehouse_id', 'TEXT'), ('batch_id', 'TEXT'), ('quantity', 'INTEGER'), ('location', 'TEXT')
+    ],
+    'allocated_materials': [
+        ('batch_id', 'TEXT'), ('order_id', 'TEXT'), ('quantity', 'INTEGER'), ('expiry_date', 'DATE')
+    ],
+    'available_inventory_report': [
+        ('trial_id', 'TEXT'), ('country', 'TEXT'), ('batch_id', 'TEXT'), ('material_id', 'TEXT'),
+        ('available_quantity', 'INTEGER'), ('expiry_date', 'DATE')
+    ],
+    'enrollment_rate_report': [
+        ('trial_id', 'TEXT'), ('country', 'TEXT'), ('enrollment_rate', 'NUMERIC'), ('report_date', 'DATE')
+    ],
+    'country_level_enrollment_report': [
+        ('country', 'TEXT'), ('trial_id', 'TEXT'), ('total_enrolled', 'INTEGER'), ('date', 'DATE')
+    ],
+    'distribution_order_report': [
+        ('order_id', 'TEXT'), ('destination', 'TEXT'), ('status', 'TEXT'), ('created_date', 'DATE')
+    ],
+    'ip_shipping_timelines_report': [
+        ('order_id', 'TEXT'), ('origin', 'TEXT'), ('destination', 'TEXT'), ('lead_time_days', 'INTEGER'),
+        ('planned_lead_time_days', 'INTEGER'), ('ship_date', 'DATE')
+    ],
+    'rim': [
+        ('country', 'TEXT'), ('material_id', 'TEXT'), ('approval_status', 'TEXT'), ('approval_date', 'DATE')
+    ],
+    'material_country_requirements': [
+        ('material_id', 'TEXT'), ('country', 'TEXT'), ('required', 'BOOLEAN'), ('compliance_status', 'TEXT')
+    ],
+    're-evaluation': [
+        ('batch_id', 'TEXT'), ('evaluation_date', 'DATE'), ('result', 'TEXT'), ('extended_expiry', 'DATE')
+    ],
+    'qdocs': [
+        ('doc_id', 'TEXT'), ('batch_id', 'TEXT'), ('doc_type', 'TEXT'), ('status', 'TEXT')
+    ],
+    'stability_documents': [
+        ('batch_id', 'TEXT'), ('test_date', 'DATE'), ('stability_status', 'TEXT'), ('notes', 'TEXT')
+    ]
+}
+
+def generate(scale: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    today = date.today()
+    n_trials = max(2, int(20 * scale))
+    n_materials = max(5, int(200 * scale))
+    n_batches = max(10, int(2000 * scale))
+    n_orders = max(20, int(20000 * scale))
+    
+    trials = [f'TRIAL-{i:03d}' for i in range(1, n_trials + 1)]
+    materials = [f'MAT-{i:04d}' for i in range(1, n_materials + 1)]
+    batches = [f'B{i:06d}' for i in range(1, n_batches + 1)]
+    trial_countries = {trial: rng.sample(COUNTRIES, rng.randint(3, 12)) for trial in trials}
+    batch_material = {batch: rng.choice(materials) for batch in batches}
+    orders = [f'ORD-{i:07d}' for i in range(1, n_orders + 1)]
+    
+    rows = {name: [] for name in TABLES}
+    
+    for batch in batches:
+        trial = rng.choice(trials)
+        country = rng.choice(trial_countries[trial])
+        expiry = today + timedelta(days=rng.randint(-10, 720))
+        rows['available_inventory_report'].append(
+            (trial, country, batch, batch_material[batch], rng.randint(0, 5000), expiry)
+        )
+        rows['affiliate_warehouse_inventory'].append(
+            (f'WH-{COUNTRIES.index(country):03d}', batch, rng.randint(0, 5000), country)
+        )
+        rows['stability_documents'].append(
+            (batch, today - timedelta(days=rng.randint(0, 365)),
+             rng.choices(['STABLE', 'INCONCLUSIVE', 'OUT_OF_SPEC'], [85, 10, 5])[0], 'Synthetic stability study')
+        )
+        for _ in range(rng.randint(0, 2)):
+            rows['re-evaluation'].append(
+                (batch, today - timedelta(days=rng.randint(0, 540)),
+                 rng.choices(['PASS', 'FAIL', 'PENDING'], [80, 10, 10])[0], expiry + timedelta(days=180))
+            )
+        for doc_type in rng.sample(['CoA', 'Batch Record', 'Label Approval', 'Deviation'], rng.randint(1, 3)):
+            rows['qdocs'].append(
+                (f'DOC-{len(rows["qdocs"]) + 1:07d}', batch, doc_type, rng.choices(['APPROVED', 'DRAFT'], [90, 10])[0])
+            )
+    
+    for trial, countries in trial_countries.items():
+        for country in countries:
+            enrolled = 0
+            for week in range(12, 0, -1):
+                report_date = today - timedelta(weeks=week)
+                rate = round(max(0.0, rng.gauss(3.0, 1.5)), 2)
+                enrolled += int(rate * 7)
+                rows['enrollment_rate_report'].append((trial, country, rate, report_date))
+                rows['country_level_enrollment_report'].append((country, trial, enrolled, report_date))
+    
+    for material in materials:
+        for country in rng.sample(COUNTRIES, rng.randint(5, 25)):
+            status = rng.choices(['APPROVED', 'PENDING', 'REJECTED'], [85, 12, 3])[0]
+            rows['rim'].append((country, material, status, today - timedelta(days=rng.randint(0, 1000))))
+            rows['material_country_requirements'].append(
+                (material, country, rng.random() < 0.9, rng.choices(['COMPLIANT', 'NON_COMPLIANT'], [92, 8])[0])
+            )
+    
+    for order in orders:
+        destination = rng.choice(COUNTRIES)
+        created = today - timedelta(days=rng.randint(0, 730))
+        origin = rng.choice(DEPOTS)
+        planned = rng.choice([7, 10, 14, 21])
+        actual = max(1, int(rng.gauss(planned * 1.1, planned * 0.35)))
+        rows['distribution_order_report'].append(
+            (order, destination, rng.choices(['DELIVERED', 'IN_TRANSIT', 'CREATED'], [80, 15, 5])[0], created)
+        )
+        rows['ip_shipping_timelines_report'].append((order, origin, destination, actual, planned, created))
+        if rng.random() < 0.3:
+            batch = rng.choice(batches)
+            rows['allocated_materials'].append(
+                (batch, order, rng.randint(10, 500), today + timedelta(days=rng.randint(0, 720)))
+            )
+    
+    return rows
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def load(conn, rows: dict, drop_existing: bool) -> None:
+    cursor = conn.cursor()
+    for table, columns in TABLES.items():
+        cursor.execute("SELECT to_regclass(%s) AS existing", (f'public.{_quote(table)}',))
+        if cursor.fetchone()['existing'] and not drop_existing:
+            raise SystemExit(f"Table {table} already exists; pass --drop-existing to replace it")
+        
+        cursor.execute(f"DROP TABLE IF EXISTS {_quote(table)}")
+        cursor.execute(f"CREATE TABLE {_quote(table)} ({', '.join(f'{c} {t}' for c, t in columns)})")
+        
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows[table])
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {_quote(table)} ({', '.join(c for c, _ in columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+        print(f"  {table}: {len(rows[table])} rows")
+    
+    cursor.execute("ANALYZE")
+    cursor.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Populate the report tables with synthetic clinical supply data')
+    parser.add_argument('--scale', type=float, default=1.0, help='1.0 = 2,000 batches and 20,000 shipments')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--drop-existing', action='store_true', help='Replace tables that already exist')
+    args = parser.parse_args()
+    
+    from db.connection import create_connection
+    
+    print(f"Generating synthetic data (scale={args.scale}, seed={args.seed})...")
+    rows = generate(args.scale, args.seed)
+    conn = create_connection()
+    try:
+        load(conn, rows, args.drop_existing)
+    finally:
+        conn.close()
+    print("Done.")
+
+if __name__ == '__main__':
+    main()
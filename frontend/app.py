@@ -1,10 +1,18 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import math
+import os
+import uuid
 import pandas as pd
 from datetime import datetime
+from urllib.parse import urlencode
 
 API_BASE_URL = "http://localhost:5000/api"
+# Links opened by the user's browser (CSV export) need an address the browser can reach, which may
+# differ from the one this server uses to call the backend
+PUBLIC_API_BASE_URL = os.getenv("PUBLIC_API_BASE_URL", API_BASE_URL).rstrip("/")
 
 st.set_page_config(
     page_title="Clinical Supply Chain Control Tower",
@@ -22,42 +30,107 @@ page = st.sidebar.radio(
     ["System Health", "Agent Query", "SQL Query", "Audit Logs", "About"]
 )
 
+HEALTH_TTL_SECONDS = 15
+SQL_TTL_SECONDS = 60
+AUDIT_TTL_SECONDS = 30
+AUDIT_REFRESH = "60s"
+PAGE_SIZES = [100, 500, 1000, 5000]
+
+class BackendError(Exception):
+    def __init__(self, result, status_code):
+        super().__init__(result.get("error", "Backend request failed"))
+        self.result = result
+        self.status_code = status_code
+
+@st.cache_resource
+def get_session():
+    # One keep-alive connection pool shared by all reruns and browser sessions
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+@st.cache_data(ttl=HEALTH_TTL_SECONDS, show_spinner=False)
 def check_health():
     try:
-        response = requests.get(f"{API_BASE_URL}/health", timeout=5)
+        response = get_session().get(f"{API_BASE_URL}/health", timeout=5)
         return response.json(), response.status_code
     except Exception as e:
         return {"error": str(e)}, 500
 
 def execute_sql(query):
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/sql",
-            json={"query": query},
-            headers={"Content-Type": "application/json"},
-            timeout=30
-        )
+        response = get_session().post(f"{API_BASE_URL}/sql", json={"query": query}, timeout=30)
         return response.json(), response.status_code
     except Exception as e:
         return {"error": str(e)}, 500
 
-def process_query(query):
+@st.cache_data(ttl=SQL_TTL_SECONDS, show_spinner=False)
+def load_sql_page(query, columns, offset, limit, with_total=False):
+    payload = {"query": query, "offset": offset, "limit": limit, "count": with_total}
+    if columns:
+        payload["columns"] = list(columns)
+    try:
+        response = get_session().post(f"{API_BASE_URL}/sql", json=payload, timeout=60)
+        result, status_code = response.json(), response.status_code
+    except Exception as e:
+        result, status_code = {"error": str(e)}, 500
+    if status_code != 200 or not result.get("success"):
+        raise BackendError(result, status_code)
+    return result
+
+@st.cache_data(ttl=SQL_TTL_SECONDS, show_spinner=False)
+def load_sql_frame(query):
+    # Failures raise, so only successful results are cached
+    result, status_code = execute_sql(query)
+    if status_code != 200 or not result.get("success"):
+        raise BackendError(result, status_code)
+    return pd.DataFrame(result.get("data", []))
+
+def process_query(query, session_id=None):
+    payload = {"query": query}
+    if session_id:
+        # Lets the backend resolve follow-ups ("and what about France?") against earlier questions
+        payload["session_id"] = session_id
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/query",
-            json={"query": query},
-            headers={"Content-Type": "application/json"},
-            timeout=60
-        )
+        response = get_session().post(f"{API_BASE_URL}/query", json=payload, timeout=60)
         return response.json(), response.status_code
     except Exception as e:
         return {"error": str(e)}, 500
 
+@st.cache_data(ttl=AUDIT_TTL_SECONDS, show_spinner=False)
+def fetch_audit_page(filters, cursor=None):
+    params = dict(filters, limit=50)
+    if cursor:
+        params["cursor"] = cursor
+    try:
+        response = get_session().get(f"{API_BASE_URL}/audit", params=params, timeout=30)
+        result, status_code = response.json(), response.status_code
+    except Exception as e:
+        result, status_code = {"error": str(e)}, 500
+    if status_code != 200:
+        raise BackendError(result, status_code)
+    return pd.DataFrame(result.get("items", [])), result.get("next_cursor")
+
+@st.cache_data(ttl=AUDIT_TTL_SECONDS, show_spinner=False)
+def fetch_audit_summary(filters):
+    try:
+        response = get_session().get(f"{API_BASE_URL}/audit/summary", params=filters, timeout=30)
+        result, status_code = response.json(), response.status_code
+    except Exception as e:
+        result, status_code = {"error": str(e)}, 500
+    if status_code != 200 or "total" not in result:
+        raise BackendError(result, status_code)
+    return result
+
 if page == "System Health":
     st.header("System Health Check")
     
     if st.button("Check Backend Status", type="primary"):
         with st.spinner("Checking backend status..."):
+            check_health.clear()
             result, status_code = check_health()
             
             if status_code == 200:
@@ -120,14 +193,20 @@ elif page == "Agent Query":
         clear_button = st.button("Clear")
         
     if clear_button:
+        # Start a new conversation
+        st.session_state.pop("agent_session_id", None)
         st.rerun()
     
     if query_button and user_query:
+        session_id = st.session_state.setdefault("agent_session_id", uuid.uuid4().hex)
         with st.spinner("Processing query through AI agents..."):
-            result, status_code = process_query(user_query)
+            result, status_code = process_query(user_query, session_id)
             
             if status_code == 200 and "error" not in result:
                 st.success("Query processed successfully!")
+                session_info = result.get("session") or {}
+                if session_info.get("follow_up"):
+                    st.caption(f"Follow-up resolved as {session_info.get('intent')} for {session_info.get('entities')}")
                 
                 st.divider()
                 
@@ -242,44 +321,95 @@ elif page == "SQL Query":
         if not sql_query.strip().upper().startswith("SELECT"):
             st.error("Only SELECT queries are allowed!")
         else:
+            st.session_state.sql_active_query = sql_query
+            st.session_state.sql_page = 1
+            st.session_state.pop("sql_columns", None)
+    
+    active_query = st.session_state.get("sql_active_query")
+    if active_query:
+        # Only the visible page is fetched; the full result never reaches the browser or this process
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            page_size = st.selectbox(
+                "Rows per page", PAGE_SIZES, index=1, on_change=lambda: st.session_state.update(sql_page=1)
+            )
+        
+        try:
             with st.spinner("Executing query..."):
-                result, status_code = execute_sql(sql_query)
+                first_page = load_sql_page(active_query, (), 0, page_size, with_total=True)
+        except BackendError as e:
+            st.error("Query execution failed!")
+            st.json(e.result)
+            first_page = None
+        
+        if first_page is not None:
+            # None when the backend skipped an over-budget COUNT; pages then follow has_more instead
+            total_rows = first_page.get("total_rows")
+            all_columns = first_page["columns"]
+            with col2:
+                selected_columns = st.multiselect("Columns", all_columns, default=all_columns, key="sql_columns")
+            
+            if total_rows is None:
+                st.success("Query executed successfully! (total row count skipped)")
+                if first_page.get("total_rows_skipped"):
+                    st.caption(first_page["total_rows_skipped"])
+            else:
+                st.success(f"Query executed successfully! ({total_rows} rows)")
+            
+            if total_rows or (total_rows is None and first_page["row_count"]):
+                if total_rows is None:
+                    page_count = None
+                    page_number = st.session_state.get("sql_page", 1)
+                else:
+                    page_count = max(1, math.ceil(total_rows / page_size))
+                    page_number = st.number_input("Page", min_value=1, max_value=page_count, step=1, key="sql_page")
+                offset = (page_number - 1) * page_size
+                projection = tuple(selected_columns) if selected_columns != all_columns else ()
+                
+                try:
+                    result_page = load_sql_page(active_query, projection, offset, page_size)
+                except BackendError as e:
+                    st.error("Failed to load page!")
+                    st.json(e.result)
+                    result_page = None
                 
-                if status_code == 200 and result.get("success"):
-                    st.success(f"Query executed successfully! ({result.get('row_count', 0)} rows)")
+                if result_page is not None:
+                    st.divider()
                     
-                    data = result.get("data", [])
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        st.subheader("Query Results")
+                        if page_count is None:
+                            st.caption(f"Rows {offset + 1}-{offset + result_page['row_count']} (page {page_number})")
+                        else:
+                            st.caption(f"Rows {offset + 1}-{offset + result_page['row_count']} of {total_rows} (page {page_number} of {page_count})")
+                    with col2:
+                        st.metric("Total Rows", total_rows if total_rows is not None else "unknown")
                     
-                    if data:
-                        df = pd.DataFrame(data)
-                        
-                        st.divider()
-                        
-                        col1, col2 = st.columns([3, 1])
+                    df = pd.DataFrame(result_page["data"], columns=result_page["columns"] or None)
+                    st.dataframe(df, use_container_width=True)
+                    
+                    if page_count is None:
+                        col1, col2 = st.columns(2)
                         with col1:
-                            st.subheader("Query Results")
+                            st.button("Previous Page", disabled=page_number <= 1,
+                                      on_click=lambda: st.session_state.update(sql_page=page_number - 1))
                         with col2:
-                            st.metric("Total Rows", len(df))
-                        
-                        st.dataframe(df, use_container_width=True)
-                        
-                        st.divider()
-                        
-                        csv = df.to_csv(index=False)
-                        st.download_button(
-                            label="Download as CSV",
-                            data=csv,
-                            file_name=f"query_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                            mime="text/csv"
-                        )
-                        
-                        with st.expander("View Raw JSON"):
-                            st.json(data)
-                    else:
-                        st.info("Query returned no results.")
-                else:
-                    st.error("Query execution failed!")
-                    st.json(result)
+                            st.button("Next Page", disabled=not result_page.get("has_more"),
+                                      on_click=lambda: st.session_state.update(sql_page=page_number + 1))
+                    
+                    st.divider()
+                    
+                    # The backend streams the CSV from a server-side cursor straight to the browser
+                    export_params = {"query": active_query}
+                    if projection:
+                        export_params["columns"] = ",".join(projection)
+                    st.link_button("Download as CSV", f"{PUBLIC_API_BASE_URL}/sql/export?{urlencode(export_params)}")
+                    
+                    with st.expander("View Raw JSON (current page)"):
+                        st.json(result_page["data"])
+            else:
+                st.info("Query returned no results.")
 
 elif page == "Audit Logs":
     st.header("AI Decision Audit Logs")
@@ -287,61 +417,96 @@ elif page == "Audit Logs":
     
     st.divider()
     
-    audit_query = """
-    SELECT 
-        id,
-        decision_type,
-        decision_json->>'severity' as severity,
-        decision_json->>'decision' as decision,
-        source_tables,
-        timestamp
-    FROM ai_decisions
-    ORDER BY timestamp DESC
-    LIMIT 20
-    """
-    
-    if st.button("Load Recent Decisions", type="primary"):
-        with st.spinner("Loading audit logs..."):
-            result, status_code = execute_sql(audit_query)
-            
-            if status_code == 200 and result.get("success"):
-                data = result.get("data", [])
-                
-                if data:
-                    df = pd.DataFrame(data)
-                    
-                    st.subheader(f"Last {len(df)} Decisions")
-                    
-                    for idx, row in df.iterrows():
-                        with st.expander(
-                            f"Decision #{row['id']} - {row['decision_type']} - {row['timestamp']}"
-                        ):
-                            col1, col2, col3 = st.columns(3)
-                            
-                            with col1:
-                                st.metric("Decision", row['decision'])
-                            with col2:
-                                st.metric("Severity", row['severity'])
-                            with col3:
-                                st.metric("Type", row['decision_type'])
-                            
-                            st.write("**Source Tables:**")
-                            st.code(row['source_tables'])
-                    
-                    st.divider()
-                    
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        label="Download Audit Logs",
-                        data=csv,
-                        file_name=f"audit_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime="text/csv"
-                    )
-                else:
-                    st.info("No audit logs found.")
-            else:
-                st.error("Failed to load audit logs!")
-                st.json(result)
+    with st.form("audit_filters"):
+        col1, col2, col3, col4, col5 = st.columns(5)
+        with col1:
+            decision_type = st.selectbox("Risk Type", ["", "EXPIRY", "SHORTFALL", "LOGISTICS", "REGULATORY", "QA"])
+        with col2:
+            severity = st.selectbox("Severity", ["", "CRITICAL", "HIGH", "MEDIUM", "LOW"])
+        with col3:
+            decision = st.selectbox("Decision", ["", "YES", "NO"])
+        with col4:
+            trial = st.text_input("Trial")
+        with col5:
+            country = st.text_input("Country")
+        load_clicked = st.form_submit_button("Load Decisions", type="primary")
+    
+    audit_params = {
+        "decision_type": decision_type,
+        "severity": severity,
+        "decision": decision,
+        "trial": trial,
+        "country": country
+    }
+    audit_params = {key: value for key, value in audit_params.items() if value}
+    
+    if load_clicked:
+        fetch_audit_page.clear()
+        fetch_audit_summary.clear()
+        st.session_state.audit_filters = audit_params
+        st.session_state.audit_loaded = True
+        st.session_state.audit_pages = 1
+    
+    @st.fragment(run_every=AUDIT_REFRESH)
+    def audit_summary_panel():
+        try:
+            summary = fetch_audit_summary(st.session_state.get("audit_filters", {}))
+        except BackendError as e:
+            st.error("Failed to load audit summary!")
+            st.json(e.result)
+            return
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Matching Decisions", summary["total"])
+        with col2:
+            st.metric("Critical", summary.get("by_severity", {}).get("CRITICAL", 0))
+        with col3:
+            st.metric("High", summary.get("by_severity", {}).get("HIGH", 0))
+        with col4:
+            st.metric("Decision YES", summary.get("by_decision", {}).get("YES", 0))
+        if summary.get("by_type"):
+            st.bar_chart(pd.Series(summary["by_type"], name="decisions"))
+    
+    @st.fragment
+    def audit_table_panel():
+        # Pages are cached per (filters, cursor), so "Load More" only fetches the new page
+        filters = st.session_state.get("audit_filters", {})
+        frames, cursor = [], None
+        try:
+            for _ in range(st.session_state.get("audit_pages", 1)):
+                frame, cursor = fetch_audit_page(filters, cursor)
+                frames.append(frame)
+                if not cursor:
+                    break
+        except BackendError as e:
+            st.error("Failed to load audit logs!")
+            st.json(e.result)
+            return
+        
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if df.empty:
+            st.info("No audit logs found.")
+            return
+        
+        st.subheader(f"{len(df)} Decisions")
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if cursor and st.button("Load More"):
+                st.session_state.audit_pages = st.session_state.get("audit_pages", 1) + 1
+                st.rerun(scope="fragment")
+        with col2:
+            st.download_button(
+                label="Download Audit Logs",
+                data=df.to_csv(index=False),
+                file_name=f"audit_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv"
+            )
+    
+    if st.session_state.get("audit_loaded"):
+        audit_summary_panel()
+        audit_table_panel()
     
     st.divider()
     
@@ -354,17 +519,15 @@ elif page == "Audit Logs":
     
     if st.button("Execute Custom Audit Query"):
         with st.spinner("Executing query..."):
-            result, status_code = execute_sql(custom_audit_query)
-            
-            if status_code == 200 and result.get("success"):
-                data = result.get("data", [])
-                if data:
-                    st.dataframe(pd.DataFrame(data), use_container_width=True)
+            try:
+                df = load_sql_frame(custom_audit_query)
+                if not df.empty:
+                    st.dataframe(df, use_container_width=True)
                 else:
                     st.info("No results found.")
-            else:
+            except BackendError as e:
                 st.error("Query failed!")
-                st.json(result)
+                st.json(e.result)
 
 elif page == "About":
     st.header("About Clinical Supply Chain Control Tower")
@@ -393,6 +556,7 @@ elif page == "About":
     
     with col1:
         if st.button("Test Backend Connection"):
+            check_health.clear()
             result, status = check_health()
             if status == 200:
                 st.success("✅ Backend is running!")
@@ -409,10 +573,15 @@ elif page == "About":
 
 st.sidebar.divider()
 st.sidebar.markdown("### System Status")
-health_result, health_status = check_health()
-if health_status == 200:
-    st.sidebar.success("✅ Backend Online")
-else:
-    st.sidebar.error("❌ Backend Offline")
 
-st.sidebar.markdown(f"**Time:** {datetime.now().strftime('%H:%M:%S')}")
+@st.fragment(run_every=f"{HEALTH_TTL_SECONDS}s")
+def sidebar_status():
+    health_result, health_status = check_health()
+    if health_status == 200:
+        st.success("✅ Backend Online")
+    else:
+        st.error("❌ Backend Offline")
+    st.markdown(f"**Time:** {datetime.now().strftime('%H:%M:%S')}")
+
+with st.sidebar:
+    sidebar_status()